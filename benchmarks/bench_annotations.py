@@ -0,0 +1,36 @@
+"""Lectura, escritura y validación de un fichero con miles de cajas."""
+import os
+
+from etiquetador_core import (
+    LABELS_FOLDER_NAME, AnnotationStore, parse_yolo_line, validate_lines
+)
+from conftest import DENSE_BOX_COUNT, write_dense_labels
+
+def bench_parse_label_file(benchmark, dataset):
+    labels_folder = os.path.join(dataset, LABELS_FOLDER_NAME)
+    # Un almacén nuevo en cada ronda obliga a releer el fichero
+    records = benchmark(lambda: AnnotationStore(labels_folder).records("large.jpg"))
+    assert len(records) == DENSE_BOX_COUNT
+
+def bench_parse_yolo_lines(benchmark, tmp_path):
+    lines = write_dense_labels(str(tmp_path / "labels.txt"), DENSE_BOX_COUNT)
+    parsed = benchmark(lambda: [parse_yolo_line(line) for line in lines])
+    assert None not in parsed
+
+def bench_flush_dense_image(benchmark, tmp_path):
+    labels_folder = str(tmp_path)
+    write_dense_labels(os.path.join(labels_folder, "dense.txt"), DENSE_BOX_COUNT)
+    store = AnnotationStore(labels_folder)
+    records = store.records("dense.jpg")
+
+    def modify_and_flush():
+        # Cambia una caja y escribe el fichero completo de forma atómica
+        store.replace_line("dense.jpg", 0, records[0])
+        return store.flush()
+
+    assert benchmark(modify_and_flush) == []
+
+def bench_validate_lines(benchmark, tmp_path):
+    lines = write_dense_labels(str(tmp_path / "labels.txt"), DENSE_BOX_COUNT)
+    issues, _ = benchmark(validate_lines, lines, {0, 1, 2, 3, 4}, (6000, 4000))
+    assert isinstance(issues, list)
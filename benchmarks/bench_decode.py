@@ -0,0 +1,20 @@
+"""Decodificación de imágenes: completa, reducida a pantalla y sólo cabecera."""
+import os
+
+from PySide6.QtCore import QSize
+
+import etiquetador
+from etiquetador_core import read_image_size
+
+SCREEN_SIZE = QSize(1920, 1080)
+
+def bench_decode_full(benchmark, dataset):
+    image, _ = benchmark(etiquetador.decode_image, os.path.join(dataset, "large.jpg"))
+    assert not image.isNull()
+
+def bench_decode_screen_size(benchmark, dataset):
+    image, original_size = benchmark(etiquetador.decode_image, os.path.join(dataset, "large.jpg"), SCREEN_SIZE)
+    assert image.width() <= SCREEN_SIZE.width() and original_size.width() > image.width()
+
+def bench_header_probe(benchmark, dataset):
+    assert benchmark(read_image_size, os.path.join(dataset, "large.jpg")) == (6000, 4000)
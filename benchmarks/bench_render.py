@@ -0,0 +1,42 @@
+"""Pintado del lienzo con miles de cajas en una ventana 4K, y navegación."""
+from PySide6.QtCore import QPoint, QRect
+
+from conftest import DENSE_BOX_COUNT
+
+def bench_paint_full_canvas(benchmark, labeling_app):
+    image_label = labeling_app.image_label
+    benchmark(image_label.repaint)
+
+def bench_paint_rubber_band(benchmark, labeling_app):
+    # Un fotograma de arrastre: sólo se repinta la zona del rectángulo de dibujo
+    image_label = labeling_app.image_label
+    benchmark(image_label.repaint, QRect(1000, 800, 300, 200))
+
+def bench_rescale_visible_region(benchmark, labeling_app):
+    image_label = labeling_app.image_label
+    center = QPoint(image_label.width() // 2, image_label.height() // 2)
+
+    def zoom_in_and_out():
+        image_label.zoom_at(4.0, center)
+        image_label._ensure_render_cache()
+        image_label.fit_to_window()
+        image_label._ensure_render_cache()
+
+    benchmark(zoom_in_and_out)
+
+def bench_hit_test(benchmark, labeling_app):
+    image_label = labeling_app.image_label
+    points = [QPoint(x, y) for x in range(0, image_label.width(), 97) for y in range(0, image_label.height(), 89)]
+    benchmark(lambda: [image_label.box_at(point) for point in points])
+
+def bench_load_dense_boxes(benchmark, labeling_app):
+    benchmark(labeling_app.load_boxes_for_current_image)
+    assert len(labeling_app.image_label.boxes) == DENSE_BOX_COUNT
+
+def bench_show_image_without_prefetch(benchmark, labeling_app):
+    # Decodificación síncrona en el hilo de la interfaz: el peor caso al navegar
+    def show_uncached():
+        labeling_app.prefetcher.clear()
+        labeling_app.show_current_image()
+
+    benchmark.pedantic(show_uncached, rounds=5, iterations=1)
@@ -0,0 +1,7 @@
+"""Escaneo de una carpeta anidada con 100k imágenes."""
+from etiquetador_core import iter_image_files
+from conftest import SCAN_FILE_COUNT
+
+def bench_scan_100k_files(benchmark, big_folder):
+    files = benchmark.pedantic(lambda: list(iter_image_files(big_folder)), rounds=3, iterations=1)
+    assert len(files) == SCAN_FILE_COUNT
@@ -0,0 +1,86 @@
+"""Datos sintéticos y entorno Qt sin pantalla para la suite de rendimiento.
+
+Los conjuntos se generan una vez por sesión en un directorio temporal: una imagen
+grande, un fichero con miles de cajas y una carpeta anidada con 100k ficheros.
+"""
+import os
+import sys
+import random
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PySide6.QtGui import QImage, QColor, QPainter, QLinearGradient
+from PySide6.QtWidgets import QApplication
+
+from etiquetador_core import LABELS_FOLDER_NAME, format_yolo_line
+
+LARGE_IMAGE_SIZE = (6000, 4000)
+DENSE_BOX_COUNT = 2000
+SCAN_FILE_COUNT = 100_000
+SCAN_FILES_PER_DIR = 1000
+
+def write_dense_labels(path, count, seed=0):
+    rng = random.Random(seed)
+    lines = [format_yolo_line(rng.randrange(5), rng.uniform(0.05, 0.95), rng.uniform(0.05, 0.95),
+                              rng.uniform(0.005, 0.05), rng.uniform(0.005, 0.05)) for _ in range(count)]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("".join(line + "\n" for line in lines))
+    return lines
+
+def make_image(path, width, height):
+    """Degradado con rectángulos para que el JPEG no sea trivial de decodificar."""
+    image = QImage(width, height, QImage.Format.Format_RGB32)
+    painter = QPainter(image)
+    gradient = QLinearGradient(0, 0, width, height)
+    gradient.setColorAt(0, QColor(20, 80, 140))
+    gradient.setColorAt(1, QColor(220, 180, 60))
+    painter.fillRect(image.rect(), gradient)
+    rng = random.Random(1)
+    for _ in range(400):
+        painter.fillRect(rng.randrange(width), rng.randrange(height), rng.randrange(20, 300), rng.randrange(20, 300),
+                         QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    painter.end()
+    image.save(path, quality=90)
+
+@pytest.fixture(scope="session")
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+@pytest.fixture(scope="session")
+def dataset(tmp_path_factory, qapp):
+    """Carpeta con una imagen grande y su fichero de etiquetas denso."""
+    folder = tmp_path_factory.mktemp("dataset")
+    make_image(str(folder / "large.jpg"), *LARGE_IMAGE_SIZE)
+    make_image(str(folder / "next.jpg"), *LARGE_IMAGE_SIZE)
+    os.makedirs(folder / LABELS_FOLDER_NAME)
+    write_dense_labels(str(folder / LABELS_FOLDER_NAME / "large.txt"), DENSE_BOX_COUNT)
+    return str(folder)
+
+@pytest.fixture(scope="session")
+def big_folder(tmp_path_factory):
+    """Árbol de carpetas con 100k ficheros de imagen vacíos (sólo cuenta el escaneo)."""
+    folder = tmp_path_factory.mktemp("scan")
+    for i in range(SCAN_FILE_COUNT):
+        subfolder = folder / f"d{i // SCAN_FILES_PER_DIR:03d}"
+        if i % SCAN_FILES_PER_DIR == 0: os.makedirs(subfolder)
+        open(subfolder / f"img{i:06d}.jpg", 'wb').close()
+    return str(folder)
+
+@pytest.fixture(scope="session")
+def labeling_app(qapp, dataset):
+    """Ventana 4K con la imagen grande abierta y sus cajas cargadas."""
+    import etiquetador
+    window = etiquetador.LabelingApp()
+    window.resize(3840, 2160)
+    window.show()
+    window.open_folder(dataset)
+    deadline = time.monotonic() + 30
+    while (window.folder_scanner is not None or not window.image_label.boxes) and time.monotonic() < deadline:
+        qapp.processEvents()
+    assert len(window.image_label.boxes) == DENSE_BOX_COUNT
+    window.image_label.grab()
+    yield window
+    window.close()
@@ -1,507 +1,2803 @@
-import sys
-import os
-import csv
-from PySide6.QtWidgets import (
-    QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QLabel, QFileDialog, QInputDialog, QMessageBox,
-    QDialog, QListWidget, QListWidgetItem, QDialogButtonBox, QComboBox,
-    QFormLayout, QGroupBox
-)
-from PySide6.QtGui import QPixmap, QPainter, QPen, QFont, QColor
-from PySide6.QtCore import Qt, QRect, QPoint, QSize
-
-# --- Diálogo para Gestionar Clases ---
-
-class ManageLabelsDialog(QDialog):
-    """Ventana para añadir, editar y eliminar las clases de objetos."""
-    def __init__(self, labels, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("Gestionar Etiquetas")
-        self.setMinimumSize(300, 400)
-
-        self.layout = QVBoxLayout(self)
-        self.list_widget = QListWidget()
-        self.original_labels = labels
-        self.current_labels = list(self.original_labels.values())
-        self.list_widget.addItems(self.current_labels)
-        self.layout.addWidget(self.list_widget)
-        
-        button_layout = QHBoxLayout()
-        self.add_button = QPushButton("Añadir")
-        self.edit_button = QPushButton("Editar")
-        self.delete_button = QPushButton("Eliminar")
-        button_layout.addWidget(self.add_button)
-        button_layout.addWidget(self.edit_button)
-        button_layout.addWidget(self.delete_button)
-        self.layout.addLayout(button_layout)
-        
-        self.button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
-        self.layout.addWidget(self.button_box)
-
-        self.add_button.clicked.connect(self.add_label)
-        self.edit_button.clicked.connect(self.edit_label)
-        self.delete_button.clicked.connect(self.delete_label)
-        self.button_box.accepted.connect(self.accept)
-        self.button_box.rejected.connect(self.reject)
-
-    def add_label(self):
-        text, ok = QInputDialog.getText(self, "Añadir Etiqueta", "Nombre de la nueva etiqueta:")
-        if ok and text and text not in self.current_labels:
-            self.current_labels.append(text)
-            self.list_widget.addItem(text)
-
-    def edit_label(self):
-        selected_item = self.list_widget.currentItem()
-        if not selected_item: return
-        old_text = selected_item.text()
-        new_text, ok = QInputDialog.getText(self, "Editar Etiqueta", "Nuevo nombre:", text=old_text)
-        if ok and new_text and new_text != old_text and new_text not in self.current_labels:
-            index = self.current_labels.index(old_text)
-            self.current_labels[index] = new_text
-            selected_item.setText(new_text)
-
-    def delete_label(self):
-        selected_item = self.list_widget.currentItem()
-        if not selected_item: return
-        reply = QMessageBox.question(self, "Eliminar Etiqueta", f"¿Estás seguro de que quieres eliminar '{selected_item.text()}'?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
-        if reply == QMessageBox.StandardButton.Yes:
-            self.current_labels.remove(selected_item.text())
-            self.list_widget.takeItem(self.list_widget.row(selected_item))
-
-    def get_updated_labels(self):
-        return {i: name for i, name in enumerate(self.current_labels)}
-
-# --- Diálogo para Seleccionar Etiqueta (Fallback) ---
-
-class SelectAndConfirmDialog(QDialog):
-    def __init__(self, class_map, yolo_data, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("Asignar Etiqueta")
-        
-        self.class_id = -1
-        self.class_map = class_map
-        
-        layout = QVBoxLayout(self)
-        form_layout = QFormLayout()
-
-        self.class_combo = QComboBox()
-        self.class_combo.addItems(list(class_map.values()))
-        
-        form_layout.addRow("Etiqueta:", self.class_combo)
-        
-        _, x_center, y_center, width, height = yolo_data
-        form_layout.addRow(QLabel("--- Datos YOLOv8 ---"))
-        form_layout.addRow("x_center:", QLabel(f"{x_center:.6f}"))
-        form_layout.addRow("y_center:", QLabel(f"{y_center:.6f}"))
-        form_layout.addRow("width:", QLabel(f"{width:.6f}"))
-        form_layout.addRow("height:", QLabel(f"{height:.6f}"))
-        
-        layout.addLayout(form_layout)
-        
-        self.button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
-        layout.addWidget(self.button_box)
-
-        self.button_box.accepted.connect(self.accept)
-        self.button_box.rejected.connect(self.reject)
-
-    def accept(self):
-        selected_text = self.class_combo.currentText()
-        self.class_id = [k for k, v in self.class_map.items() if v == selected_text][0]
-        super().accept()
-
-# --- Widget de Imagen ---
-
-class ImageLabel(QLabel):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.main_window = parent
-        self.current_pixmap = None
-        self.scale_factor = 1.0
-        self.pixmap_offset = QPoint(0, 0)
-        self.scaled_pixmap_size = QSize()
-        self.boxes = []
-        self.drawing = False
-        self.start_point = QPoint()
-        self.end_point = QPoint()
-        self.selected_box_index = -1
-        self.setMouseTracking(True)
-
-    def setPixmap(self, pixmap):
-        self.current_pixmap = pixmap
-        self.update()
-
-    def load_boxes(self, boxes):
-        self.boxes = boxes
-        self.set_selected_box(-1)
-        self.update()
-
-    def set_selected_box(self, index):
-        self.selected_box_index = index
-        self.update()
-
-    def mousePressEvent(self, event):
-        if event.button() == Qt.MouseButton.LeftButton and self.current_pixmap:
-            self.drawing = True
-            self.start_point = event.pos()
-            self.end_point = event.pos()
-            self.update()
-
-    def mouseMoveEvent(self, event):
-        if self.drawing and self.current_pixmap:
-            self.end_point = event.pos()
-            self.update()
-
-    def mouseReleaseEvent(self, event):
-        if event.button() == Qt.MouseButton.LeftButton and self.drawing:
-            self.drawing = False
-            user_rect_on_widget = QRect(self.start_point, self.end_point).normalized()
-            self.update()
-
-            if not self.current_pixmap or self.current_pixmap.isNull(): return
-
-            image_area_on_widget = QRect(self.pixmap_offset, self.scaled_pixmap_size)
-            clipped_rect_on_widget = user_rect_on_widget.intersected(image_area_on_widget)
-
-            if clipped_rect_on_widget.width() < 5 or clipped_rect_on_widget.height() < 5: return
-            
-            rect_on_image = QRect(clipped_rect_on_widget.topLeft() - self.pixmap_offset, clipped_rect_on_widget.size())
-
-            if self.scale_factor > 0:
-                original_rect = QRect(
-                    int(rect_on_image.left() / self.scale_factor),
-                    int(rect_on_image.top() / self.scale_factor),
-                    int(rect_on_image.width() / self.scale_factor),
-                    int(rect_on_image.height() / self.scale_factor)
-                )
-                self.process_new_box(original_rect)
-
-    def paintEvent(self, event):
-        super().paintEvent(event)
-        if not self.current_pixmap or self.current_pixmap.isNull(): return
-        painter = QPainter(self)
-        
-        scaled_pixmap = self.current_pixmap.scaled(self.size(), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-        
-        self.scaled_pixmap_size = scaled_pixmap.size()
-        self.scale_factor = scaled_pixmap.width() / self.current_pixmap.width() if self.current_pixmap.width() > 0 else 1
-        self.pixmap_offset = QPoint((self.width() - self.scaled_pixmap_size.width()) // 2, (self.height() - self.scaled_pixmap_size.height()) // 2)
-        
-        painter.drawPixmap(self.pixmap_offset, scaled_pixmap)
-
-        pen_saved = QPen(QColor(0, 255, 0), 2, Qt.PenStyle.SolidLine)
-        pen_selected = QPen(QColor(255, 255, 0), 3, Qt.PenStyle.SolidLine)
-        font = QFont("Arial", 10, QFont.Weight.Bold)
-        painter.setFont(font)
-
-        for i, box_data in enumerate(self.boxes):
-            rect_pixels, label = box_data['rect_pixels'], box_data['label']
-            painter.setPen(pen_selected if i == self.selected_box_index else pen_saved)
-
-            scaled_box = QRect(
-                int(rect_pixels.left() * self.scale_factor), int(rect_pixels.top() * self.scale_factor),
-                int(rect_pixels.width() * self.scale_factor), int(rect_pixels.height() * self.scale_factor)
-            )
-            scaled_box.translate(self.pixmap_offset)
-            painter.drawRect(scaled_box)
-            
-            text_point = scaled_box.topLeft()
-            font_metrics = painter.fontMetrics()
-            text_width = font_metrics.horizontalAdvance(label)
-            text_height = font_metrics.height()
-            text_bg_rect = QRect(text_point.x(), text_point.y() - text_height, text_width + 4, text_height)
-            
-            bg_color = QColor(200, 200, 0, 180) if i == self.selected_box_index else QColor(0, 128, 0, 180)
-            painter.fillRect(text_bg_rect, bg_color)
-            painter.setPen(QColor(0,0,0) if i == self.selected_box_index else QColor(255,255,255))
-            painter.drawText(text_point + QPoint(2, -3), label)
-
-        if self.drawing:
-            pen_drawing = QPen(QColor(255, 0, 0), 2, Qt.PenStyle.DashLine)
-            painter.setPen(pen_drawing)
-            painter.drawRect(QRect(self.start_point, self.end_point))
-
-    def process_new_box(self, rect_pixels):
-        class_map = self.main_window.class_map
-        preselected_id = self.main_window.preselected_class_id
-
-        img_w, img_h = self.current_pixmap.width(), self.current_pixmap.height()
-        x_center = (rect_pixels.left() + rect_pixels.width() / 2) / img_w
-        y_center = (rect_pixels.top() + rect_pixels.height() / 2) / img_h
-        width = rect_pixels.width() / img_w
-        height = rect_pixels.height() / img_h
-        
-        if preselected_id != -1:
-            # Flujo rápido con preselección
-            label = class_map[preselected_id]
-            yolo_data = (preselected_id, x_center, y_center, width, height)
-            self.main_window.add_new_box(rect_pixels, label, yolo_data)
-        else:
-            # Flujo normal con diálogo si no hay preselección
-            if not class_map:
-                QMessageBox.warning(self, "Sin Etiquetas", "Añada etiquetas usando 'Gestionar Etiquetas'.")
-                return
-            yolo_data_preview = (-1, x_center, y_center, width, height)
-            dialog = SelectAndConfirmDialog(class_map, yolo_data_preview, self)
-            if dialog.exec():
-                class_id = dialog.class_id
-                label = class_map[class_id]
-                yolo_data = (class_id, x_center, y_center, width, height)
-                self.main_window.add_new_box(rect_pixels, label, yolo_data)
-
-# --- Ventana Principal ---
-
-class LabelingApp(QMainWindow):
-    def __init__(self):
-        super().__init__()
-        self.setWindowTitle("Herramienta de Etiquetado (Formato YOLOv8)")
-        self.setGeometry(100, 100, 1200, 700)
-
-        self.image_folder = ""
-        self.labels_folder = "" # NUEVO: Carpeta para los archivos .txt
-        self.image_files = []
-        self.current_image_index = -1
-        self.class_map = {}
-        self.preselected_class_id = -1
-
-        main_widget = QWidget()
-        self.setCentralWidget(main_widget)
-        main_layout = QHBoxLayout(main_widget)
-
-        # --- Panel Izquierdo ---
-        left_panel = QWidget()
-        left_layout = QVBoxLayout(left_panel)
-        top_bar_layout = QHBoxLayout()
-        
-        self.btn_select_folder = QPushButton("Seleccionar Carpeta")
-        self.btn_manage_labels = QPushButton("Gestionar Etiquetas")
-        self.btn_prev_image = QPushButton("<< Anterior")
-        self.btn_next_image = QPushButton("Siguiente >>")
-        
-        top_bar_layout.addWidget(self.btn_select_folder)
-        top_bar_layout.addWidget(self.btn_manage_labels)
-        top_bar_layout.addStretch()
-        top_bar_layout.addWidget(self.btn_prev_image)
-        top_bar_layout.addWidget(self.btn_next_image)
-
-        self.image_label = ImageLabel(self)
-        self.status_label = QLabel("Selecciona una carpeta para comenzar.")
-        
-        left_layout.addLayout(top_bar_layout)
-        left_layout.addWidget(self.image_label, 1)
-        left_layout.addWidget(self.status_label)
-
-        # --- Panel Derecho ---
-        right_panel = QWidget()
-        right_panel.setFixedWidth(300)
-        right_layout = QVBoxLayout(right_panel)
-        
-        # Grupo de Preselección
-        preselect_group = QGroupBox("Seleccionar Etiqueta")
-        preselect_layout = QVBoxLayout(preselect_group)
-        self.class_selection_list = QListWidget()
-        preselect_layout.addWidget(self.class_selection_list)
-        
-        # Grupo de Etiquetas en Imagen
-        boxes_group = QGroupBox("Etiquetas en Imagen")
-        boxes_layout = QVBoxLayout(boxes_group)
-        self.boxes_list_widget = QListWidget()
-        self.btn_delete_box = QPushButton("Eliminar Etiqueta Seleccionada")
-        boxes_layout.addWidget(self.boxes_list_widget)
-        boxes_layout.addWidget(self.btn_delete_box)
-
-        right_layout.addWidget(preselect_group)
-        right_layout.addWidget(boxes_group)
-
-        main_layout.addWidget(left_panel, 1)
-        main_layout.addWidget(right_panel)
-
-        # --- Estilos ---
-        self.setStyleSheet("""
-            QMainWindow, QWidget { background-color: #2E2E2E; color: #F0F0F0; }
-            QGroupBox { border: 1px solid #555; border-radius: 5px; margin-top: 1ex; }
-            QGroupBox::title { subcontrol-origin: margin; left: 10px; padding: 0 3px 0 3px; }
-            QPushButton { background-color: #555; border: 1px solid #666; padding: 5px; border-radius: 3px; }
-            QPushButton:hover { background-color: #666; }
-            QPushButton:pressed { background-color: #444; }
-            QListWidget { border: 1px solid #555; background-color: #3C3C3C; }
-            QListWidget::item:selected { background-color: #0078D7; color: white; }
-            QLabel { color: #F0F0F0; }
-        """)
-
-        # --- Conexiones ---
-        self.btn_select_folder.clicked.connect(self.select_folder)
-        self.btn_manage_labels.clicked.connect(self.manage_labels)
-        self.btn_prev_image.clicked.connect(self.prev_image)
-        self.btn_next_image.clicked.connect(self.next_image)
-        self.btn_delete_box.clicked.connect(self.delete_selected_box)
-        self.boxes_list_widget.itemSelectionChanged.connect(self.highlight_selected_box)
-        self.class_selection_list.itemSelectionChanged.connect(self.handle_class_preselection)
-
-        self.update_button_states()
-
-    def handle_class_preselection(self):
-        selected_item = self.class_selection_list.currentItem()
-        if selected_item:
-            class_name = selected_item.text()
-            self.preselected_class_id = [k for k, v in self.class_map.items() if v == class_name][0]
-        else:
-            self.preselected_class_id = -1
-    
-    def highlight_selected_box(self):
-        self.image_label.set_selected_box(self.boxes_list_widget.currentRow())
-        self.update_button_states()
-
-    def update_button_states(self):
-        has_images = bool(self.image_files)
-        self.btn_prev_image.setEnabled(has_images and self.current_image_index > 0)
-        self.btn_next_image.setEnabled(has_images and self.current_image_index < len(self.image_files) - 1)
-        self.btn_manage_labels.setEnabled(bool(self.image_folder))
-        self.btn_delete_box.setEnabled(self.boxes_list_widget.currentItem() is not None)
-
-    def select_folder(self):
-        folder = QFileDialog.getExistingDirectory(self, "Seleccionar Carpeta de Imágenes")
-        if folder:
-            self.image_folder = folder
-            # NUEVO: Definir y crear la carpeta de etiquetas
-            self.labels_folder = os.path.join(self.image_folder, "Yolov8")
-            os.makedirs(self.labels_folder, exist_ok=True)
-            
-            self.load_classes()
-            self.load_image_list()
-            if self.image_files:
-                self.current_image_index = 0
-                self.show_current_image()
-            else:
-                QMessageBox.warning(self, "Sin Imágenes", "La carpeta no contiene imágenes (.jpg, .png).")
-                self.image_folder = ""
-            self.update_button_states()
-
-    def load_image_list(self):
-        supported = ('.png', '.jpg', '.jpeg')
-        self.image_files = sorted([f for f in os.listdir(self.image_folder) if f.lower().endswith(supported)])
-    
-    def load_classes(self):
-        path = os.path.join(self.image_folder, "classes.csv")
-        if not os.path.exists(path):
-            self.class_map = {0: "persona", 1: "pez"}
-            self.save_classes()
-        else:
-            try:
-                with open(path, mode='r', newline='', encoding='utf-8') as f:
-                    self.class_map = {int(r[0]): r[1] for r in csv.reader(f)}
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"No se pudo leer 'classes.csv': {e}")
-                self.class_map = {}
-        self.populate_class_selection_list()
-
-    def populate_class_selection_list(self):
-        self.class_selection_list.clear()
-        self.class_selection_list.addItems(list(self.class_map.values()))
-
-    def save_classes(self):
-        path = os.path.join(self.image_folder, "classes.csv")
-        try:
-            with open(path, mode='w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                for class_id, name in self.class_map.items():
-                    writer.writerow([class_id, name])
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"No se pudo guardar 'classes.csv': {e}")
-
-    def manage_labels(self):
-        dialog = ManageLabelsDialog(self.class_map, self)
-        if dialog.exec():
-            self.class_map = dialog.get_updated_labels()
-            self.save_classes()
-            self.populate_class_selection_list()
-
-    def show_current_image(self):
-        if 0 <= self.current_image_index < len(self.image_files):
-            image_path = os.path.join(self.image_folder, self.image_files[self.current_image_index])
-            pixmap = QPixmap(image_path)
-            self.image_label.setPixmap(pixmap)
-            self.status_label.setText(f"Imagen {self.current_image_index + 1}/{len(self.image_files)}: {self.image_files[self.current_image_index]}")
-            self.load_boxes_for_current_image()
-        self.update_button_states()
-
-    def next_image(self):
-        if self.current_image_index < len(self.image_files) - 1:
-            self.current_image_index += 1
-            self.show_current_image()
-
-    def prev_image(self):
-        if self.current_image_index > 0:
-            self.current_image_index -= 1
-            self.show_current_image()
-            
-    def add_new_box(self, rect_pixels, label, yolo_data):
-        yolo_line = f"{yolo_data[0]} {yolo_data[1]:.6f} {yolo_data[2]:.6f} {yolo_data[3]:.6f} {yolo_data[4]:.6f}"
-        self.append_to_yolo_txt(yolo_line)
-        self.load_boxes_for_current_image()
-        
-    def append_to_yolo_txt(self, yolo_line):
-        filename_base = os.path.splitext(self.image_files[self.current_image_index])[0]
-        # MODIFICADO: Usa la carpeta de etiquetas
-        txt_path = os.path.join(self.labels_folder, filename_base + ".txt")
-        try:
-            with open(txt_path, mode='a', encoding='utf-8') as f:
-                f.write(yolo_line + "\n")
-        except IOError as e:
-            QMessageBox.critical(self, "Error de Escritura", f"No se pudo guardar en .txt:\n{e}")
-            
-    def load_boxes_for_current_image(self):
-        boxes = []
-        self.boxes_list_widget.clear()
-        filename_base = os.path.splitext(self.image_files[self.current_image_index])[0]
-        # MODIFICADO: Usa la carpeta de etiquetas
-        txt_path = os.path.join(self.labels_folder, filename_base + ".txt")
-        
-        if os.path.exists(txt_path):
-            try:
-                img_w, img_h = self.image_label.current_pixmap.width(), self.image_label.current_pixmap.height()
-                with open(txt_path, 'r') as f:
-                    for line in f:
-                        if not line.strip(): continue
-                        parts = line.strip().split()
-                        class_id, x_c, y_c, w, h = int(parts[0]), float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4])
-                        
-                        rect = QRect(int((x_c - w/2) * img_w), int((y_c - h/2) * img_h), int(w * img_w), int(h * img_h))
-                        label = self.class_map.get(class_id, f"ID:{class_id}?")
-                        
-                        box_data = {'rect_pixels': rect, 'label': label, 'yolo_line': line.strip()}
-                        boxes.append(box_data)
-
-                        item = QListWidgetItem(f"ID: {class_id} - {label}")
-                        item.setData(Qt.ItemDataRole.UserRole, line.strip())
-                        self.boxes_list_widget.addItem(item)
-            except Exception as e:
-                print(f"Error leyendo el archivo .txt: {e}")
-
-        self.image_label.load_boxes(boxes)
-        self.update_button_states()
-
-    def delete_selected_box(self):
-        selected_item = self.boxes_list_widget.currentItem()
-        if not selected_item: return
-
-        line_to_delete = selected_item.data(Qt.ItemDataRole.UserRole)
-        filename_base = os.path.splitext(self.image_files[self.current_image_index])[0]
-        # MODIFICADO: Usa la carpeta de etiquetas
-        txt_path = os.path.join(self.labels_folder, filename_base + ".txt")
-
-        try:
-            with open(txt_path, 'r') as f: lines = f.readlines()
-            with open(txt_path, 'w') as f:
-                for line in lines:
-                    if line.strip() != line_to_delete: f.write(line)
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"No se pudo modificar el archivo .txt: {e}")
-            return
-        
-        self.load_boxes_for_current_image()
-
-if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = LabelingApp()
-    window.show()
-    sys.exit(app.exec())
+import sys
+import os
+import math
+import json
+import sqlite3
+import hashlib
+import time
+import threading
+import multiprocessing
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PySide6.QtWidgets import (
+    QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
+    QPushButton, QLabel, QFileDialog, QInputDialog, QMessageBox,
+    QDialog, QListWidget, QListWidgetItem, QListView, QDialogButtonBox, QComboBox,
+    QGroupBox, QProgressDialog, QFrame, QLineEdit
+)
+from PySide6.QtGui import QPixmap, QPainter, QPen, QFont, QFontMetrics, QColor, QImage, QImageReader, QImageIOHandler, QKeySequence, QShortcut
+from PySide6.QtCore import (
+    Qt, QRect, QRectF, QPoint, QPointF, QSize, QTimer, QObject, QRunnable, QThread, QThreadPool, Signal,
+    QAbstractListModel, QModelIndex, QEventLoop, QEvent, QFileSystemWatcher
+)
+from etiquetador_core import (
+    LABELS_FOLDER_NAME, CACHE_FOLDER_NAME, CLASSES_FILE_NAME,
+    read_classes, write_classes, list_image_dir, fuzzy_filter, format_yolo_line, parse_yolo_line, box_iou,
+    AnnotationStore, AnnotationIndex, EditCommand, EditJournal, RemapCancelled, remap_label_files,
+    read_image_size, ImageMetadataIndex, perf
+)
+import etiquetador_prelabel as prelabel
+import etiquetador_session as shared
+
+# --- Diálogo para Gestionar Clases ---
+
+class ManageLabelsDialog(QDialog):
+    """Ventana para añadir, editar, reordenar y eliminar las clases de objetos.
+
+    Los IDs se renumeran por posición al aceptar; `get_id_mapping` indica cómo pasar
+    de los IDs antiguos a los nuevos para reescribir los archivos de etiquetas.
+    """
+    def __init__(self, labels, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Gestionar Etiquetas")
+        self.setMinimumSize(300, 400)
+
+        self.layout = QVBoxLayout(self)
+        self.list_widget = QListWidget()
+        self.original_labels = labels
+        self.current_labels = list(self.original_labels.values())
+        self.current_ids = list(self.original_labels.keys()) # ID original de cada fila; None si es nueva
+        self.list_widget.addItems(self.current_labels)
+        self.layout.addWidget(self.list_widget)
+        
+        button_layout = QHBoxLayout()
+        self.add_button = QPushButton("Añadir")
+        self.edit_button = QPushButton("Editar")
+        self.delete_button = QPushButton("Eliminar")
+        self.up_button = QPushButton("Subir")
+        self.down_button = QPushButton("Bajar")
+        button_layout.addWidget(self.add_button)
+        button_layout.addWidget(self.edit_button)
+        button_layout.addWidget(self.delete_button)
+        button_layout.addWidget(self.up_button)
+        button_layout.addWidget(self.down_button)
+        self.layout.addLayout(button_layout)
+        
+        self.button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        self.layout.addWidget(self.button_box)
+
+        self.add_button.clicked.connect(self.add_label)
+        self.edit_button.clicked.connect(self.edit_label)
+        self.delete_button.clicked.connect(self.delete_label)
+        self.up_button.clicked.connect(lambda: self.move_label(-1))
+        self.down_button.clicked.connect(lambda: self.move_label(1))
+        self.button_box.accepted.connect(self.accept)
+        self.button_box.rejected.connect(self.reject)
+
+    def add_label(self):
+        text, ok = QInputDialog.getText(self, "Añadir Etiqueta", "Nombre de la nueva etiqueta:")
+        if ok and text and text not in self.current_labels:
+            self.current_labels.append(text)
+            self.current_ids.append(None)
+            self.list_widget.addItem(text)
+
+    def edit_label(self):
+        selected_item = self.list_widget.currentItem()
+        if not selected_item: return
+        old_text = selected_item.text()
+        new_text, ok = QInputDialog.getText(self, "Editar Etiqueta", "Nuevo nombre:", text=old_text)
+        if ok and new_text and new_text != old_text and new_text not in self.current_labels:
+            index = self.current_labels.index(old_text)
+            self.current_labels[index] = new_text
+            selected_item.setText(new_text)
+
+    def delete_label(self):
+        selected_item = self.list_widget.currentItem()
+        if not selected_item: return
+        reply = QMessageBox.question(self, "Eliminar Etiqueta", f"¿Estás seguro de que quieres eliminar '{selected_item.text()}'?\nSus cajas se borrarán de todos los archivos de etiquetas.", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if reply == QMessageBox.StandardButton.Yes:
+            row = self.list_widget.row(selected_item)
+            del self.current_labels[row]
+            del self.current_ids[row]
+            self.list_widget.takeItem(row)
+
+    def move_label(self, step):
+        row = self.list_widget.currentRow()
+        target = row + step
+        if row < 0 or not 0 <= target < len(self.current_labels): return
+        for values in (self.current_labels, self.current_ids):
+            values[row], values[target] = values[target], values[row]
+        self.list_widget.insertItem(target, self.list_widget.takeItem(row))
+        self.list_widget.setCurrentRow(target)
+
+    def get_updated_labels(self):
+        return {i: name for i, name in enumerate(self.current_labels)}
+
+    def get_id_mapping(self):
+        """{id antiguo: id nuevo}; las clases eliminadas se asocian a None."""
+        mapping = {old_id: None for old_id in self.original_labels}
+        for new_id, old_id in enumerate(self.current_ids):
+            if old_id is not None:
+                mapping[old_id] = new_id
+        return mapping
+
+# --- Asignación Rápida de Clase ---
+
+class QuickAssignPopup(QFrame):
+    """Ventana emergente, no modal, para elegir una clase escribiendo parte de su nombre.
+
+    Enter asigna la clase resaltada, las flechas recorren la lista y Escape o un clic
+    fuera cancelan. Con la búsqueda vacía, 1-9 eligen la clase de esa posición, igual
+    que los atajos de la ventana principal.
+    """
+    class_chosen = Signal(int)
+    cancelled = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent, Qt.WindowType.Popup)
+        self.setFrameShape(QFrame.Shape.StyledPanel)
+        self.setFixedWidth(240)
+        self.class_ids_by_name = {}
+        self._chosen = False
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(4, 4, 4, 4)
+        self.search = QLineEdit()
+        self.search.setPlaceholderText("Buscar clase...")
+        self.matches = QListWidget()
+        self.matches.setUniformItemSizes(True)
+        layout.addWidget(self.search)
+        layout.addWidget(self.matches)
+        self.search.textChanged.connect(self.refresh)
+        self.search.installEventFilter(self)
+        self.matches.itemClicked.connect(self._choose_item)
+
+    def open_at(self, class_ids_by_name, current_class_id, global_pos):
+        self.class_ids_by_name = class_ids_by_name
+        self._chosen = False
+        self.search.blockSignals(True)
+        self.search.clear()
+        self.search.blockSignals(False)
+        self.refresh()
+        # Sin búsqueda queda resaltada la última clase usada
+        for row in range(self.matches.count()):
+            if self.matches.item(row).data(Qt.ItemDataRole.UserRole) == current_class_id:
+                self.matches.setCurrentRow(row)
+        self.move(global_pos)
+        self.show()
+        self.search.setFocus()
+
+    def refresh(self):
+        self.matches.clear()
+        for name in fuzzy_filter(self.search.text(), list(self.class_ids_by_name)):
+            item = QListWidgetItem(name)
+            item.setData(Qt.ItemDataRole.UserRole, self.class_ids_by_name[name])
+            self.matches.addItem(item)
+        self.matches.setCurrentRow(0)
+
+    def eventFilter(self, obj, event):
+        if obj is self.search and event.type() == QEvent.Type.KeyPress:
+            key = event.key()
+            if key in (Qt.Key.Key_Up, Qt.Key.Key_Down, Qt.Key.Key_PageUp, Qt.Key.Key_PageDown):
+                QApplication.sendEvent(self.matches, event)
+                return True
+            if key in (Qt.Key.Key_Return, Qt.Key.Key_Enter):
+                self._choose_item(self.matches.currentItem())
+                return True
+            if key == Qt.Key.Key_Escape:
+                self.hide()
+                return True
+            if Qt.Key.Key_1 <= key <= Qt.Key.Key_9 and not self.search.text():
+                self._choose_item(self.matches.item(key - Qt.Key.Key_1))
+                return True
+        return super().eventFilter(obj, event)
+
+    def _choose_item(self, item):
+        if item is None: return
+        self._chosen = True
+        self.hide()
+        self.class_chosen.emit(item.data(Qt.ItemDataRole.UserRole))
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        if not self._chosen: self.cancelled.emit()
+
+# --- Modelo de la Lista de Cajas ---
+
+class BoxListModel(QAbstractListModel):
+    """Modelo de la lista de cajas de la imagen actual.
+
+    Las filas siguen el orden de los IDs de caja, que es también el del fichero, así
+    que la fila de una caja se encuentra por bisección. Permite insertar, quitar o
+    actualizar filas sueltas sin reconstruir la lista, lo que mantiene la interfaz
+    fluida con miles de cajas por imagen.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.boxes = []
+        self.box_ids = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.boxes)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.boxes): return None
+        box = self.boxes[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"ID: {box['class_id']} - {box['label']}"
+        if role == Qt.ItemDataRole.UserRole:
+            return box['box_id']
+        return None
+
+    def row_of(self, box_id):
+        row = bisect_left(self.box_ids, box_id)
+        return row if row < len(self.box_ids) and self.box_ids[row] == box_id else -1
+
+    def reset_boxes(self, boxes):
+        self.beginResetModel()
+        self.boxes = list(boxes)
+        self.box_ids = [box['box_id'] for box in self.boxes]
+        self.endResetModel()
+
+    def insert_box(self, box):
+        """Inserta la caja en la fila que le corresponde por ID y la devuelve."""
+        row = bisect_left(self.box_ids, box['box_id'])
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.boxes.insert(row, box)
+        self.box_ids.insert(row, box['box_id'])
+        self.endInsertRows()
+        return row
+
+    def remove_box(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        box = self.boxes.pop(row)
+        del self.box_ids[row]
+        self.endRemoveRows()
+        return box
+
+    def update_box(self, row, box):
+        self.boxes[row] = box
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+# --- Índice Espacial de Cajas ---
+
+class BoxSpatialIndex:
+    """Cajas guardadas en arrays compactos con una rejilla uniforme para consultas por área.
+
+    Cada caja ocupa un hueco (slot) estable mientras exista; los huecos libres se
+    reutilizan. Las coordenadas son píxeles de la imagen original y pueden salirse de
+    ella: todo lo que queda fuera cae en un anillo de celdas de borde alrededor de la
+    rejilla, así que ni una caja enorme ni una consulta lejana recorren más celdas que la
+    propia rejilla. Cada caja lleva además un orden de dibujo, independiente del slot
+    que le toque.
+    """
+    GRID_CELLS = 64 # Celdas por lado para la dimensión mayor de la imagen
+
+    def __init__(self):
+        self.reset(QSize(0, 0))
+
+    def reset(self, image_size):
+        self.x0, self.y0, self.x1, self.y1 = array('i'), array('i'), array('i'), array('i')
+        self.order = array('q')
+        self.items = []
+        self._free = []
+        self._grid = {}
+        self.cell_size = max(32, math.ceil(max(image_size.width(), image_size.height(), 1) / self.GRID_CELLS))
+        # Celdas de la imagen por lado; -1 y este valor son las celdas de borde
+        self._grid_cells = (max(1, math.ceil(image_size.width() / self.cell_size)),
+                            max(1, math.ceil(image_size.height() / self.cell_size)))
+
+    def _cell_range(self, x0, y0, x1, y1):
+        c = self.cell_size
+        nx, ny = self._grid_cells
+        return (min(max(math.floor(x0) // c, -1), nx), min(max(math.floor(y0) // c, -1), ny),
+                min(max(math.floor(x1) // c, -1), nx), min(max(math.floor(y1) // c, -1), ny))
+
+    def _cells(self, cx0, cy0, cx1, cy1):
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                yield cx, cy
+
+    def insert(self, rect, item, order):
+        x0, y0, x1, y1 = rect.left(), rect.top(), rect.left() + rect.width(), rect.top() + rect.height()
+        if self._free:
+            slot = self._free.pop()
+            self.x0[slot], self.y0[slot], self.x1[slot], self.y1[slot] = x0, y0, x1, y1
+            self.order[slot] = order
+            self.items[slot] = item
+        else:
+            slot = len(self.items)
+            self.x0.append(x0); self.y0.append(y0); self.x1.append(x1); self.y1.append(y1)
+            self.order.append(order)
+            self.items.append(item)
+        for cell in self._cells(*self._cell_range(x0, y0, x1, y1)):
+            self._grid.setdefault(cell, set()).add(slot)
+        return slot
+
+    def remove(self, slot):
+        for cell in self._cells(*self._cell_range(self.x0[slot], self.y0[slot], self.x1[slot], self.y1[slot])):
+            bucket = self._grid.get(cell)
+            if bucket is not None:
+                bucket.discard(slot)
+                if not bucket: del self._grid[cell]
+        self.items[slot] = None
+        self._free.append(slot)
+
+    def query(self, x0, y0, x1, y1):
+        """Slots de las cajas que intersectan el rectángulo dado, en orden de dibujo."""
+        if not self._grid: return []
+        found = set()
+        for cell in self._cells(*self._cell_range(x0, y0, x1, y1)):
+            bucket = self._grid.get(cell)
+            if bucket: found.update(bucket)
+        return sorted((slot for slot in found
+                       if self.x0[slot] <= x1 and self.x1[slot] >= x0 and self.y0[slot] <= y1 and self.y1[slot] >= y0),
+                      key=self.order.__getitem__)
+
+    def hit_test(self, x, y):
+        """Slot de la caja más pequeña que contiene el punto, o -1. Entre cajas iguales,
+        la que se dibuja encima."""
+        best, best_area = -1, None
+        for slot in self.query(x, y, x, y):
+            area = (self.x1[slot] - self.x0[slot]) * (self.y1[slot] - self.y0[slot])
+            if best_area is None or area <= best_area:
+                best, best_area = slot, area
+        return best
+
+# --- Transformación de Vista ---
+
+class ViewTransform:
+    """Transformación imagen -> widget de la vista: escala uniforme y desplazamiento.
+
+    `offset` es la posición en el widget del origen de la imagen. Todas las
+    conversiones entre coordenadas del widget y de la imagen pasan por aquí.
+    """
+    def __init__(self):
+        self.scale = 1.0
+        self.offset = QPointF(0, 0)
+
+    def key(self):
+        return (self.scale, self.offset.x(), self.offset.y())
+
+    def fit(self, image_size, widget_size):
+        """Ajusta la imagen completa al widget, centrada."""
+        if image_size.isEmpty(): return
+        self.scale = min(widget_size.width() / image_size.width(), widget_size.height() / image_size.height())
+        self.offset = QPointF((widget_size.width() - int(image_size.width() * self.scale)) // 2,
+                              (widget_size.height() - int(image_size.height() * self.scale)) // 2)
+
+    def clamp(self, image_size, widget_size):
+        """Centra los ejes en los que la imagen cabe y, en los demás, impide que quede
+        espacio vacío a un lado."""
+        offset = []
+        for content, available, current in ((image_size.width() * self.scale, widget_size.width(), self.offset.x()),
+                                            (image_size.height() * self.scale, widget_size.height(), self.offset.y())):
+            offset.append((available - content) / 2 if content <= available else min(0, max(available - content, current)))
+        self.offset = QPointF(*offset)
+
+    def zoom_at(self, factor, point):
+        """Escala por `factor` manteniendo fijo el punto de la imagen bajo `point`."""
+        self.offset = QPointF(point.x() - (point.x() - self.offset.x()) * factor, point.y() - (point.y() - self.offset.y()) * factor)
+        self.scale *= factor
+
+    def pan(self, dx, dy):
+        self.offset += QPointF(dx, dy)
+
+    def map_to_image(self, point):
+        return (point.x() - self.offset.x()) / self.scale, (point.y() - self.offset.y()) / self.scale
+
+    def map_rect_to_widget(self, rect):
+        s = self.scale
+        return QRect(int(rect.left() * s + self.offset.x()), int(rect.top() * s + self.offset.y()),
+                     int(rect.width() * s), int(rect.height() * s))
+
+    def map_rect_to_image(self, rect):
+        s = self.scale
+        return QRectF((rect.left() - self.offset.x()) / s, (rect.top() - self.offset.y()) / s, rect.width() / s, rect.height() / s)
+
+# --- Widget de Imagen ---
+
+class ImageLabel(QLabel):
+    # Tiempo sin interacción tras el cual se vuelve a renderizar en alta calidad
+    IDLE_RENDER_DELAY_MS = 150
+    # Zoom máximo (píxeles de pantalla por píxel de imagen) y factor por paso de rueda
+    MAX_ZOOM = 16.0
+    ZOOM_STEP = 1.25
+    MINIMAP_SIZE = 180
+    MINIMAP_MARGIN = 10
+    # Panel de perfilado: resumen de las últimas muestras de cada operación
+    PERF_FONT = QFont("Monospace", 9)
+    PERF_OVERLAY_WIDTH = 330
+    PERF_OVERLAY_SAMPLES = 2000
+    # Margen (px) para cubrir el grosor del lápiz al invalidar regiones
+    DIRTY_MARGIN = 3
+    LABEL_FONT = QFont("Arial", 10, QFont.Weight.Bold)
+    # Lado (px) de los tiradores de la caja seleccionada
+    HANDLE_SIZE = 8
+    HANDLE_CURSORS = {
+        'tl': Qt.CursorShape.SizeFDiagCursor, 'br': Qt.CursorShape.SizeFDiagCursor,
+        'tr': Qt.CursorShape.SizeBDiagCursor, 'bl': Qt.CursorShape.SizeBDiagCursor,
+        't': Qt.CursorShape.SizeVerCursor, 'b': Qt.CursorShape.SizeVerCursor,
+        'l': Qt.CursorShape.SizeHorCursor, 'r': Qt.CursorShape.SizeHorCursor,
+        'move': Qt.CursorShape.SizeAllCursor,
+    }
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.main_window = parent
+        self.current_pixmap = None
+        self.image_size = QSize() # Tamaño original; el pixmap puede estar reducido
+        self.tile_pyramid = None
+        self.view = ViewTransform()
+        # Mientras no se haga zoom la imagen se ajusta a la ventana
+        self.fit_mode = True
+        self.panning = False
+        self.minimap_dragging = False
+        self._pan_last = QPoint()
+        self._minimap_cache = None
+        self._minimap_cache_key = None
+        self._perf_lines = []
+        self.boxes = {} # box_id -> caja
+        self.drawing = False
+        self.start_point = QPoint()
+        self.end_point = QPoint()
+        # Caja recién dibujada que espera a que se elija su clase (coordenadas de imagen)
+        self.pending_rect = None
+        self.selected_box_id = None
+        self.hovered_box = None
+        # Edición de la caja seleccionada: tirador arrastrado y rectángulo provisional
+        self.edit_handle = None
+        self.edit_start_rect = QRectF()
+        self.edit_rect = QRectF()
+        self._cursor_handle = None
+        self.spatial_index = BoxSpatialIndex()
+        # Propuestas del modelo: pocas por imagen, se recorren sin índice
+        self.proposals = []
+        self.selected_proposal = -1
+        self._label_metrics = QFontMetrics(self.LABEL_FONT)
+        self._label_widths = {} # Caché de anchos de texto por etiqueta
+        self.setMouseTracking(True)
+
+        # Caché de renderizado: la parte visible de la imagen ya escalada, que sólo se
+        # recalcula si cambian el pixmap, el tamaño del widget o la transformación.
+        self._scaled_cache = None
+        self._scaled_cache_origin = QPoint()
+        self._scaled_cache_key = None
+        self._scaled_cache_mode = None
+        self._fast_render = False
+        self._idle_timer = QTimer(self)
+        self._idle_timer.setSingleShot(True)
+        self._idle_timer.timeout.connect(self._on_input_idle)
+
+    def setPixmap(self, pixmap, image_size=None):
+        self.current_pixmap = pixmap
+        self.image_size = image_size if image_size is not None else pixmap.size()
+        self.fit_mode = True
+        self._sync_view()
+        self._invalidate_render_cache()
+        self.update()
+
+    def load_boxes(self, boxes):
+        self.boxes = {box['box_id']: box for box in boxes}
+        self.hovered_box = None
+        self.spatial_index.reset(self.image_size)
+        for box in boxes:
+            box['slot'] = self.spatial_index.insert(box['rect_pixels'], box, box['box_id'])
+        self.set_selected_box(None)
+        self.update()
+
+    def set_selected_box(self, box_id):
+        previous = self.selected_box_id
+        self.selected_box_id = box_id
+        self._update_box_dict_area(self.boxes.get(previous))
+        self._update_box_dict_area(self.boxes.get(box_id))
+
+    # --- Cambios incrementales de cajas ---
+
+    def insert_box(self, box):
+        self.boxes[box['box_id']] = box
+        box['slot'] = self.spatial_index.insert(box['rect_pixels'], box, box['box_id'])
+        self._update_box_dict_area(box)
+
+    def remove_box(self, box_id):
+        box = self.boxes.pop(box_id)
+        self._update_box_dict_area(box)
+        self.spatial_index.remove(box['slot'])
+        if box is self.hovered_box: self.hovered_box = None
+        if self.selected_box_id == box_id: self.selected_box_id = None
+
+    def update_box(self, box):
+        old_box = self.boxes[box['box_id']]
+        self._update_box_dict_area(old_box)
+        self.spatial_index.remove(old_box['slot'])
+        if old_box is self.hovered_box: self.hovered_box = box
+        self.boxes[box['box_id']] = box
+        box['slot'] = self.spatial_index.insert(box['rect_pixels'], box, box['box_id'])
+        self._update_box_dict_area(box)
+
+    # --- Propuestas del modelo ---
+
+    def load_proposals(self, proposals):
+        for proposal in self.proposals: self._update_box_dict_area(proposal)
+        self.proposals = proposals
+        self.selected_proposal = -1
+        for proposal in proposals: self._update_box_dict_area(proposal)
+
+    def set_selected_proposal(self, index):
+        if 0 <= self.selected_proposal < len(self.proposals):
+            self._update_box_dict_area(self.proposals[self.selected_proposal])
+        self.selected_proposal = index
+        if 0 <= index < len(self.proposals):
+            self._update_box_dict_area(self.proposals[index])
+
+    def remove_proposal(self, index):
+        self._update_box_dict_area(self.proposals.pop(index))
+        if self.selected_proposal == index:
+            self.selected_proposal = -1
+        elif self.selected_proposal > index:
+            self.selected_proposal -= 1
+
+    def proposal_at(self, point):
+        """Índice de la propuesta más pequeña bajo un punto del widget, o -1."""
+        best, best_area = -1, None
+        for i, proposal in enumerate(self.proposals):
+            rect = self.view.map_rect_to_widget(proposal['rect_pixels'])
+            area = rect.width() * rect.height()
+            if rect.contains(point) and (best_area is None or area < best_area):
+                best, best_area = i, area
+        return best
+
+    def _label_width(self, label):
+        width = self._label_widths.get(label)
+        if width is None:
+            width = self._label_widths[label] = self._label_metrics.horizontalAdvance(label)
+        return width
+
+    def _box_area(self, rect_pixels, label):
+        """Zona del widget que ocupa una caja con su etiqueta de texto y sus tiradores."""
+        text_height = self._label_metrics.height()
+        area = self.view.map_rect_to_widget(rect_pixels)
+        area = area.united(QRect(area.left(), area.top() - text_height, self._label_width(label) + 4, text_height))
+        m = self.DIRTY_MARGIN + self.HANDLE_SIZE // 2
+        return area.adjusted(-m, -m, m, m)
+
+    def _update_box_dict_area(self, box):
+        """Repinta sólo la zona de una caja, incluida su etiqueta de texto."""
+        if box is None: return
+        self.update(self._box_area(box['rect_pixels'], box['label']))
+
+    # --- Edición de la caja seleccionada ---
+
+    def _handle_points(self, rect):
+        l, t, r, b = rect.left(), rect.top(), rect.right(), rect.bottom()
+        cx, cy = (l + r) // 2, (t + b) // 2
+        # Las esquinas van primero para que ganen en cajas pequeñas
+        return {'tl': (l, t), 'tr': (r, t), 'br': (r, b), 'bl': (l, b),
+                't': (cx, t), 'r': (r, cy), 'b': (cx, b), 'l': (l, cy)}
+
+    def _handle_at(self, point):
+        """Tirador de la caja seleccionada bajo el punto, 'move' si cae dentro de ella o None."""
+        box = self.boxes.get(self.selected_box_id)
+        if box is None: return None
+        rect = self.view.map_rect_to_widget(box['rect_pixels'])
+        reach = self.HANDLE_SIZE // 2 + 1
+        for name, (hx, hy) in self._handle_points(rect).items():
+            if abs(point.x() - hx) <= reach and abs(point.y() - hy) <= reach:
+                return name
+        return 'move' if rect.contains(point) else None
+
+    def _edited_rect(self):
+        """Rectángulo (en píxeles de la imagen) que resulta del arrastre en curso."""
+        s = self.view.scale
+        dx = (self.end_point.x() - self.start_point.x()) / s
+        dy = (self.end_point.y() - self.start_point.y()) / s
+        r = self.edit_start_rect
+        img_w, img_h = self.image_size.width(), self.image_size.height()
+        if self.edit_handle == 'move':
+            dx = min(max(dx, -r.left()), img_w - r.right())
+            dy = min(max(dy, -r.top()), img_h - r.bottom())
+            return r.translated(dx, dy)
+        left, top, right, bottom = r.left(), r.top(), r.right(), r.bottom()
+        if 'l' in self.edit_handle: left = min(max(left + dx, 0), img_w)
+        if 'r' in self.edit_handle: right = min(max(right + dx, 0), img_w)
+        if 't' in self.edit_handle: top = min(max(top + dy, 0), img_h)
+        if 'b' in self.edit_handle: bottom = min(max(bottom + dy, 0), img_h)
+        return QRectF(QPointF(left, top), QPointF(right, bottom)).normalized()
+
+    def _edit_area(self):
+        box = self.boxes.get(self.selected_box_id)
+        return self._box_area(self.edit_rect.toRect(), box['label']) if box is not None else QRect()
+
+    def rect_to_yolo(self, rect_pixels):
+        """(x_center, y_center, width, height) normalizados de un rectángulo de la imagen."""
+        img_w, img_h = self.image_size.width(), self.image_size.height()
+        return ((rect_pixels.left() + rect_pixels.width() / 2) / img_w, (rect_pixels.top() + rect_pixels.height() / 2) / img_h,
+                rect_pixels.width() / img_w, rect_pixels.height() / img_h)
+
+    # --- Caché de renderizado ---
+
+    def _invalidate_render_cache(self):
+        self._scaled_cache = None
+        self._scaled_cache_key = None
+        self._scaled_cache_mode = None
+
+    def _begin_fast_render(self):
+        """Usa escalado rápido mientras dure la interacción y programa el suavizado."""
+        self._fast_render = True
+        self._idle_timer.start(self.IDLE_RENDER_DELAY_MS)
+
+    def _on_input_idle(self):
+        self._fast_render = False
+        if self._scaled_cache_mode == Qt.TransformationMode.FastTransformation:
+            self.update()
+
+    def _sync_view(self):
+        if self.fit_mode:
+            self.view.fit(self.image_size, self.size())
+
+    def _ensure_render_cache(self):
+        """Devuelve la parte visible de la imagen ya escalada, recalculándola sólo cuando
+        es necesario. Sólo se escala la región del pixmap que queda a la vista, así que
+        el coste no crece con el zoom."""
+        if not self.current_pixmap or self.current_pixmap.isNull() or self.image_size.isEmpty():
+            return None
+        self._sync_view()
+        key = (self.current_pixmap.cacheKey(), self.width(), self.height(), self.view.key())
+        wanted_mode = Qt.TransformationMode.FastTransformation if self._fast_render else Qt.TransformationMode.SmoothTransformation
+        # Una versión suave ya cacheada sirve también durante la interacción
+        reusable = key == self._scaled_cache_key and (
+            self._scaled_cache_mode == wanted_mode or self._scaled_cache_mode == Qt.TransformationMode.SmoothTransformation)
+        if not reusable:
+            self._scaled_cache_key = key
+            self._scaled_cache_mode = wanted_mode
+            self._scaled_cache = None
+            # Región visible en coordenadas del pixmap (que puede estar reducido)
+            ps = self.current_pixmap.width() / self.image_size.width()
+            visible = self.view.map_rect_to_image(QRectF(self.rect()))
+            source = QRectF(visible.left() * ps, visible.top() * ps, visible.width() * ps, visible.height() * ps)
+            source = source.toAlignedRect().intersected(self.current_pixmap.rect())
+            if source.isEmpty(): return None
+            target = self.view.map_rect_to_widget(QRectF(source.left() / ps, source.top() / ps, source.width() / ps, source.height() / ps))
+            if target.isEmpty(): return None
+            with perf.measure("scale", f"{target.width()}x{target.height()}"):
+                region = self.current_pixmap if source == self.current_pixmap.rect() else self.current_pixmap.copy(source)
+                self._scaled_cache = region.scaled(target.size(), Qt.AspectRatioMode.IgnoreAspectRatio, wanted_mode)
+            self._scaled_cache_origin = target.topLeft()
+        return self._scaled_cache
+
+    # --- Zoom y desplazamiento ---
+
+    def _fit_scale(self):
+        fit = ViewTransform()
+        fit.fit(self.image_size, self.size())
+        return fit.scale
+
+    def fit_to_window(self):
+        self.fit_mode = True
+        self.update()
+
+    def zoom_at(self, factor, point):
+        """Amplía o reduce alrededor de un punto del widget, sin bajar del ajuste a ventana."""
+        if self.image_size.isEmpty(): return
+        self._sync_view()
+        fit_scale = self._fit_scale()
+        new_scale = min(max(self.view.scale * factor, fit_scale), max(self.MAX_ZOOM, fit_scale))
+        if new_scale <= fit_scale * 1.001:
+            self.fit_mode = True
+        else:
+            self.fit_mode = False
+            self.view.zoom_at(new_scale / self.view.scale, point)
+            self.view.clamp(self.image_size, self.size())
+        self._begin_fast_render()
+        self.update()
+
+    def pan_by(self, dx, dy):
+        if self.fit_mode: return
+        self.view.pan(dx, dy)
+        self.view.clamp(self.image_size, self.size())
+        self._begin_fast_render()
+        self.update()
+
+    def center_on(self, x, y):
+        """Centra la vista en un punto de la imagen."""
+        if self.fit_mode: return
+        self.view.offset = QPointF(self.width() / 2 - x * self.view.scale, self.height() / 2 - y * self.view.scale)
+        self.view.clamp(self.image_size, self.size())
+        self._begin_fast_render()
+        self.update()
+
+    def _minimap_rect(self):
+        """Rectángulo del minimapa (esquina inferior derecha), o uno vacío si no se muestra."""
+        if self.fit_mode or self.image_size.isEmpty(): return QRect()
+        size = self.image_size.scaled(QSize(self.MINIMAP_SIZE, self.MINIMAP_SIZE), Qt.AspectRatioMode.KeepAspectRatio)
+        return QRect(self.width() - size.width() - self.MINIMAP_MARGIN, self.height() - size.height() - self.MINIMAP_MARGIN,
+                     size.width(), size.height())
+
+    def _minimap_to_image(self, point):
+        rect = self._minimap_rect()
+        return ((point.x() - rect.left()) * self.image_size.width() / rect.width(),
+                (point.y() - rect.top()) * self.image_size.height() / rect.height())
+
+    def _paint_minimap(self, painter, dirty):
+        rect = self._minimap_rect()
+        if rect.isEmpty() or not dirty.intersects(rect): return
+        key = (self.current_pixmap.cacheKey(), rect.size().width(), rect.size().height())
+        if key != self._minimap_cache_key:
+            self._minimap_cache = self.current_pixmap.scaled(rect.size(), Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            self._minimap_cache_key = key
+        painter.drawPixmap(rect.topLeft(), self._minimap_cache)
+        painter.setPen(QPen(QColor(255, 255, 255), 1))
+        painter.drawRect(rect.adjusted(0, 0, -1, -1))
+        visible = self.view.map_rect_to_image(QRectF(self.rect()))
+        k = rect.width() / self.image_size.width()
+        view_rect = QRectF(rect.left() + visible.left() * k, rect.top() + visible.top() * k, visible.width() * k, visible.height() * k)
+        painter.setPen(QPen(QColor(255, 0, 0), 2))
+        painter.drawRect(view_rect.intersected(QRectF(rect)))
+        painter.setFont(self.LABEL_FONT)
+        painter.drawText(rect.adjusted(4, 2, 0, 0), Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop, f"{self.view.scale * 100:.0f}%")
+
+    def set_pending_rect(self, rect_pixels):
+        if self.pending_rect is not None: self.update_image_area(self.pending_rect)
+        self.pending_rect = rect_pixels
+        if rect_pixels is not None: self.update_image_area(rect_pixels)
+
+    def update_image_area(self, rect_pixels):
+        """Repinta la zona del widget que muestra un rectángulo de la imagen."""
+        m = self.DIRTY_MARGIN
+        self.update(self.view.map_rect_to_widget(rect_pixels).adjusted(-m, -m, m, m))
+
+    def box_at(self, point):
+        """Caja bajo un punto del widget, usando el índice espacial."""
+        x, y = self.view.map_to_image(point)
+        slot = self.spatial_index.hit_test(x, y)
+        return self.spatial_index.items[slot] if slot != -1 else None
+
+    def _rubber_band_rect(self):
+        m = self.DIRTY_MARGIN
+        return QRect(self.start_point, self.end_point).normalized().adjusted(-m, -m, m, m)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.fit_mode: self._sync_view()
+        else: self.view.clamp(self.image_size, self.size())
+        self._begin_fast_render()
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if steps and self.current_pixmap:
+            self.zoom_at(self.ZOOM_STEP ** steps, event.position())
+
+    # --- Eventos de ratón ---
+
+    def mousePressEvent(self, event):
+        if event.button() in (Qt.MouseButton.MiddleButton, Qt.MouseButton.RightButton) and self.current_pixmap:
+            # Botón central o derecho: arrastrar desplaza la vista
+            self.panning = True
+            self._pan_last = event.pos()
+            self.setCursor(Qt.CursorShape.ClosedHandCursor)
+            return
+        if event.button() == Qt.MouseButton.LeftButton and self._minimap_rect().contains(event.pos()):
+            self.minimap_dragging = True
+            self.center_on(*self._minimap_to_image(event.pos()))
+            return
+        if event.button() == Qt.MouseButton.LeftButton and self.current_pixmap:
+            self.start_point = event.pos()
+            self.end_point = event.pos()
+            # Arrastrar sobre la caja seleccionada la mueve o la redimensiona
+            handle = self._handle_at(event.pos())
+            if handle is not None:
+                self.edit_handle = handle
+                self.edit_start_rect = QRectF(self.boxes[self.selected_box_id]['rect_pixels'])
+                self.edit_rect = self.edit_start_rect
+                return
+            self.drawing = True
+            self.start_point = event.pos()
+            self.end_point = event.pos()
+            self.update(self._rubber_band_rect())
+
+    def mouseMoveEvent(self, event):
+        if self.panning:
+            delta = event.pos() - self._pan_last
+            self._pan_last = event.pos()
+            self.pan_by(delta.x(), delta.y())
+        elif self.minimap_dragging:
+            self.center_on(*self._minimap_to_image(event.pos()))
+        elif self.edit_handle is not None:
+            # Como con el rectángulo de dibujo, sólo se repinta la unión de la caja
+            # provisional anterior y la nueva; el índice y el fichero esperan al soltar
+            dirty = self._edit_area()
+            self.end_point = event.pos()
+            self.edit_rect = self._edited_rect()
+            self.update(dirty.united(self._edit_area()))
+        elif self.drawing and self.current_pixmap:
+            # Sólo se repinta la unión del rectángulo anterior y el nuevo
+            dirty = self._rubber_band_rect()
+            self.end_point = event.pos()
+            self._begin_fast_render()
+            self.update(dirty.united(self._rubber_band_rect()))
+        elif self.current_pixmap:
+            hovered = self.box_at(event.pos())
+            if hovered is not self.hovered_box:
+                self._update_box_dict_area(self.hovered_box)
+                self.hovered_box = hovered
+                self._update_box_dict_area(hovered)
+            handle = self._handle_at(event.pos())
+            if handle != self._cursor_handle:
+                self._cursor_handle = handle
+                self.setCursor(self.HANDLE_CURSORS.get(handle, Qt.CursorShape.ArrowCursor))
+
+    def leaveEvent(self, event):
+        self._update_box_dict_area(self.hovered_box)
+        self.hovered_box = None
+        super().leaveEvent(event)
+
+    def _select_at(self, point):
+        """Un clic sin arrastre selecciona la propuesta o caja que haya debajo."""
+        proposal = self.proposal_at(point)
+        self.main_window.select_proposal(proposal)
+        if proposal != -1: return
+        box = self.box_at(point)
+        self.main_window.select_box(box['box_id'] if box is not None else None)
+
+    def mouseReleaseEvent(self, event):
+        if self.panning and event.button() in (Qt.MouseButton.MiddleButton, Qt.MouseButton.RightButton):
+            self.panning = False
+            self._cursor_handle = None
+            self.setCursor(Qt.CursorShape.ArrowCursor)
+            return
+        if self.minimap_dragging and event.button() == Qt.MouseButton.LeftButton:
+            self.minimap_dragging = False
+            return
+        if event.button() == Qt.MouseButton.LeftButton and self.edit_handle is not None:
+            self.update(self._edit_area())
+            self.edit_handle = None
+            box = self.boxes.get(self.selected_box_id)
+            if box is None: return
+            self._update_box_dict_area(box)
+            if (self.end_point - self.start_point).manhattanLength() < 5:
+                self._select_at(self.start_point)
+                return
+            new_rect = self.edit_rect.toRect()
+            if new_rect.width() >= 1 and new_rect.height() >= 1 and new_rect != box['rect_pixels']:
+                self.main_window.modify_box(box['box_id'], new_rect)
+            return
+        if event.button() == Qt.MouseButton.LeftButton and self.drawing:
+            self.drawing = False
+            user_rect_on_widget = QRect(self.start_point, self.end_point).normalized()
+            self.update(self._rubber_band_rect())
+
+            if not self.current_pixmap or self.current_pixmap.isNull(): return
+            self._ensure_render_cache()
+
+            image_area_on_widget = self.view.map_rect_to_widget(QRect(QPoint(0, 0), self.image_size))
+            clipped_rect_on_widget = user_rect_on_widget.intersected(image_area_on_widget)
+
+            if clipped_rect_on_widget.width() < 5 or clipped_rect_on_widget.height() < 5:
+                # Un clic sin arrastre selecciona la caja que haya debajo
+                if user_rect_on_widget.width() < 5 and user_rect_on_widget.height() < 5:
+                    self._select_at(self.start_point)
+                return
+            
+            rect_on_image = self.view.map_rect_to_image(QRectF(clipped_rect_on_widget))
+            original_rect = QRect(int(rect_on_image.left()), int(rect_on_image.top()), int(rect_on_image.width()), int(rect_on_image.height()))
+            self.process_new_box(original_rect.intersected(QRect(QPoint(0, 0), self.image_size)))
+
+    def mouseDoubleClickEvent(self, event):
+        # Doble clic sobre una propuesta la acepta
+        proposal = self.proposal_at(event.pos())
+        if proposal != -1:
+            self.main_window.accept_proposal(proposal)
+        else:
+            super().mouseDoubleClickEvent(event)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if perf.enabled:
+            dirty = event.rect()
+            with perf.measure("paint", f"{dirty.width()}x{dirty.height()}"):
+                self._paint_image(event)
+            self._paint_perf_overlay(event.rect())
+        else:
+            self._paint_image(event)
+
+    def _paint_image(self, event):
+        scaled_pixmap = self._ensure_render_cache()
+        if scaled_pixmap is None: return
+        painter = QPainter(self)
+        painter.setClipRegion(event.region())
+
+        painter.drawPixmap(self._scaled_cache_origin, scaled_pixmap)
+        self._paint_tiles(painter, event.rect())
+
+        pen_saved = QPen(QColor(0, 255, 0), 2, Qt.PenStyle.SolidLine)
+        pen_selected = QPen(QColor(255, 255, 0), 3, Qt.PenStyle.SolidLine)
+        pen_hovered = QPen(QColor(0, 255, 255), 2, Qt.PenStyle.SolidLine)
+        painter.setFont(self.LABEL_FONT)
+        selected_box = self.boxes.get(self.selected_box_id)
+        text_height = self._label_metrics.height()
+
+        # Sólo se dibujan las cajas que tocan la zona a repintar. La etiqueta de texto
+        # queda por encima y a la derecha de la caja, así que la consulta se amplía.
+        dirty = event.rect()
+        s = self.view.scale
+        x0, y0 = self.view.map_to_image(dirty.topLeft())
+        x1, y1 = self.view.map_to_image(dirty.bottomRight())
+        max_label = max(self._label_widths.values(), default=0) + 4
+        for slot in self.spatial_index.query(x0 - max_label / s, y0, x1, y1 + text_height / s):
+            box_data = self.spatial_index.items[slot]
+            if box_data is selected_box: continue
+            painter.setPen(pen_hovered if box_data is self.hovered_box else pen_saved)
+            self._paint_box(painter, self.view.map_rect_to_widget(box_data['rect_pixels']), box_data['label'],
+                            QColor(0, 128, 0, 180), QColor(255, 255, 255))
+
+        # La seleccionada va encima de las demás, con sus tiradores y, si se está
+        # editando, en su posición provisional
+        if selected_box is not None:
+            rect_pixels = self.edit_rect.toRect() if self.edit_handle is not None else selected_box['rect_pixels']
+            scaled_box = self.view.map_rect_to_widget(rect_pixels)
+            if dirty.intersects(self._box_area(rect_pixels, selected_box['label'])):
+                painter.setPen(pen_selected)
+                self._paint_box(painter, scaled_box, selected_box['label'], QColor(200, 200, 0, 180), QColor(0, 0, 0))
+                half = self.HANDLE_SIZE // 2
+                for hx, hy in self._handle_points(scaled_box).values():
+                    painter.fillRect(QRect(hx - half, hy - half, self.HANDLE_SIZE, self.HANDLE_SIZE), QColor(255, 255, 0))
+
+        if self.proposals:
+            self._paint_proposals(painter, dirty, text_height)
+
+        if self.drawing:
+            pen_drawing = QPen(QColor(255, 0, 0), 2, Qt.PenStyle.DashLine)
+            painter.setPen(pen_drawing)
+            painter.drawRect(QRect(self.start_point, self.end_point))
+
+        if self.pending_rect is not None:
+            painter.setPen(QPen(QColor(255, 0, 0), 2, Qt.PenStyle.DashLine))
+            painter.drawRect(self.view.map_rect_to_widget(self.pending_rect))
+
+        self._paint_minimap(painter, dirty)
+
+    def perf_overlay_rect(self):
+        return QRect(self.MINIMAP_MARGIN, self.MINIMAP_MARGIN, self.PERF_OVERLAY_WIDTH,
+                     (len(self._perf_lines) + 1) * self._label_metrics.height() + 8)
+
+    def refresh_perf_overlay(self):
+        """Recalcula el resumen de tiempos y repinta sólo la zona del panel."""
+        old_rect = self.perf_overlay_rect()
+        self._perf_lines = [f"{op:<10}{stats['count']:>6}{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['max_ms']:>9.2f}"
+                            for op, stats in perf.summary(last=self.PERF_OVERLAY_SAMPLES).items()] if perf.enabled else []
+        self.update(old_rect.united(self.perf_overlay_rect()))
+
+    def _paint_perf_overlay(self, dirty):
+        """Panel con los tiempos recientes por operación (ms), en la esquina superior izquierda."""
+        rect = self.perf_overlay_rect()
+        if not dirty.intersects(rect): return
+        painter = QPainter(self)
+        painter.fillRect(rect, QColor(0, 0, 0, 170))
+        painter.setFont(self.PERF_FONT)
+        painter.setPen(QColor(255, 255, 255))
+        text = "\n".join([f"{'op':<10}{'n':>6}{'p50':>9}{'p95':>9}{'max':>9}"] + self._perf_lines)
+        painter.drawText(rect.adjusted(4, 4, -4, -4), Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop, text)
+
+    def _paint_box(self, painter, scaled_box, label, bg_color, text_color):
+        """Dibuja el rectángulo (con el lápiz ya elegido) y su etiqueta de texto."""
+        painter.drawRect(scaled_box)
+        text_height = self._label_metrics.height()
+        text_point = scaled_box.topLeft()
+        painter.fillRect(QRect(text_point.x(), text_point.y() - text_height, self._label_width(label) + 4, text_height), bg_color)
+        painter.setPen(text_color)
+        painter.drawText(text_point + QPoint(2, -3), label)
+
+    def _paint_proposals(self, painter, dirty, text_height):
+        pen_proposal = QPen(QColor(255, 0, 255), 2, Qt.PenStyle.DashLine)
+        pen_selected = QPen(QColor(255, 160, 0), 3, Qt.PenStyle.DashLine)
+        for i, proposal in enumerate(self.proposals):
+            scaled_box = self.view.map_rect_to_widget(proposal['rect_pixels'])
+            label = proposal['label']
+            text_width = self._label_width(label)
+            text_bg_rect = QRect(scaled_box.left(), scaled_box.top() - text_height, text_width + 4, text_height)
+            if not dirty.intersects(scaled_box.united(text_bg_rect).adjusted(-3, -3, 3, 3)): continue
+            is_selected = i == self.selected_proposal
+            painter.setPen(pen_selected if is_selected else pen_proposal)
+            painter.drawRect(scaled_box)
+            painter.fillRect(text_bg_rect, QColor(200, 120, 0, 180) if is_selected else QColor(128, 0, 128, 180))
+            painter.setPen(QColor(255, 255, 255))
+            painter.drawText(scaled_box.topLeft() + QPoint(2, -3), label)
+
+    def _paint_tiles(self, painter, dirty_rect):
+        """Si la vista supera la resolución del pixmap reducido, dibuja encima los
+        tiles visibles del nivel de la pirámide adecuado."""
+        pyramid = self.tile_pyramid
+        if pyramid is None or not pyramid.has_source() or self.image_size.width() <= 0: return
+        preview_scale = self.current_pixmap.width() / self.image_size.width()
+        s = self.view.scale
+        if s <= preview_scale * 1.05: return
+
+        source_rect = self.view.map_rect_to_image(QRectF(dirty_rect)).toAlignedRect()
+        level = pyramid.level_for_scale(s)
+        for tile_rect, tile_pixmap in pyramid.tiles_for_rect(level, source_rect):
+            if tile_pixmap is None: continue
+            target = QRectF(tile_rect.left() * s + self.view.offset.x(), tile_rect.top() * s + self.view.offset.y(),
+                            tile_rect.width() * s, tile_rect.height() * s)
+            painter.drawPixmap(target, tile_pixmap, QRectF(tile_pixmap.rect()))
+
+    def process_new_box(self, rect_pixels):
+        class_map = self.main_window.class_map
+        preselected_id = self.main_window.preselected_class_id
+
+        x_center, y_center, width, height = self.rect_to_yolo(rect_pixels)
+        
+        if preselected_id != -1:
+            # Flujo rápido con preselección
+            label = class_map[preselected_id]
+            yolo_data = (preselected_id, x_center, y_center, width, height)
+            self.main_window.add_new_box(rect_pixels, label, yolo_data)
+        elif not class_map:
+            QMessageBox.warning(self, "Sin Etiquetas", "Añada etiquetas usando 'Gestionar Etiquetas'.")
+        else:
+            # Sin preselección la clase se elige en una ventana emergente que no bloquea
+            self.main_window.request_class_for_new_box(rect_pixels)
+
+# --- Índice de Anotaciones del Dataset ---
+
+class _IndexReconcileSignals(QObject):
+    finished = Signal(str, int)
+
+class _IndexReconcileTask(QRunnable):
+    """Reconcilia el índice en segundo plano con su propia conexión SQLite."""
+    def __init__(self, db_path, labels_folder, signals):
+        super().__init__()
+        self.db_path = db_path
+        self.labels_folder = labels_folder
+        self.signals = signals
+
+    def run(self):
+        changed = 0
+        try:
+            index = AnnotationIndex(self.db_path)
+            try:
+                changed = index.reconcile(self.labels_folder)
+            finally:
+                index.close()
+        except sqlite3.Error as e:
+            print(f"No se pudo actualizar el índice de anotaciones: {e}")
+        self.signals.finished.emit(self.db_path, changed)
+
+# --- Reasignación de IDs de Clase ---
+
+class RemapWorker(QThread):
+    """Ejecuta `remap_label_files` fuera del hilo de la interfaz."""
+    progress = Signal(int, int)
+
+    def __init__(self, labels_folder, mapping, parent=None):
+        super().__init__(parent)
+        self.labels_folder = labels_folder
+        self.mapping = mapping
+        self.cancel_event = threading.Event()
+        self.changed = 0
+        self.error = None
+        self.cancelled = False
+
+    def run(self):
+        try:
+            self.changed = remap_label_files(self.labels_folder, self.mapping,
+                                             lambda done, total: self.progress.emit(done, total), self.cancel_event)
+        except RemapCancelled:
+            self.cancelled = True
+        except (OSError, UnicodeDecodeError) as e:
+            self.error = e
+
+# --- Metadatos de Imagen (dimensiones sin decodificar) ---
+
+def probe_image_size(image_path):
+    """Dimensiones desde la cabecera; si el formato no se reconoce se pregunta a Qt,
+    que tampoco decodifica los píxeles."""
+    size = read_image_size(image_path)
+    if size is None:
+        qsize = QImageReader(image_path).size()
+        size = (qsize.width(), qsize.height()) if qsize.isValid() else None
+    return size
+
+# --- Precarga de Imágenes ---
+
+# Qt 6 rechaza por defecto las imágenes que ocupan más de 256 MB decodificadas (unos
+# 67 MP en RGB32), justo las que la pirámide de tiles tiene que poder abrir. El límite
+# es global del proceso, así que vale para la vista previa, las miniaturas y los tiles.
+IMAGE_ALLOCATION_LIMIT_MB = 4096
+QImageReader.setAllocationLimit(IMAGE_ALLOCATION_LIMIT_MB)
+
+def decode_image(image_path, max_size=None):
+    """Decodifica una imagen a QImage. Es seguro llamarla desde hilos de trabajo.
+
+    Si se indica `max_size` y el formato lo permite, la imagen se decodifica ya
+    reducida a ese tamaño. Devuelve (imagen, tamaño original): las coordenadas de
+    las cajas siempre se expresan respecto al tamaño original.
+    """
+    reader = QImageReader(image_path)
+    original_size = reader.size()
+    if max_size is not None and original_size.isValid() and (
+            original_size.width() > max_size.width() or original_size.height() > max_size.height()):
+        reader.setScaledSize(original_size.scaled(max_size, Qt.AspectRatioMode.KeepAspectRatio))
+    with perf.measure("decode", os.path.basename(image_path)):
+        image = reader.read()
+    if image.isNull():
+        print(f"No se pudo decodificar '{image_path}': {reader.errorString()}")
+    if not original_size.isValid():
+        original_size = image.size()
+    return image, original_size
+
+class _DecodeSignals(QObject):
+    finished = Signal(str, int, QImage, QSize)
+
+class _DecodeTask(QRunnable):
+    """Decodifica una imagen en el pool de hilos y notifica al hilo principal."""
+    def __init__(self, image_path, generation, max_size, signals):
+        super().__init__()
+        self.image_path = image_path
+        self.generation = generation
+        self.max_size = max_size
+        self.signals = signals
+
+    def run(self):
+        image, original_size = decode_image(self.image_path, self.max_size)
+        self.signals.finished.emit(self.image_path, self.generation, image, original_size)
+
+class ImagePrefetcher(QObject):
+    """Decodifica en segundo plano las imágenes vecinas y las guarda en una caché LRU.
+
+    El límite de la caché se mide en bytes. Las imágenes se decodifican a QImage en
+    un pool de hilos y se convierten a QPixmap en el hilo principal al llegar, de modo
+    que mostrar una imagen precargada no cuesta nada. Con `max_size` las imágenes
+    se decodifican a resolución de pantalla en lugar de a resolución completa.
+    """
+    image_ready = Signal(str)
+
+    def __init__(self, max_bytes=768 * 1024 * 1024, max_size=None, parent=None):
+        super().__init__(parent)
+        self.max_bytes = max_bytes
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._pending = set()
+        self._generation = 0
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(max(1, min(4, QThreadPool.globalInstance().maxThreadCount() - 1)))
+        self._signals = _DecodeSignals(self)
+        self._signals.finished.connect(self._on_decoded)
+
+    @staticmethod
+    def _pixmap_bytes(pixmap):
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+    def _store(self, image_path, pixmap, original_size):
+        if image_path in self._cache:
+            self._cache_bytes -= self._pixmap_bytes(self._cache.pop(image_path)[0])
+        self._cache[image_path] = (pixmap, original_size)
+        self._cache_bytes += self._pixmap_bytes(pixmap)
+        # Se expulsan las menos usadas, pero nunca la recién insertada
+        while self._cache_bytes > self.max_bytes and len(self._cache) > 1:
+            _, (evicted, _) = self._cache.popitem(last=False)
+            self._cache_bytes -= self._pixmap_bytes(evicted)
+
+    def take(self, image_path):
+        """Devuelve (pixmap, tamaño original) si está cacheado, marcándolo como reciente, o None."""
+        entry = self._cache.get(image_path)
+        if entry is not None:
+            self._cache.move_to_end(image_path)
+        return entry
+
+    def load_now(self, image_path):
+        """Decodificación síncrona para cuando la imagen no llegó a precargarse."""
+        image, original_size = decode_image(image_path, self.max_size)
+        pixmap = QPixmap.fromImage(image)
+        if not pixmap.isNull():
+            self._store(image_path, pixmap, original_size)
+        return pixmap, original_size
+
+    def request(self, image_paths):
+        """Encola la decodificación de las rutas dadas, en orden de prioridad."""
+        for image_path in image_paths:
+            if image_path in self._cache or image_path in self._pending:
+                continue
+            self._pending.add(image_path)
+            self._pool.start(_DecodeTask(image_path, self._generation, self.max_size, self._signals))
+
+    def cancel(self):
+        """Descarta el trabajo en cola; los resultados en curso se ignoran al llegar."""
+        self._generation += 1
+        self._pool.clear()
+        self._pending.clear()
+
+    def clear(self):
+        self.cancel()
+        self._cache.clear()
+        self._cache_bytes = 0
+
+    def _on_decoded(self, image_path, generation, image, original_size):
+        if generation != self._generation:
+            return
+        self._pending.discard(image_path)
+        if image.isNull():
+            return
+        self._store(image_path, QPixmap.fromImage(image), original_size)
+        self.image_ready.emit(image_path)
+
+# --- Pirámide de Tiles para Imágenes Muy Grandes ---
+
+class _TileSignals(QObject):
+    finished = Signal(str, int, int, int, QImage)
+
+class _TileTask(QRunnable):
+    """Lee un tile de la pirámide o, si no está en disco, genera y guarda su banda entera.
+
+    Decodificar cada tile por separado sale caro: el JPEG se descomprime desde el
+    principio de la imagen en cada lectura y los formatos sin recorte (PNG) se leen
+    enteros. Por eso se decodifica una sola vez la banda de filas que contiene el tile
+    (la imagen completa si el formato no admite recorte) y se trocea en todos sus tiles.
+    """
+    _band_locks = {}
+    _band_locks_guard = threading.Lock()
+
+    def __init__(self, image_path, tile_folder, band_rect, band_size, key, level, tx, ty, signals):
+        super().__init__()
+        self.image_path = image_path
+        self.tile_folder = tile_folder
+        self.band_rect = band_rect
+        self.band_size = band_size
+        self.key, self.level, self.tx, self.ty = key, level, tx, ty
+        self.signals = signals
+
+    def _tile_path(self, tx, ty):
+        return os.path.join(self.tile_folder, f"{tx}_{ty}.png")
+
+    def run(self):
+        tile_path = self._tile_path(self.tx, self.ty)
+        tile = QImage(tile_path) if os.path.exists(tile_path) else QImage()
+        if tile.isNull():
+            # Otro hilo puede estar generando la misma banda: se espera y se reaprovecha
+            with self._band_locks_guard:
+                lock = self._band_locks.setdefault((self.tile_folder, self.band_rect.top()), threading.Lock())
+            with lock:
+                tile = QImage(tile_path) if os.path.exists(tile_path) else QImage()
+                if tile.isNull():
+                    tile = self._build_band()
+        self.signals.finished.emit(self.key, self.level, self.tx, self.ty, tile)
+
+    def _build_band(self):
+        """Decodifica la banda ya reducida a su nivel, guarda todos sus tiles y devuelve el pedido."""
+        reader = QImageReader(self.image_path)
+        reader.setClipRect(self.band_rect)
+        reader.setScaledSize(self.band_size)
+        with perf.measure("tiles", os.path.basename(self.image_path)):
+            band = reader.read()
+        if band.isNull():
+            print(f"No se pudo decodificar '{self.image_path}': {reader.errorString()}")
+            return band
+        size = TilePyramid.TILE_SIZE
+        first_ty = self.band_rect.top() // (size << self.level)
+        os.makedirs(self.tile_folder, exist_ok=True)
+        result = QImage()
+        for row in range(math.ceil(band.height() / size)):
+            for tx in range(math.ceil(band.width() / size)):
+                tile = band.copy(QRect(tx * size, row * size, size, size).intersected(band.rect()))
+                tile_path = self._tile_path(tx, first_ty + row)
+                tmp_path = tile_path + ".tmp.png"
+                if tile.save(tmp_path, "PNG"):
+                    os.replace(tmp_path, tile_path)
+                if (tx, first_ty + row) == (self.tx, self.ty):
+                    result = tile
+        return result
+
+class TilePyramid(QObject):
+    """Pirámide de tiles en disco para ver zonas de una imagen enorme a resolución real.
+
+    El nivel 0 es la resolución original y cada nivel reduce a la mitad. Los tiles se
+    generan bajo demanda en un pool de hilos, se guardan en `cache_folder/tiles` y sólo
+    se piden los que intersectan la región visible.
+    """
+    TILE_SIZE = 512
+    tile_ready = Signal(QRect) # Zona de la imagen original que cubre el tile
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, parent=None):
+        super().__init__(parent)
+        self.cache_folder = ""
+        self.max_bytes = max_bytes
+        self.image_path = None
+        self.image_size = QSize()
+        self.max_level = 0
+        self._key = None
+        self._whole_image_bands = False
+        self._tiles = OrderedDict()
+        self._tiles_bytes = 0
+        self._pending = set()
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(2)
+        self._signals = _TileSignals(self)
+        self._signals.finished.connect(self._on_tile_loaded)
+
+    def set_source(self, image_path, image_size, min_level_size=None):
+        """Cambia la imagen de origen. `min_level_size` es el tamaño a partir del cual
+        ya no hacen falta más niveles (normalmente el del pixmap reducido)."""
+        self._pool.clear()
+        self._pending.clear()
+        self._tiles.clear()
+        self._tiles_bytes = 0
+        self.image_path = image_path
+        self.image_size = image_size
+        self._key = None
+        if not image_path: return
+        stat = os.stat(image_path)
+        self._key = hashlib.sha1(f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}".encode()).hexdigest()
+        # Sin recorte nativo Qt decodifica la imagen entera en cada lectura: mejor una sola banda
+        self._whole_image_bands = not QImageReader(image_path).supportsOption(QImageIOHandler.ImageOption.ClipRect)
+        self.max_level = 0
+        if min_level_size is not None and min_level_size.width() > 0:
+            self.max_level = max(0, int(math.floor(math.log2(image_size.width() / min_level_size.width()))))
+
+    def has_source(self):
+        return self._key is not None
+
+    def level_for_scale(self, scale):
+        """Nivel cuya resolución es la más baja que no queda por debajo de `scale`."""
+        if scale >= 1: return 0
+        return max(0, min(self.max_level, int(math.floor(math.log2(1 / scale)))))
+
+    def tiles_for_rect(self, level, source_rect):
+        """Devuelve [(rect en píxeles originales, QPixmap o None)] para los tiles que
+        intersectan `source_rect`. Los que faltan se encolan y emiten `tile_ready`."""
+        span = self.TILE_SIZE << level
+        image_rect = QRect(QPoint(0, 0), self.image_size)
+        source_rect = source_rect.intersected(image_rect)
+        if source_rect.isEmpty(): return []
+        result = []
+        for ty in range(source_rect.top() // span, source_rect.bottom() // span + 1):
+            for tx in range(source_rect.left() // span, source_rect.right() // span + 1):
+                tile_rect = QRect(tx * span, ty * span, span, span).intersected(image_rect)
+                result.append((tile_rect, self._get_tile(level, tx, ty, tile_rect)))
+        return result
+
+    def _get_tile(self, level, tx, ty, tile_rect):
+        tile_id = (level, tx, ty)
+        pixmap = self._tiles.get(tile_id)
+        if pixmap is not None:
+            self._tiles.move_to_end(tile_id)
+            return pixmap
+        if tile_id not in self._pending:
+            self._pending.add(tile_id)
+            tile_folder = os.path.join(self.cache_folder, "tiles", self._key, str(level))
+            if self._whole_image_bands:
+                band_rect = QRect(QPoint(0, 0), self.image_size)
+            else:
+                band_rect = QRect(0, tile_rect.top(), self.image_size.width(), tile_rect.height())
+            band_size = QSize(max(1, math.ceil(band_rect.width() / (1 << level))), max(1, math.ceil(band_rect.height() / (1 << level))))
+            self._pool.start(_TileTask(self.image_path, tile_folder, band_rect, band_size, self._key, level, tx, ty, self._signals))
+        return None
+
+    def _on_tile_loaded(self, key, level, tx, ty, image):
+        if key != self._key: return
+        self._pending.discard((level, tx, ty))
+        if image.isNull(): return
+        pixmap = QPixmap.fromImage(image)
+        self._tiles[(level, tx, ty)] = pixmap
+        self._tiles_bytes += pixmap.width() * pixmap.height() * 4
+        while self._tiles_bytes > self.max_bytes and len(self._tiles) > 1:
+            _, evicted = self._tiles.popitem(last=False)
+            self._tiles_bytes -= evicted.width() * evicted.height() * 4
+        span = self.TILE_SIZE << level
+        self.tile_ready.emit(QRect(tx * span, ty * span, span, span).intersected(QRect(QPoint(0, 0), self.image_size)))
+
+# --- Escaneo de Carpetas ---
+
+class FolderScanner(QThread):
+    """Recorre la carpeta de imágenes (con subcarpetas) en segundo plano.
+
+    Las rutas relativas se emiten por lotes en un orden estable: primero los ficheros
+    de cada carpeta y después sus subcarpetas, todo ordenado por nombre. Se mantiene
+    un manifiesto con el contenido de cada carpeta y su mtime; en aperturas
+    posteriores sólo se vuelven a listar las carpetas cuyo mtime ha cambiado.
+    """
+    batch_found = Signal(list)
+    scan_finished = Signal(int)
+
+    BATCH_SIZE = 500
+    BATCH_INTERVAL = 0.1 # segundos
+
+    def __init__(self, image_folder, manifest_path, parent=None):
+        super().__init__(parent)
+        self.image_folder = image_folder
+        self.manifest_path = manifest_path
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("dirs", {})
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, dirs):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"dirs": dirs}, f)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            print(f"No se pudo guardar el manifiesto: {e}")
+
+    def run(self):
+        cached_dirs = self._load_manifest()
+        scanned_dirs = {}
+        batch, last_emit, total = [], time.monotonic(), 0
+        stack = [""]
+        while stack and not self._cancelled:
+            rel_dir = stack.pop()
+            abs_dir = os.path.join(self.image_folder, rel_dir)
+            try:
+                mtime_ns = os.stat(abs_dir).st_mtime_ns
+                cached = cached_dirs.get(rel_dir)
+                if cached is not None and cached["mtime_ns"] == mtime_ns:
+                    files, subdirs = cached["files"], cached["subdirs"]
+                else:
+                    files, subdirs = list_image_dir(abs_dir)
+            except OSError as e:
+                print(f"No se pudo leer la carpeta '{abs_dir}': {e}")
+                continue
+            scanned_dirs[rel_dir] = {"mtime_ns": mtime_ns, "files": files, "subdirs": subdirs}
+            batch.extend(os.path.join(rel_dir, name) if rel_dir else name for name in files)
+            # Se apilan en orden inverso para visitarlas por orden alfabético
+            stack.extend(os.path.join(rel_dir, name) if rel_dir else name for name in reversed(subdirs))
+            if len(batch) >= self.BATCH_SIZE or (batch and time.monotonic() - last_emit >= self.BATCH_INTERVAL):
+                total += len(batch)
+                self.batch_found.emit(batch)
+                batch, last_emit = [], time.monotonic()
+        if self._cancelled: return
+        if batch:
+            total += len(batch)
+            self.batch_found.emit(batch)
+        self._save_manifest(scanned_dirs)
+        self.scan_finished.emit(total)
+
+# --- Miniaturas y Tira de Imágenes ---
+
+class _ThumbnailSignals(QObject):
+    finished = Signal(str, QImage)
+
+class _ThumbnailTask(QRunnable):
+    """Carga la miniatura de la caché en disco o la genera decodificando a tamaño reducido."""
+    def __init__(self, image_folder, thumbs_folder, rel_path, size, signals):
+        super().__init__()
+        self.image_folder = image_folder
+        self.thumbs_folder = thumbs_folder
+        self.rel_path = rel_path
+        self.size = size
+        self.signals = signals
+
+    def run(self):
+        image_path = os.path.join(self.image_folder, self.rel_path)
+        thumbnail = QImage()
+        try:
+            stat = os.stat(image_path)
+            key = hashlib.sha1(f"{self.rel_path}|{stat.st_mtime_ns}|{stat.st_size}".encode()).hexdigest()
+            thumb_path = os.path.join(self.thumbs_folder, key[:2], key + ".jpg")
+            if os.path.exists(thumb_path):
+                thumbnail = QImage(thumb_path)
+            if thumbnail.isNull():
+                reader = QImageReader(image_path)
+                original_size = reader.size()
+                if original_size.isValid():
+                    reader.setScaledSize(original_size.scaled(QSize(self.size, self.size), Qt.AspectRatioMode.KeepAspectRatio))
+                thumbnail = reader.read()
+                if not thumbnail.isNull():
+                    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+                    tmp_path = thumb_path + ".tmp.jpg"
+                    if thumbnail.save(tmp_path, "JPG", 85):
+                        os.replace(tmp_path, thumb_path)
+        except OSError:
+            pass
+        self.signals.finished.emit(self.rel_path, thumbnail)
+
+class ThumbnailCache(QObject):
+    """Miniaturas en memoria (LRU) respaldadas por una caché en disco.
+
+    Las miniaturas se generan en un pool de hilos y se guardan en `cache_folder/thumbs`
+    con una clave de ruta + mtime + tamaño, de modo que una imagen modificada genera
+    una miniatura nueva. Las peticiones más recientes se atienden primero para que
+    al desplazarse rápido se carguen antes las filas visibles.
+    """
+    THUMB_SIZE = 96
+    MAX_PENDING = 400
+    thumbnail_ready = Signal(str)
+
+    def __init__(self, max_items=3000, parent=None):
+        super().__init__(parent)
+        self.max_items = max_items
+        self.image_folder = ""
+        self.cache_folder = ""
+        self._pixmaps = OrderedDict()
+        self._pending = set()
+        self._priority = 0
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(2)
+        self._signals = _ThumbnailSignals(self)
+        self._signals.finished.connect(self._on_thumbnail_loaded)
+
+    def set_folders(self, image_folder, cache_folder):
+        self._pool.clear()
+        self._pending.clear()
+        self._pixmaps.clear()
+        self.image_folder, self.cache_folder = image_folder, cache_folder
+
+    def get(self, rel_path):
+        """Devuelve el pixmap si está en memoria; si no, lo pide y devuelve None."""
+        pixmap = self._pixmaps.get(rel_path)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(rel_path)
+            return pixmap
+        if rel_path not in self._pending:
+            if len(self._pending) >= self.MAX_PENDING:
+                # Las peticiones viejas ya no están en pantalla; se volverán a pedir si hace falta
+                self._pool.clear()
+                self._pending.clear()
+            self._pending.add(rel_path)
+            self._priority += 1
+            task = _ThumbnailTask(self.image_folder, os.path.join(self.cache_folder, "thumbs"),
+                                  rel_path, self.THUMB_SIZE, self._signals)
+            self._pool.start(task, self._priority)
+        return None
+
+    def _on_thumbnail_loaded(self, rel_path, image):
+        if rel_path not in self._pending: return
+        self._pending.discard(rel_path)
+        if not image.isNull():
+            self._pixmaps[rel_path] = QPixmap.fromImage(image)
+            while len(self._pixmaps) > self.max_items:
+                self._pixmaps.popitem(last=False)
+        self.thumbnail_ready.emit(rel_path)
+
+class ImageListModel(QAbstractListModel):
+    """Modelo virtual de la lista de imágenes para la tira de miniaturas.
+
+    Sólo se consultan las filas visibles; las miniaturas se cargan bajo demanda y el
+    número de etiquetas sale del índice de anotaciones (clave: ruta sin extensión).
+    """
+    def __init__(self, image_files, thumbnails, parent=None):
+        super().__init__(parent)
+        self.image_files = image_files
+        self.thumbnails = thumbnails
+        self.label_counts = {}
+        self._rows = {}
+        size = ThumbnailCache.THUMB_SIZE
+        self._placeholder = QPixmap(size, size)
+        self._placeholder.fill(QColor(60, 60, 60))
+        thumbnails.thumbnail_ready.connect(self._on_thumbnail_ready)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.image_files)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.image_files): return None
+        rel_path = self.image_files[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            count = self.label_counts.get(os.path.splitext(rel_path)[0], 0)
+            return f"{os.path.basename(rel_path)} ({count})"
+        if role == Qt.ItemDataRole.DecorationRole:
+            pixmap = self.thumbnails.get(rel_path)
+            return pixmap if pixmap is not None else self._placeholder
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return rel_path
+        return None
+
+    def reset_images(self, image_files):
+        self.beginResetModel()
+        self.image_files = image_files
+        self._rows = {rel_path: row for row, rel_path in enumerate(image_files)}
+        self.endResetModel()
+
+    def images_appended(self, count):
+        """Avisa de que se añadieron `count` imágenes al final de la lista compartida."""
+        first = len(self.image_files) - count
+        self.beginInsertRows(QModelIndex(), first, len(self.image_files) - 1)
+        for row in range(first, len(self.image_files)):
+            self._rows[self.image_files[row]] = row
+        self.endInsertRows()
+
+    def set_label_counts(self, label_counts):
+        self.label_counts = label_counts
+        if self.image_files:
+            self.dataChanged.emit(self.index(0), self.index(len(self.image_files) - 1), [Qt.ItemDataRole.DisplayRole])
+
+    def set_label_count(self, rel_path, count):
+        self.label_counts[os.path.splitext(rel_path)[0]] = count
+        row = self._rows.get(rel_path)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DisplayRole])
+
+    def _on_thumbnail_ready(self, rel_path):
+        row = self._rows.get(rel_path)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+# --- Pre-etiquetado con Modelo ---
+
+class PrelabelQueue(QObject):
+    """Cola de inferencia en segundo plano sobre las imágenes próximas a la actual.
+
+    Las imágenes se envían por lotes a un pool de procesos; los lotes que aún no han
+    empezado se cancelan cuando el usuario salta lejos, para que el trabajo siga
+    siempre cerca de la imagen visible.
+    """
+    predictions_ready = Signal(str)
+    failed = Signal(str)
+    _batch_done = Signal(object)
+
+    BATCH_SIZE = 4
+    # Imágenes por delante (y la mitad por detrás) de la actual que se mantienen predichas
+    WINDOW = 32
+    MAX_IN_FLIGHT = 4
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.executor = None
+        self.cache = None
+        self.model_path = None
+        self.results = {}
+        self.in_flight = {} # future -> lote de rutas
+        self.queued = set()
+        self._focus = ([], -1)
+        self._batch_done.connect(self._on_batch_done)
+
+    def is_running(self):
+        return self.executor is not None
+
+    def start(self, model_path, image_folder, cache_folder):
+        self.stop()
+        self.model_path = model_path
+        self.cache = prelabel.PredictionCache(image_folder, cache_folder, model_path)
+        workers = max(1, (os.cpu_count() or 2) // 2)
+        threads = max(1, (os.cpu_count() or 2) // workers)
+        # "spawn" evita heredar los hilos de Qt del proceso principal
+        self.executor = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=prelabel.init_worker, initargs=(model_path, image_folder, cache_folder, threads, IMAGE_ALLOCATION_LIMIT_MB))
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        self.cache = None
+        self.results.clear()
+        self.in_flight.clear()
+        self.queued.clear()
+
+    def proposals(self, rel_path):
+        """Propuestas conocidas para una imagen, o None si aún no se han calculado."""
+        if self.cache is None: return None
+        if rel_path not in self.results:
+            cached = self.cache.load(rel_path)
+            if cached is None: return None
+            self.results[rel_path] = cached
+        return self.results[rel_path]
+
+    def discard(self, rel_path, proposal):
+        """Quita una propuesta ya aceptada o rechazada, también de la caché en disco."""
+        proposals = self.results.get(rel_path)
+        if proposals is None or proposal not in proposals: return
+        proposals.remove(proposal)
+        try:
+            self.cache.store(rel_path, proposals)
+        except OSError as e:
+            print(f"No se pudo actualizar la caché de predicciones: {e}")
+
+    def set_focus(self, image_files, index):
+        """Reprioriza la cola alrededor de `index`."""
+        self._focus = (image_files, index)
+        if self.executor is None: return
+        wanted = [image_files[index]] if 0 <= index < len(image_files) else []
+        for step in range(1, self.WINDOW + 1):
+            for i in ((index + step, index - step) if step <= self.WINDOW // 2 else (index + step,)):
+                if 0 <= i < len(image_files): wanted.append(image_files[i])
+        wanted_set = set(wanted)
+        for future, batch in list(self.in_flight.items()):
+            if wanted_set.isdisjoint(batch): future.cancel()
+        pending = [rel_path for rel_path in wanted if rel_path not in self.queued and self.proposals(rel_path) is None]
+        while pending and len(self.in_flight) < self.MAX_IN_FLIGHT:
+            batch, pending = pending[:self.BATCH_SIZE], pending[self.BATCH_SIZE:]
+            future = self.executor.submit(prelabel.predict_batch, batch)
+            self.in_flight[future] = batch
+            self.queued.update(batch)
+            # El callback llega en un hilo del executor; la señal lo lleva al hilo principal
+            future.add_done_callback(self._batch_done.emit)
+
+    def _on_batch_done(self, future):
+        batch = self.in_flight.pop(future, None)
+        if batch is None: return
+        self.queued.difference_update(batch)
+        if future.cancelled(): return
+        try:
+            results = future.result()
+        except BrokenProcessPool as e:
+            self.stop()
+            self.failed.emit(f"El proceso de inferencia terminó inesperadamente: {e}")
+            return
+        except Exception as e:
+            print(f"Error de inferencia en {batch}: {e}")
+            results = [(rel_path, []) for rel_path in batch]
+        for rel_path, proposals in results:
+            self.results[rel_path] = proposals
+            self.predictions_ready.emit(rel_path)
+        self.set_focus(*self._focus)
+
+# --- Ventana Principal ---
+
+class LabelingApp(QMainWindow):
+    # Imágenes a precargar por delante y por detrás de la actual
+    PREFETCH_AHEAD = 3
+    PREFETCH_BEHIND = 1
+    # Espera tras el último cambio antes de escribir las etiquetas a disco
+    FLUSH_DELAY_MS = 2000
+    # Una propuesta que solapa así con una caja existente de su clase no se muestra
+    PROPOSAL_OVERLAP_IOU = 0.5
+    # Frecuencia de refresco del panel de perfilado
+    PERF_REFRESH_MS = 500
+    # En sesión compartida, cada cuánto se comprueba si otros cambiaron la imagen o las
+    # clases (el watcher no recibe avisos de cambios hechos desde otro equipo por NFS)
+    SESSION_POLL_MS = 3000
+
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("Herramienta de Etiquetado (Formato YOLOv8)")
+        self.setGeometry(100, 100, 1200, 700)
+
+        self.image_folder = ""
+        self.labels_folder = "" # NUEVO: Carpeta para los archivos .txt
+        self.cache_folder = ""
+        self.image_files = []
+        self.current_image_index = -1
+        self.class_map = {}
+        # Índice inverso nombre -> ID, reconstruido con cada cambio de clases
+        self.class_ids_by_name = {}
+        self.preselected_class_id = -1
+        self.last_class_id = -1
+        # Se decodifica a resolución de pantalla; la pirámide cubre las vistas ampliadas
+        screen = QApplication.primaryScreen()
+        self.decode_size = screen.size() * screen.devicePixelRatio() if screen else None
+        self.prefetcher = ImagePrefetcher(max_size=self.decode_size, parent=self)
+        self.tile_pyramid = TilePyramid(parent=self)
+        self.metadata_index = None
+        self.annotations = None
+        self.annotation_index = None
+        self.index_reconciled = False # hasta entonces el índice puede estar incompleto
+        self.journal = None
+        self.filter_class_id = -1
+        self.folder_scanner = None
+        self.thumbnails = ThumbnailCache(parent=self)
+        self.image_list_model = ImageListModel(self.image_files, self.thumbnails, self)
+        self.last_shown_index = -1
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.timeout.connect(self.flush_annotations)
+        self.perf_timer = QTimer(self)
+        self.perf_timer.setInterval(self.PERF_REFRESH_MS)
+        self._reconcile_pool = QThreadPool(self)
+        self._reconcile_signals = _IndexReconcileSignals(self)
+        self._reconcile_signals.finished.connect(self.on_index_reconciled)
+        self.prelabel_queue = PrelabelQueue(self)
+        self.prelabel_queue.predictions_ready.connect(self.on_predictions_ready)
+        self.prelabel_queue.failed.connect(self.on_prelabel_failed)
+        self.session = None
+        self.image_holder = None # dueño del lease de la imagen actual si no es nuestro
+        self.classes_stamp = None
+        self.session_watcher = QFileSystemWatcher(self)
+        self.session_timer = QTimer(self)
+        self.session_timer.setInterval(self.SESSION_POLL_MS)
+        self.quick_assign = QuickAssignPopup(self)
+        self.quick_assign_target = None # ("new", rect en píxeles) o ("relabel", box_id)
+
+        main_widget = QWidget()
+        self.setCentralWidget(main_widget)
+        main_layout = QHBoxLayout(main_widget)
+
+        # --- Panel Izquierdo ---
+        left_panel = QWidget()
+        left_layout = QVBoxLayout(left_panel)
+        top_bar_layout = QHBoxLayout()
+        
+        self.btn_select_folder = QPushButton("Seleccionar Carpeta")
+        self.btn_manage_labels = QPushButton("Gestionar Etiquetas")
+        self.btn_prev_image = QPushButton("<< Anterior")
+        self.btn_next_image = QPushButton("Siguiente >>")
+        self.btn_next_unlabeled = QPushButton("Siguiente sin etiquetar")
+        self.btn_prev_image.setToolTip("Imagen anterior (A)")
+        self.btn_next_image.setToolTip("Imagen siguiente (D)")
+        self.btn_next_unlabeled.setToolTip("Siguiente imagen sin cajas (N)")
+        self.class_filter_combo = QComboBox()
+        self.class_filter_combo.setToolTip("Navegar sólo por imágenes que contienen esta clase")
+        self.btn_share_folder = QPushButton("Compartir Carpeta")
+        self.btn_share_folder.setToolTip("Activa el modo de sesión para que varios etiquetadores trabajen a la vez en esta carpeta"
+                                         if shared.session_available() else "El modo de sesión necesita 'fcntl' (Linux/macOS)")
+        self.btn_prelabel = QPushButton("Pre-etiquetar...")
+        self.btn_prelabel.setCheckable(True)
+        self.btn_prelabel.setToolTip("Propone cajas con un modelo YOLO en formato ONNX" if prelabel.prelabel_available()
+                                     else "Instala 'onnxruntime' y 'numpy' para activar el pre-etiquetado")
+        
+        top_bar_layout.addWidget(self.btn_select_folder)
+        top_bar_layout.addWidget(self.btn_manage_labels)
+        top_bar_layout.addWidget(self.btn_prelabel)
+        top_bar_layout.addWidget(self.btn_share_folder)
+        top_bar_layout.addStretch()
+        top_bar_layout.addWidget(self.class_filter_combo)
+        top_bar_layout.addWidget(self.btn_prev_image)
+        top_bar_layout.addWidget(self.btn_next_image)
+        top_bar_layout.addWidget(self.btn_next_unlabeled)
+
+        self.image_label = ImageLabel(self)
+        self.image_label.tile_pyramid = self.tile_pyramid
+        self.tile_pyramid.tile_ready.connect(self.image_label.update_image_area)
+        self.status_label = QLabel("Selecciona una carpeta para comenzar.")
+
+        # Tira de miniaturas: con tamaños uniformes la vista sólo materializa las filas visibles
+        thumb = ThumbnailCache.THUMB_SIZE
+        self.filmstrip = QListView()
+        self.filmstrip.setModel(self.image_list_model)
+        self.filmstrip.setViewMode(QListView.ViewMode.IconMode)
+        self.filmstrip.setFlow(QListView.Flow.LeftToRight)
+        self.filmstrip.setWrapping(False)
+        self.filmstrip.setMovement(QListView.Movement.Static)
+        self.filmstrip.setUniformItemSizes(True)
+        self.filmstrip.setLayoutMode(QListView.LayoutMode.Batched)
+        self.filmstrip.setBatchSize(200)
+        self.filmstrip.setIconSize(QSize(thumb, thumb))
+        self.filmstrip.setGridSize(QSize(thumb + 24, thumb + 24))
+        self.filmstrip.setFixedHeight(thumb + 48)
+        
+        left_layout.addLayout(top_bar_layout)
+        left_layout.addWidget(self.image_label, 1)
+        left_layout.addWidget(self.filmstrip)
+        left_layout.addWidget(self.status_label)
+
+        # --- Panel Derecho ---
+        right_panel = QWidget()
+        right_panel.setFixedWidth(300)
+        right_layout = QVBoxLayout(right_panel)
+        
+        # Grupo de Preselección
+        preselect_group = QGroupBox("Seleccionar Etiqueta")
+        preselect_layout = QVBoxLayout(preselect_group)
+        self.class_selection_list = QListWidget()
+        self.class_selection_list.setToolTip("Las teclas 1-9 seleccionan las nueve primeras clases")
+        preselect_layout.addWidget(self.class_selection_list)
+        
+        # Grupo de Etiquetas en Imagen
+        boxes_group = QGroupBox("Etiquetas en Imagen")
+        boxes_layout = QVBoxLayout(boxes_group)
+        self.boxes_model = BoxListModel(self)
+        self.boxes_list_view = QListView()
+        self.boxes_list_view.setModel(self.boxes_model)
+        self.boxes_list_view.setUniformItemSizes(True)
+        self.btn_delete_box = QPushButton("Eliminar Etiqueta Seleccionada")
+        self.btn_relabel_box = QPushButton("Cambiar Clase...")
+        self.btn_delete_box.setToolTip("Eliminar la caja seleccionada (Supr)")
+        self.btn_relabel_box.setToolTip("Elegir otra clase para la caja seleccionada (C)")
+        self.btn_undo = QPushButton("Deshacer")
+        self.btn_redo = QPushButton("Rehacer")
+        self.btn_undo.setToolTip("Deshacer el último cambio de esta imagen (Ctrl+Z)")
+        self.btn_redo.setToolTip("Rehacer el último cambio deshecho (Ctrl+Y)")
+        history_layout = QHBoxLayout()
+        history_layout.addWidget(self.btn_undo)
+        history_layout.addWidget(self.btn_redo)
+        boxes_layout.addWidget(self.boxes_list_view)
+        boxes_layout.addWidget(self.btn_delete_box)
+        boxes_layout.addWidget(self.btn_relabel_box)
+        boxes_layout.addLayout(history_layout)
+
+        # Grupo de Propuestas del Modelo (visible sólo con el pre-etiquetado activo)
+        self.proposals_group = QGroupBox("Propuestas del Modelo")
+        proposals_layout = QHBoxLayout(self.proposals_group)
+        self.btn_accept_proposal = QPushButton("Aceptar")
+        self.btn_reject_proposal = QPushButton("Rechazar")
+        self.btn_accept_all_proposals = QPushButton("Aceptar todas")
+        proposals_layout.addWidget(self.btn_accept_proposal)
+        proposals_layout.addWidget(self.btn_reject_proposal)
+        proposals_layout.addWidget(self.btn_accept_all_proposals)
+        self.proposals_group.setVisible(False)
+
+        # Grupo de Sesión Compartida (visible sólo si la carpeta está compartida)
+        self.session_group = QGroupBox("Sesión Compartida")
+        session_layout = QVBoxLayout(self.session_group)
+        self.session_label = QLabel()
+        self.session_label.setWordWrap(True)
+        self.btn_claim_chunk = QPushButton("Tomar Siguiente Lote")
+        self.btn_claim_chunk.setToolTip("Da por terminado tu lote actual y te asigna el siguiente libre")
+        session_layout.addWidget(self.session_label)
+        session_layout.addWidget(self.btn_claim_chunk)
+        self.session_group.setVisible(False)
+
+        right_layout.addWidget(preselect_group)
+        right_layout.addWidget(boxes_group)
+        right_layout.addWidget(self.proposals_group)
+        right_layout.addWidget(self.session_group)
+
+        main_layout.addWidget(left_panel, 1)
+        main_layout.addWidget(right_panel)
+
+        # --- Estilos ---
+        self.setStyleSheet("""
+            QMainWindow, QWidget { background-color: #2E2E2E; color: #F0F0F0; }
+            QGroupBox { border: 1px solid #555; border-radius: 5px; margin-top: 1ex; }
+            QGroupBox::title { subcontrol-origin: margin; left: 10px; padding: 0 3px 0 3px; }
+            QPushButton { background-color: #555; border: 1px solid #666; padding: 5px; border-radius: 3px; }
+            QPushButton:hover { background-color: #666; }
+            QPushButton:pressed { background-color: #444; }
+            QListWidget, QListView { border: 1px solid #555; background-color: #3C3C3C; }
+            QListWidget::item:selected, QListView::item:selected { background-color: #0078D7; color: white; }
+            QLabel { color: #F0F0F0; }
+        """)
+
+        # --- Conexiones ---
+        self.btn_select_folder.clicked.connect(self.select_folder)
+        self.btn_manage_labels.clicked.connect(self.manage_labels)
+        self.btn_prev_image.clicked.connect(self.prev_image)
+        self.btn_next_image.clicked.connect(self.next_image)
+        self.btn_next_unlabeled.clicked.connect(self.next_unlabeled_image)
+        self.class_filter_combo.currentIndexChanged.connect(self.handle_class_filter)
+        self.btn_delete_box.clicked.connect(self.delete_selected_box)
+        self.btn_relabel_box.clicked.connect(self.relabel_selected_box)
+        self.btn_undo.clicked.connect(self.undo_edit)
+        self.btn_redo.clicked.connect(self.redo_edit)
+        QShortcut(QKeySequence.StandardKey.Undo, self, self.undo_edit)
+        QShortcut(QKeySequence.StandardKey.Redo, self, self.redo_edit)
+        QShortcut(QKeySequence("Ctrl+0"), self, self.image_label.fit_to_window)
+        QShortcut(QKeySequence("F12"), self, self.toggle_profiling)
+        # Flujo de teclado: clases, navegación y edición sin pasar por diálogos
+        for position in range(9):
+            QShortcut(QKeySequence(str(position + 1)), self, lambda position=position: self.preselect_class_at(position))
+        QShortcut(QKeySequence("D"), self, self.next_image)
+        QShortcut(QKeySequence("A"), self, self.prev_image)
+        QShortcut(QKeySequence("N"), self, self.next_unlabeled_image)
+        QShortcut(QKeySequence("C"), self, self.relabel_selected_box)
+        QShortcut(QKeySequence.StandardKey.Delete, self, self.delete_selected_box)
+        QShortcut(QKeySequence(Qt.Key.Key_Backspace), self, self.delete_selected_box)
+        QShortcut(QKeySequence(Qt.Key.Key_Escape), self, lambda: self.class_selection_list.setCurrentRow(-1))
+        self.quick_assign.class_chosen.connect(self.on_quick_assign_chosen)
+        self.quick_assign.cancelled.connect(self.on_quick_assign_cancelled)
+        self.perf_timer.timeout.connect(self.image_label.refresh_perf_overlay)
+        if perf.enabled: self.perf_timer.start()
+        self.btn_prelabel.clicked.connect(self.toggle_prelabel)
+        self.btn_share_folder.clicked.connect(self.share_folder)
+        self.btn_claim_chunk.clicked.connect(self.claim_next_chunk)
+        self.session_watcher.fileChanged.connect(self.check_shared_changes)
+        self.session_watcher.directoryChanged.connect(self.check_shared_changes)
+        self.session_timer.timeout.connect(self.check_shared_changes)
+        self.btn_accept_proposal.clicked.connect(lambda: self.accept_proposal())
+        self.btn_reject_proposal.clicked.connect(lambda: self.reject_proposal())
+        self.btn_accept_all_proposals.clicked.connect(self.accept_all_proposals)
+        self.boxes_list_view.selectionModel().currentChanged.connect(self.highlight_selected_box)
+        self.filmstrip.clicked.connect(self.jump_to_image)
+        self.class_selection_list.itemSelectionChanged.connect(self.handle_class_preselection)
+
+        self.update_button_states()
+
+    def handle_class_preselection(self):
+        selected_item = self.class_selection_list.currentItem()
+        if selected_item and selected_item.isSelected():
+            self.preselected_class_id = selected_item.data(Qt.ItemDataRole.UserRole)
+            self.last_class_id = self.preselected_class_id
+        else:
+            self.preselected_class_id = -1
+
+    def preselect_class_at(self, position):
+        if position < self.class_selection_list.count():
+            self.class_selection_list.setCurrentRow(position)
+
+    # --- Asignación Rápida ---
+
+    def request_class_for_new_box(self, rect_pixels):
+        """Pide la clase de una caja recién dibujada sin bloquear la interfaz."""
+        self.quick_assign_target = ("new", rect_pixels)
+        self.image_label.set_pending_rect(rect_pixels)
+        self._open_quick_assign(rect_pixels)
+
+    def _open_quick_assign(self, rect_pixels):
+        anchor = self.image_label.view.map_rect_to_widget(rect_pixels).bottomLeft() + QPoint(0, 4)
+        self.quick_assign.open_at(self.class_ids_by_name, self.last_class_id, self.image_label.mapToGlobal(anchor))
+
+    def on_quick_assign_chosen(self, class_id):
+        target, self.quick_assign_target = self.quick_assign_target, None
+        self.image_label.set_pending_rect(None)
+        if target is None or class_id not in self.class_map: return
+        self.last_class_id = class_id
+        kind, value = target
+        if kind == "new":
+            yolo_data = (class_id, *self.image_label.rect_to_yolo(value))
+            self.add_new_box(value, self.class_map[class_id], yolo_data)
+        else:
+            self.relabel_box(value, class_id)
+
+    def on_quick_assign_cancelled(self):
+        self.quick_assign_target = None
+        self.image_label.set_pending_rect(None)
+
+    def handle_class_filter(self):
+        class_id = self.class_filter_combo.currentData()
+        self.filter_class_id = class_id if class_id is not None else -1
+    
+    # --- Perfilado ---
+
+    def toggle_profiling(self):
+        """Activa o desactiva la medición de tiempos; al desactivarla se vuelcan las muestras."""
+        if perf.enabled:
+            path = self.dump_profile()
+            perf.enabled = False
+            self.perf_timer.stop()
+            if path: self.status_label.setText(f"Perfil guardado en {path} (y .csv)")
+        else:
+            perf.clear()
+            perf.enabled = True
+            self.perf_timer.start()
+            self.status_label.setText("Perfilado activado (F12 para detener y guardar)")
+        self.image_label.refresh_perf_overlay()
+
+    def dump_profile(self):
+        """Guarda las muestras en JSON y CSV dentro de la carpeta de caché. Devuelve la ruta JSON."""
+        if not perf.samples: return None
+        folder = os.path.join(self.cache_folder or os.getcwd(), "perf")
+        base = os.path.join(folder, time.strftime("perf-%Y%m%d-%H%M%S"))
+        try:
+            perf.dump(base + ".json")
+            perf.dump(base + ".csv")
+        except OSError as e:
+            print(f"No se pudo guardar el perfil: {e}")
+            return None
+        return base + ".json"
+
+    # --- Sesión Compartida ---
+
+    def share_folder(self):
+        """Convierte la carpeta abierta en compartida y la reabre en modo sesión."""
+        reply = QMessageBox.question(
+            self, "Compartir Carpeta",
+            "Todos los que abran esta carpeta trabajarán en modo sesión: cada imagen abierta queda reservada, "
+            "los cambios simultáneos se fusionan y las imágenes se reparten por lotes. ¿Continuar?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if reply != QMessageBox.StandardButton.Yes: return
+        os.makedirs(shared.session_folder(self.cache_folder), exist_ok=True)
+        self.open_folder(self.image_folder)
+
+    def close_session(self):
+        self.session_timer.stop()
+        if self.session_watcher.files(): self.session_watcher.removePaths(self.session_watcher.files())
+        if self.session_watcher.directories(): self.session_watcher.removePaths(self.session_watcher.directories())
+        if self.session is not None: self.session.close()
+        self.session = None
+        self.image_holder = None
+
+    def start_session_watch(self):
+        self.session_group.setVisible(self.session is not None)
+        if self.session is None: return
+        self.session_timer.start()
+        self.watch_path(os.path.join(self.image_folder, CLASSES_FILE_NAME))
+        self.update_session_label()
+
+    def watch_path(self, path):
+        # Un reemplazo atómico deja al watcher sin el fichero: se vuelve a añadir
+        if os.path.exists(path) and path not in self.session_watcher.files():
+            self.session_watcher.addPath(path)
+
+    def take_image_lease(self):
+        """Reserva la imagen actual y suelta la anterior. Si otro la tiene, queda en sólo lectura."""
+        if self.session is None: return
+        image_file = self.image_files[self.current_image_index]
+        self.session.leases.release_all()
+        self.image_holder = self.session.leases.acquire(image_file)
+        for path in self.session_watcher.files():
+            if not path.endswith(CLASSES_FILE_NAME): self.session_watcher.removePath(path)
+        label_path = self.annotations.label_path(image_file)
+        self.watch_path(label_path)
+        # Las cajas que otro guardó mientras no mirábamos esta imagen
+        self.annotations.reload_if_changed(image_file)
+
+    def read_only_reason(self, image_file):
+        """Motivo por el que no se pueden editar las cajas de la imagen, o None."""
+        error = self.annotations.unreadable.get(image_file)
+        if error is not None:
+            return f"No se pudo leer la etiqueta de {image_file} ({error}); no se puede editar."
+        if self.session is None or self.image_holder is None: return None
+        if image_file != self.image_files[self.current_image_index]: return None
+        return f"{image_file} está en uso por {self.image_holder}; los cambios no se guardan."
+
+    def is_read_only(self, image_file):
+        reason = self.read_only_reason(image_file)
+        if reason is not None: self.status_label.setText(reason)
+        return reason is not None
+
+    def check_shared_changes(self, *_):
+        """Recoge lo que otros etiquetadores cambiaron en la imagen actual o en las clases."""
+        if self.session is None or not self.image_folder: return
+        self.watch_path(os.path.join(self.image_folder, CLASSES_FILE_NAME))
+        if self._classes_stamp() != self.classes_stamp:
+            self.on_classes_changed_elsewhere()
+        if not 0 <= self.current_image_index < len(self.image_files): return
+        image_file = self.image_files[self.current_image_index]
+        self.watch_path(self.annotations.label_path(image_file))
+        if self.image_holder is not None:
+            # Si el otro etiquetador la soltó, se reserva para poder editarla
+            self.image_holder = self.session.leases.acquire(image_file)
+            self.update_status_label()
+            self.update_button_states()
+        if not self.annotations.changed_on_disk(image_file): return
+        if self.annotations.has_pending_changes():
+            self.flush_annotations() # la fusión recarga la vista
+        elif self.annotations.reload_if_changed(image_file):
+            self.load_boxes_for_current_image()
+            self.status_label.setText(f"{image_file} actualizada con los cambios de otro etiquetador.")
+
+    def on_classes_changed_elsewhere(self):
+        self.load_classes()
+        if 0 <= self.current_image_index < len(self.image_files):
+            self.load_boxes_for_current_image()
+        self.status_label.setText("Otro etiquetador cambió las clases; se han recargado.")
+
+    def on_annotations_merged(self, merged):
+        """Tras fusionar con cambios de otros, refresca la vista y resuelve los conflictos."""
+        current = self.image_files[self.current_image_index] if 0 <= self.current_image_index < len(self.image_files) else None
+        if current in merged:
+            self.load_boxes_for_current_image()
+        conflicts = {image_file: pairs for image_file, pairs in merged.items() if pairs}
+        if not conflicts:
+            self.status_label.setText(f"Cambios fusionados con los de otro etiquetador en {len(merged)} imágenes.")
+            return
+        count = sum(len(pairs) for pairs in conflicts.values())
+        dialog = QMessageBox(QMessageBox.Icon.Warning, "Cambios Simultáneos",
+                          f"Otro etiquetador cambió a la vez {count} cajas que coinciden con las tuyas en {len(conflicts)} imágenes "
+                          f"({', '.join(list(conflicts)[:3])}{'...' if len(conflicts) > 3 else ''}). ¿Qué versión se conserva?", parent=self)
+        keep_ours = dialog.addButton("Las mías", QMessageBox.ButtonRole.AcceptRole)
+        keep_theirs = dialog.addButton("Las suyas", QMessageBox.ButtonRole.AcceptRole)
+        dialog.addButton("Ambas", QMessageBox.ButtonRole.RejectRole)
+        dialog.exec()
+        if dialog.clickedButton() not in (keep_ours, keep_theirs): return
+        # Se borran las cajas descartadas como cambios normales, así que se pueden deshacer
+        discard_index = 1 if dialog.clickedButton() is keep_ours else 0
+        for image_file, pairs in conflicts.items():
+            records = self.annotations.records(image_file)
+            for pair in pairs:
+                line = pair[discard_index]
+                box_id = next((box_id for box_id, record in records.items() if record == line), None)
+                if box_id is not None:
+                    self.apply_edit(EditCommand("delete", image_file, box_id, line, None))
+        self.flush_annotations()
+
+    def claim_next_chunk(self):
+        if self.session is None or self.folder_scanner is not None: return
+        self.flush_annotations()
+        span = self.session.queue.claim(self.image_files)
+        if span is None:
+            QMessageBox.information(self, "Sesión Compartida", "No quedan lotes libres.")
+        else:
+            self.current_image_index = span[0]
+            self.show_current_image()
+        self.update_session_label()
+
+    def update_session_label(self):
+        if self.session is None: return
+        done, assigned, total = self.session.queue.progress()
+        span = self.session.queue.current(self.image_files) if self.folder_scanner is None else None
+        chunk = f"Tu lote: imágenes {span[0] + 1}-{span[1]}" if span else "Sin lote asignado"
+        self.session_label.setText(f"{self.session.owner}\n{chunk}\nLotes: {done} terminados, {assigned} en curso, {total} en total")
+
+    # --- Pre-etiquetado ---
+
+    def toggle_prelabel(self):
+        if self.prelabel_queue.is_running():
+            self.prelabel_queue.stop()
+        else:
+            model_path, _ = QFileDialog.getOpenFileName(self, "Seleccionar Modelo ONNX", "", "Modelos ONNX (*.onnx)")
+            if model_path:
+                self.prelabel_queue.start(model_path, self.image_folder, self.cache_folder)
+                self.prelabel_queue.set_focus(self.image_files, self.current_image_index)
+        running = self.prelabel_queue.is_running()
+        self.btn_prelabel.setChecked(running)
+        self.proposals_group.setVisible(running)
+        self.load_proposals_for_current_image()
+
+    def on_prelabel_failed(self, message):
+        self.btn_prelabel.setChecked(False)
+        self.proposals_group.setVisible(False)
+        self.load_proposals_for_current_image()
+        QMessageBox.critical(self, "Error de Pre-etiquetado", message)
+
+    def on_predictions_ready(self, rel_path):
+        if 0 <= self.current_image_index < len(self.image_files) and self.image_files[self.current_image_index] == rel_path:
+            self.load_proposals_for_current_image()
+
+    def load_proposals_for_current_image(self):
+        proposals = []
+        if 0 <= self.current_image_index < len(self.image_files):
+            image_file = self.image_files[self.current_image_index]
+            raw = self.prelabel_queue.proposals(image_file) or []
+            img_size = self.metadata_index.image_size(image_file) if raw else None
+            existing = [parse_yolo_line(box['yolo_line']) for box in self.boxes_model.boxes]
+            for source in raw if img_size else []:
+                class_id, x_c, y_c, w, h, score = source
+                # Clases que no existen en classes.csv o ya etiquetadas no se proponen
+                if class_id not in self.class_map: continue
+                if any(box[0] == class_id and box_iou(box[1:], (x_c, y_c, w, h)) >= self.PROPOSAL_OVERLAP_IOU for box in existing): continue
+                rect_pixels = self.yolo_to_rect(x_c, y_c, w, h, img_size)
+                if rect_pixels is None:
+                    print(f"Propuesta ignorada en {image_file}: {source}")
+                    continue
+                proposals.append({'rect_pixels': rect_pixels, 'label': f"{self.class_map[class_id]} {score:.2f}",
+                                  'yolo_data': (class_id, x_c, y_c, w, h), 'source': source})
+        self.image_label.load_proposals(proposals)
+        self.update_button_states()
+
+    def select_proposal(self, index):
+        self.image_label.set_selected_proposal(index)
+        if index != -1: self.select_box_row(-1)
+        self.update_button_states()
+
+    def accept_proposal(self, index=None):
+        """Convierte una propuesta (por defecto, la seleccionada) en una caja real.
+        Devuelve False si no se pudo añadir; en ese caso la propuesta se conserva."""
+        index = self.image_label.selected_proposal if index is None else index
+        if not 0 <= index < len(self.image_label.proposals): return False
+        proposal = self.image_label.proposals[index]
+        class_id = proposal['yolo_data'][0]
+        # Sólo se quita de la caché si la caja llegó a añadirse
+        if not self.add_new_box(QRect(proposal['rect_pixels']), self.class_map[class_id], proposal['yolo_data']): return False
+        self._discard_proposal(index)
+        return True
+
+    def reject_proposal(self, index=None):
+        index = self.image_label.selected_proposal if index is None else index
+        if 0 <= index < len(self.image_label.proposals):
+            self._discard_proposal(index)
+
+    def accept_all_proposals(self):
+        while self.image_label.proposals:
+            if not self.accept_proposal(len(self.image_label.proposals) - 1): break
+
+    def _discard_proposal(self, index):
+        proposal = self.image_label.proposals[index]
+        self.prelabel_queue.discard(self.image_files[self.current_image_index], proposal['source'])
+        self.image_label.remove_proposal(index)
+        self.update_button_states()
+
+    def select_box_row(self, row):
+        """Selecciona una caja de la lista (desde el lienzo); -1 quita la selección."""
+        if row < 0:
+            self.boxes_list_view.clearSelection()
+            self.boxes_list_view.setCurrentIndex(QModelIndex())
+        else:
+            index = self.boxes_model.index(row)
+            self.boxes_list_view.setCurrentIndex(index)
+            self.boxes_list_view.scrollTo(index)
+        self.highlight_selected_box()
+
+    def select_box(self, box_id):
+        """Selecciona una caja por su ID (desde el lienzo); None quita la selección."""
+        self.select_box_row(self.boxes_model.row_of(box_id) if box_id is not None else -1)
+
+    def highlight_selected_box(self):
+        row = self.boxes_list_view.currentIndex().row()
+        self.image_label.set_selected_box(self.boxes_model.boxes[row]['box_id'] if row >= 0 else None)
+        self.update_button_states()
+
+    def update_button_states(self):
+        has_images = bool(self.image_files)
+        self.btn_prev_image.setEnabled(has_images and self.current_image_index > 0)
+        self.btn_next_image.setEnabled(has_images and self.current_image_index < len(self.image_files) - 1)
+        self.btn_next_unlabeled.setEnabled(has_images and self.annotation_index is not None and self.index_reconciled)
+        self.class_filter_combo.setEnabled(bool(self.image_folder))
+        self.btn_manage_labels.setEnabled(bool(self.image_folder))
+        self.btn_delete_box.setEnabled(self.boxes_list_view.currentIndex().isValid())
+        self.btn_relabel_box.setEnabled(self.boxes_list_view.currentIndex().isValid() and bool(self.class_map))
+        current_image = self.image_files[self.current_image_index] if 0 <= self.current_image_index < len(self.image_files) else None
+        self.btn_undo.setEnabled(self.journal is not None and self.journal.can_undo(current_image))
+        self.btn_redo.setEnabled(self.journal is not None and self.journal.can_redo(current_image))
+        self.btn_prelabel.setEnabled(bool(self.image_folder) and prelabel.prelabel_available())
+        self.btn_share_folder.setEnabled(bool(self.image_folder) and shared.session_available() and self.session is None)
+        self.btn_claim_chunk.setEnabled(self.session is not None and self.folder_scanner is None and bool(self.image_files))
+        has_selected_proposal = 0 <= self.image_label.selected_proposal < len(self.image_label.proposals)
+        # Aceptar una propuesta en una imagen de sólo lectura la descartaría sin añadir la caja
+        editable = current_image is not None and self.annotations is not None and self.read_only_reason(current_image) is None
+        self.btn_accept_proposal.setEnabled(has_selected_proposal and editable)
+        self.btn_reject_proposal.setEnabled(has_selected_proposal)
+        self.btn_accept_all_proposals.setEnabled(bool(self.image_label.proposals) and editable)
+
+    def select_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Seleccionar Carpeta de Imágenes")
+        if folder:
+            self.open_folder(folder)
+
+    def open_folder(self, folder):
+        self.flush_annotations()
+        if self.metadata_index: self.metadata_index.save()
+        self.image_folder = folder
+        # NUEVO: Definir y crear la carpeta de etiquetas
+        self.labels_folder = os.path.join(self.image_folder, LABELS_FOLDER_NAME)
+        os.makedirs(self.labels_folder, exist_ok=True)
+        # Carpeta para cachés internas (metadatos, tiles...)
+        self.cache_folder = os.path.join(self.image_folder, CACHE_FOLDER_NAME)
+        self.prefetcher.clear()
+        self.tile_pyramid.cache_folder = self.cache_folder
+        self.thumbnails.set_folders(self.image_folder, self.cache_folder)
+        self.metadata_index = ImageMetadataIndex(self.image_folder, os.path.join(self.cache_folder, "metadata.json"), probe_image_size)
+        if self.annotation_index: self.annotation_index.close()
+        self.annotation_index = None
+        try:
+            self.annotation_index = AnnotationIndex(os.path.join(self.image_folder, "annotations.db"))
+            self.start_index_reconcile()
+        except sqlite3.Error as e:
+            print(f"Índice de anotaciones desactivado: {e}")
+        self.close_session()
+        if shared.session_available() and shared.is_shared(self.cache_folder):
+            self.session = shared.SharedSession(self.cache_folder)
+        if self.journal: self.journal.close()
+        self.journal = EditJournal(self.session.journal_path() if self.session else os.path.join(self.cache_folder, "journal.log"))
+        self.annotations = self.new_annotation_store()
+        self.restore_unsaved_changes()
+        self.last_shown_index = -1
+        if self.prelabel_queue.is_running():
+            self.prelabel_queue.start(self.prelabel_queue.model_path, self.image_folder, self.cache_folder)
+        
+        self.load_classes()
+        self.load_image_list()
+        self.start_session_watch()
+        self.update_button_states()
+
+    def new_annotation_store(self):
+        return AnnotationStore(self.labels_folder, self.annotation_index, self.journal,
+                               lock=self.session.lock if self.session else None)
+
+    def closeEvent(self, event):
+        self.stop_folder_scan()
+        self.prelabel_queue.stop()
+        self.flush_annotations()
+        self.close_session()
+        if self.journal: self.journal.close()
+        self._reconcile_pool.waitForDone()
+        if self.annotation_index: self.annotation_index.close()
+        if self.metadata_index: self.metadata_index.save()
+        if perf.enabled: self.dump_profile()
+        super().closeEvent(event)
+
+    def load_image_list(self):
+        # El escaneo corre en segundo plano; la primera imagen se muestra en cuanto llega
+        self.stop_folder_scan()
+        self.image_files = []
+        self.image_list_model.reset_images(self.image_files)
+        self.current_image_index = -1
+        self.status_label.setText("Buscando imágenes...")
+        self.folder_scanner = FolderScanner(self.image_folder, os.path.join(self.cache_folder, "manifest.json"), self)
+        self.folder_scanner.batch_found.connect(self.on_images_found)
+        self.folder_scanner.scan_finished.connect(self.on_scan_finished)
+        self.folder_scanner.start()
+
+    def stop_folder_scan(self):
+        if self.folder_scanner is not None:
+            self.folder_scanner.batch_found.disconnect(self.on_images_found)
+            self.folder_scanner.scan_finished.disconnect(self.on_scan_finished)
+            self.folder_scanner.cancel()
+            self.folder_scanner.wait()
+            self.folder_scanner = None
+
+    def on_images_found(self, image_files):
+        # Un lote ya encolado de un escaneo cancelado no debe mezclarse con la carpeta nueva
+        if self.sender() is not self.folder_scanner: return
+        self.image_files.extend(image_files)
+        self.image_list_model.images_appended(len(image_files))
+        if self.current_image_index == -1:
+            self.current_image_index = 0
+            self.show_current_image()
+        else:
+            self.update_status_label()
+            self.update_button_states()
+
+    def on_scan_finished(self, total):
+        if self.sender() is not self.folder_scanner: return
+        self.folder_scanner = None
+        if not self.image_files:
+            QMessageBox.warning(self, "Sin Imágenes", "La carpeta no contiene imágenes (.jpg, .png).")
+            self.image_folder = ""
+            self.status_label.setText("Selecciona una carpeta para comenzar.")
+        self.update_status_label()
+        self.update_session_label()
+        self.update_button_states()
+
+    def update_status_label(self):
+        if not 0 <= self.current_image_index < len(self.image_files): return
+        scanning = " (buscando más...)" if self.folder_scanner is not None else ""
+        busy = f" — en uso por {self.image_holder}, sólo lectura" if self.image_holder else ""
+        if self.annotations and self.image_files[self.current_image_index] in self.annotations.unreadable:
+            busy = " — no se pudo leer su .txt, sólo lectura"
+        self.status_label.setText(f"Imagen {self.current_image_index + 1}/{len(self.image_files)}{scanning}: {self.image_files[self.current_image_index]}{busy}")
+    
+    def load_classes(self):
+        path = os.path.join(self.image_folder, CLASSES_FILE_NAME)
+        if not os.path.exists(path):
+            # Se crea con las clases por defecto, salvo que otro etiquetador lo cree antes
+            self.classes_stamp = None
+            self.class_map = {0: "persona", 1: "pez"}
+            if self.save_classes() or not os.path.exists(path):
+                self.populate_class_selection_list()
+                return
+        try:
+            self.classes_stamp = self._classes_stamp()
+            self.class_map = read_classes(path)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"No se pudo leer 'classes.csv': {e}")
+            self.class_map = {}
+        self.populate_class_selection_list()
+
+    def populate_class_selection_list(self):
+        self.class_ids_by_name = {name: class_id for class_id, name in self.class_map.items()}
+        self.class_selection_list.clear()
+        for class_id, name in self.class_map.items():
+            item = QListWidgetItem(name)
+            item.setData(Qt.ItemDataRole.UserRole, class_id)
+            self.class_selection_list.addItem(item)
+        self.class_filter_combo.blockSignals(True)
+        self.class_filter_combo.clear()
+        self.class_filter_combo.addItem("Todas las imágenes", -1)
+        for class_id, name in self.class_map.items():
+            self.class_filter_combo.addItem(f"Con '{name}'", class_id)
+        index = self.class_filter_combo.findData(self.filter_class_id)
+        self.class_filter_combo.setCurrentIndex(max(0, index))
+        self.filter_class_id = self.class_filter_combo.currentData()
+        self.class_filter_combo.blockSignals(False)
+        self.refresh_class_counts()
+
+    def refresh_class_counts(self):
+        """Muestra el número de cajas de cada clase en todo el dataset, según el índice."""
+        if self.annotation_index is None: return
+        try:
+            class_counts = self.annotation_index.class_counts()
+        except sqlite3.Error as e:
+            print(f"No se pudo consultar el índice de anotaciones: {e}")
+            return
+        for row in range(self.class_selection_list.count()):
+            item = self.class_selection_list.item(row)
+            class_id = item.data(Qt.ItemDataRole.UserRole)
+            item.setText(f"{self.class_map[class_id]} ({class_counts.get(class_id, 0)})")
+
+    def start_index_reconcile(self):
+        self.index_reconciled = False
+        self.update_button_states()
+        self._reconcile_pool.start(_IndexReconcileTask(self.annotation_index.db_path, self.labels_folder, self._reconcile_signals))
+
+    def on_index_reconciled(self, db_path, changed):
+        if self.annotation_index is None or db_path != self.annotation_index.db_path: return
+        self.index_reconciled = True
+        self.image_list_model.set_label_counts(self.annotation_index.box_counts())
+        self.refresh_class_counts()
+        self.update_button_states()
+
+    def _classes_stamp(self):
+        try:
+            stat = os.stat(os.path.join(self.image_folder, CLASSES_FILE_NAME))
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def save_classes(self):
+        """Guarda classes.csv. En sesión compartida no sobrescribe cambios de otros: si el
+        fichero cambió desde que se leyó, no lo escribe y devuelve False. Recargar las
+        clases queda a cargo de quien llama, así que nunca se vuelve a `load_classes`."""
+        path = os.path.join(self.image_folder, CLASSES_FILE_NAME)
+        try:
+            if self.session is None:
+                write_classes(path, self.class_map)
+                return True
+            with self.session.lock(CLASSES_FILE_NAME):
+                if self._classes_stamp() != self.classes_stamp:
+                    return False
+                write_classes(path, self.class_map)
+                self.classes_stamp = self._classes_stamp()
+            return True
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"No se pudo guardar 'classes.csv': {e}")
+            return False
+
+    def manage_labels(self):
+        dialog = ManageLabelsDialog(self.class_map, self)
+        if dialog.exec():
+            mapping = dialog.get_id_mapping()
+            if any(old_id != new_id for old_id, new_id in mapping.items()):
+                if self.session is not None:
+                    # Reescribir todas las etiquetas mientras otros las editan mezclaría IDs viejos y nuevos
+                    QMessageBox.warning(self, "Sesión Compartida", "No se pueden borrar ni reordenar clases en una carpeta compartida. Añade o renombra clases, o reasigna los IDs cuando nadie más esté trabajando en la carpeta.")
+                    return
+                reply = QMessageBox.question(self, "Reasignar IDs", "Los IDs de clase han cambiado y se reescribirán todos los archivos de etiquetas. ¿Continuar?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+                if reply != QMessageBox.StandardButton.Yes or not self.remap_class_ids(mapping):
+                    return
+            self.class_map = dialog.get_updated_labels()
+            if not self.save_classes():
+                if self.session is not None and self._classes_stamp() != self.classes_stamp:
+                    self.on_classes_changed_elsewhere()
+                    QMessageBox.warning(self, "Sesión Compartida", "Otro etiquetador modificó 'classes.csv' mientras tanto. Se han cargado sus clases y tus cambios no se guardaron; vuelve a aplicarlos.")
+                return
+            self.populate_class_selection_list()
+            if 0 <= self.current_image_index < len(self.image_files):
+                self.load_boxes_for_current_image()
+
+    def remap_class_ids(self, mapping):
+        """Reescribe los archivos de etiquetas con el nuevo mapa de IDs. Devuelve True si se aplicó."""
+        self.flush_annotations()
+        if self.annotations.has_pending_changes(): return False
+        worker = RemapWorker(self.labels_folder, mapping, self)
+        progress = QProgressDialog("Reescribiendo archivos de etiquetas...", "Cancelar", 0, 0, self)
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(300)
+        worker.progress.connect(lambda done, total: (progress.setMaximum(total), progress.setValue(done)))
+        progress.canceled.connect(worker.cancel_event.set)
+        loop = QEventLoop()
+        worker.finished.connect(loop.quit)
+        worker.start()
+        loop.exec()
+        progress.close()
+
+        if worker.cancelled:
+            self.status_label.setText("Reasignación cancelada; no se modificó ningún archivo.")
+            return False
+        if worker.error is not None:
+            QMessageBox.critical(self, "Error", f"No se pudieron reescribir las etiquetas; se restauraron los originales.\n{worker.error}")
+            return False
+        # Los ficheros cambiaron en disco: se descarta la caché en memoria y el historial, y se reindexa
+        self.journal.reset()
+        self.annotations = self.new_annotation_store()
+        if self.annotation_index is not None:
+            self.start_index_reconcile()
+        self.status_label.setText(f"IDs de clase reasignados en {worker.changed} archivos.")
+        return True
+
+    def show_current_image(self):
+        # Al navegar se escriben las etiquetas pendientes de la imagen anterior
+        self.flush_annotations()
+        if 0 <= self.current_image_index < len(self.image_files):
+            image_path = os.path.join(self.image_folder, self.image_files[self.current_image_index])
+            # Un salto lejano deja obsoleta la precarga en curso
+            if abs(self.current_image_index - self.last_shown_index) > self.PREFETCH_AHEAD + self.PREFETCH_BEHIND:
+                self.prefetcher.cancel()
+            self.last_shown_index = self.current_image_index
+            self.take_image_lease()
+            entry = self.prefetcher.take(image_path)
+            with perf.measure("show", "precargada" if entry is not None else "síncrona"):
+                pixmap, image_size = entry if entry is not None else self.prefetcher.load_now(image_path)
+            # Con una imagen reducida, la pirámide da la resolución real al hacer zoom
+            needs_pyramid = pixmap.width() > 0 and image_size.width() > pixmap.width()
+            self.tile_pyramid.set_source(image_path if needs_pyramid else None, image_size, pixmap.size())
+            self.image_label.setPixmap(pixmap, image_size)
+            self.update_status_label()
+            self.load_boxes_for_current_image()
+            self.load_proposals_for_current_image()
+            self.prelabel_queue.set_focus(self.image_files, self.current_image_index)
+            current = self.image_list_model.index(self.current_image_index)
+            self.filmstrip.setCurrentIndex(current)
+            self.filmstrip.scrollTo(current)
+            self.schedule_prefetch()
+        self.update_button_states()
+
+    def schedule_prefetch(self):
+        # Primero la siguiente y la anterior, después el resto de la ventana
+        offsets = []
+        for step in range(1, max(self.PREFETCH_AHEAD, self.PREFETCH_BEHIND) + 1):
+            if step <= self.PREFETCH_AHEAD: offsets.append(step)
+            if step <= self.PREFETCH_BEHIND: offsets.append(-step)
+        indices = [self.current_image_index + o for o in offsets]
+        self.prefetcher.request([os.path.join(self.image_folder, self.image_files[i])
+                                 for i in indices if 0 <= i < len(self.image_files)])
+
+    def jump_to_image(self, index):
+        if index.isValid() and index.row() != self.current_image_index:
+            self.current_image_index = index.row()
+            self.show_current_image()
+
+    def update_label_count(self):
+        image_file = self.image_files[self.current_image_index]
+        self.image_list_model.set_label_count(image_file, self.annotations.box_count(image_file))
+
+    def next_image(self):
+        self._step_to_image(1)
+
+    def prev_image(self):
+        self._step_to_image(-1)
+
+    def _step_to_image(self, step, accept=None):
+        """Avanza en la dirección `step` hasta la primera imagen aceptada por el filtro."""
+        self.flush_annotations()
+        if accept is None and self.filter_class_id != -1 and self.annotation_index is not None:
+            with_class = self.annotation_index.images_with_class(self.filter_class_id)
+            accept = lambda stem: stem in with_class
+        index = self.current_image_index + step
+        while 0 <= index < len(self.image_files):
+            if accept is None or accept(os.path.splitext(self.image_files[index])[0]):
+                self.current_image_index = index
+                self.show_current_image()
+                return True
+            index += step
+        return False
+
+    def next_unlabeled_image(self):
+        if self.annotation_index is None or not self.index_reconciled: return
+        self.flush_annotations()
+        labeled = self.annotation_index.labeled_images()
+        if not self._step_to_image(1, lambda stem: stem not in labeled):
+            self.status_label.setText("No hay más imágenes sin etiquetar a partir de la actual.")
+            
+    def add_new_box(self, rect_pixels, label, yolo_data):
+        """Añade una caja a la imagen actual. Devuelve False si la imagen es de sólo lectura."""
+        image_file = self.image_files[self.current_image_index]
+        if self.is_read_only(image_file): return False
+        box_id = self.annotations.new_box_id(image_file)
+        self.apply_edit(EditCommand("add", image_file, box_id, None, format_yolo_line(*yolo_data)))
+        return True
+
+    # --- Cambios y Deshacer/Rehacer ---
+
+    def apply_edit(self, command):
+        """Aplica un cambio, lo anota en el historial y actualiza la vista."""
+        if self.is_read_only(command.image_file): return
+        command.apply(self.annotations)
+        self.journal.record(command)
+        self.on_edit_applied(command)
+
+    def undo_edit(self):
+        self._step_history(self.journal.undo if self.journal else None)
+
+    def redo_edit(self):
+        self._step_history(self.journal.redo if self.journal else None)
+
+    def _step_history(self, step):
+        if step is None or not 0 <= self.current_image_index < len(self.image_files): return
+        if self.is_read_only(self.image_files[self.current_image_index]): return
+        try:
+            command = step(self.annotations, self.image_files[self.current_image_index])
+        except ValueError as e:
+            QMessageBox.warning(self, "Historial", f"No se pudo aplicar el cambio: {e}")
+            return
+        if command is not None:
+            self.on_edit_applied(command)
+
+    def on_edit_applied(self, command):
+        """Refleja en la lista y el lienzo sólo la caja afectada por un cambio."""
+        self.schedule_flush()
+        if command.image_file != self.image_files[self.current_image_index]:
+            self.update_button_states()
+            return
+        row = self.boxes_model.row_of(command.box_id)
+        img_size = self.metadata_index.image_size(command.image_file) or (self.image_label.image_size.width(), self.image_label.image_size.height())
+        box = self.make_box(command.box_id, command.new_line, img_size) if command.new_line is not None else None
+        if row != -1 and box is not None:
+            self.boxes_model.update_box(row, box)
+            self.image_label.update_box(box)
+        elif row != -1:
+            if self.boxes_list_view.currentIndex().row() == row: self.select_box_row(-1)
+            self.boxes_model.remove_box(row)
+            self.image_label.remove_box(command.box_id)
+        elif box is not None:
+            self.boxes_model.insert_box(box)
+            self.image_label.insert_box(box)
+        self.update_label_count()
+        self.update_button_states()
+
+    @staticmethod
+    def yolo_to_rect(x_c, y_c, w, h, img_size):
+        """Rectángulo en píxeles de una caja normalizada, o None si no cabe en un QRect."""
+        img_w, img_h = img_size
+        values = ((x_c - w/2) * img_w, (y_c - h/2) * img_h, w * img_w, h * img_h)
+        # Con margen para que también quepan left() + width() y similares
+        if not all(abs(v) < 2**30 for v in values): return None
+        return QRect(*map(int, values))
+
+    def make_box(self, box_id, yolo_line, img_size=None, rect_pixels=None):
+        """Construye el dict de una caja a partir de su línea YOLO, o None si no es válida."""
+        parsed = parse_yolo_line(yolo_line)
+        if parsed is None: return None
+        class_id, x_c, y_c, w, h = parsed
+        if rect_pixels is None:
+            rect_pixels = self.yolo_to_rect(x_c, y_c, w, h, img_size)
+            if rect_pixels is None: return None
+        label = self.class_map.get(class_id, f"ID:{class_id}?")
+        return {'rect_pixels': rect_pixels, 'label': label, 'class_id': class_id, 'yolo_line': yolo_line, 'box_id': box_id}
+
+    def schedule_flush(self):
+        self.flush_timer.start(self.FLUSH_DELAY_MS)
+
+    def flush_annotations(self):
+        self.flush_timer.stop()
+        if not self.annotations or not self.annotations.has_pending_changes(): return
+        errors = self.annotations.flush()
+        if errors:
+            details = "\n".join(f"{image_file}: {e}" for image_file, e in errors)
+            QMessageBox.critical(self, "Error de Escritura", f"No se pudo guardar en .txt:\n{details}")
+        if self.annotations.merged:
+            self.on_annotations_merged(self.annotations.merged)
+        self.refresh_class_counts()
+            
+    def load_boxes_for_current_image(self):
+        boxes = []
+        image_file = self.image_files[self.current_image_index]
+        records = self.annotations.records(image_file)
+        if image_file in self.annotations.unreadable: self.update_status_label()
+
+        if records:
+            # Las dimensiones salen del índice de metadatos, sin depender del pixmap
+            img_size = self.metadata_index.image_size(image_file) or (self.image_label.image_size.width(), self.image_label.image_size.height())
+            for box_id, line in records.items():
+                box = self.make_box(box_id, line, img_size)
+                if box is None:
+                    print(f"Línea ignorada en {image_file}: '{line}'")
+                    continue
+                boxes.append(box)
+
+        with perf.measure("load_boxes", str(len(boxes))):
+            self.boxes_model.reset_boxes(boxes)
+            self.image_label.load_boxes(boxes)
+        self.update_label_count()
+        self.update_button_states()
+
+    def modify_box(self, box_id, rect_pixels):
+        """Guarda la nueva geometría de una caja movida o redimensionada en el lienzo."""
+        row = self.boxes_model.row_of(box_id)
+        if row == -1: return
+        box = self.boxes_model.boxes[row]
+        new_line = format_yolo_line(box['class_id'], *self.image_label.rect_to_yolo(rect_pixels))
+        if new_line != box['yolo_line']:
+            self.apply_edit(EditCommand("modify", self.image_files[self.current_image_index], box_id, box['yolo_line'], new_line))
+
+    def delete_selected_box(self):
+        row = self.boxes_list_view.currentIndex().row()
+        if row < 0: return
+        # Se elimina exactamente la caja seleccionada, aunque haya otras idénticas
+        box = self.boxes_model.boxes[row]
+        self.apply_edit(EditCommand("delete", self.image_files[self.current_image_index], box['box_id'], box['yolo_line'], None))
+
+    def relabel_selected_box(self):
+        row = self.boxes_list_view.currentIndex().row()
+        if row < 0 or not self.class_map: return
+        box = self.boxes_model.boxes[row]
+        self.quick_assign_target = ("relabel", box['box_id'])
+        self._open_quick_assign(box['rect_pixels'])
+
+    def relabel_box(self, box_id, class_id):
+        row = self.boxes_model.row_of(box_id)
+        if row == -1: return
+        box = self.boxes_model.boxes[row]
+        if class_id == box['class_id']: return
+        _, x_c, y_c, w, h = parse_yolo_line(box['yolo_line'])
+        new_line = format_yolo_line(class_id, x_c, y_c, w, h)
+        self.apply_edit(EditCommand("relabel", self.image_files[self.current_image_index], box['box_id'], box['yolo_line'], new_line))
+
+    def restore_unsaved_changes(self):
+        """Ofrece reaplicar los cambios que quedaron en el log tras un cierre inesperado."""
+        pending = self.journal.pending()
+        changes = [entry for entry in pending if entry.get("op") != "saved"]
+        if not changes:
+            # Sólo quedan marcas de IDs de la sesión anterior, que ya no sirven
+            self.journal.compact()
+            return
+        images = len({entry.get("image_file") for entry in changes})
+        reply = QMessageBox.question(
+            self, "Cambios sin Guardar",
+            f"La sesión anterior terminó con {len(changes)} cambios sin guardar en {images} imágenes. ¿Restaurarlos?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if reply == QMessageBox.StandardButton.Yes:
+            applied = self.journal.replay(self.annotations, pending)
+            self.flush_annotations()
+            self.status_label.setText(f"Restaurados {applied} cambios de la sesión anterior.")
+        else:
+            self.journal.compact()
+
+if __name__ == '__main__':
+    app = QApplication(sys.argv)
+    window = LabelingApp()
+    window.show()
+    sys.exit(app.exec())
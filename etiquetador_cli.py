@@ -0,0 +1,330 @@
+"""Herramienta de línea de comandos para datasets etiquetados en formato YOLOv8.
+
+Trabaja sobre la misma estructura que la aplicación gráfica (imágenes, `classes.csv`
+y la carpeta `Yolov8/`) sin depender de Qt, por lo que puede usarse en CI o en
+pipelines de datos. Los datasets se recorren en streaming y el trabajo por imagen se
+reparte entre varios procesos.
+
+    python etiquetador_cli.py validate CARPETA [--fix]
+    python etiquetador_cli.py stats CARPETA
+    python etiquetador_cli.py to-coco CARPETA salida.json
+    python etiquetador_cli.py from-coco anotaciones.json CARPETA
+    python etiquetador_cli.py to-voc CARPETA carpeta_xml
+    python etiquetador_cli.py from-voc carpeta_xml CARPETA
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import multiprocessing
+from collections import Counter
+from xml.etree import ElementTree
+
+from etiquetador_core import (
+    LABELS_FOLDER_NAME, CLASSES_FILE_NAME,
+    read_classes, write_classes, label_path_for, iter_image_files,
+    format_yolo_line, parse_yolo_line, atomic_write_text, validate_lines, read_image_size
+)
+
+CHUNK_SIZE = 64
+
+# --- Trabajo por Imagen (se ejecuta en los procesos del pool) ---
+
+_config = {}
+
+def _init_worker(config):
+    _config.update(config)
+
+def _read_label_lines(image_file):
+    """(líneas, existe, error). Un fichero ilegible o que no es UTF-8 no aborta el
+    recorrido: se devuelve sin líneas y con su error para que el comando lo informe."""
+    try:
+        with open(label_path_for(_config["labels_folder"], image_file), 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()], True, None
+    except FileNotFoundError:
+        return [], False, None
+    except (OSError, UnicodeDecodeError) as e:
+        return [], True, e
+
+def _unreadable_message(image_file, error):
+    return f"{label_path_for(LABELS_FOLDER_NAME, image_file)}: ilegible o no es UTF-8 ({error})"
+
+def _image_size(image_file):
+    return read_image_size(os.path.join(_config["image_folder"], image_file))
+
+def _validate_task(image_file):
+    lines, exists, error = _read_label_lines(image_file)
+    if error is not None: return image_file, [(None, f"ilegible o no es UTF-8 ({error})")], False
+    if not exists: return image_file, [], False
+    issues, fixed = validate_lines(lines, _config["class_ids"], _image_size(image_file), _config["fix"])
+    changed = _config["fix"] and bool(issues)
+    if changed:
+        atomic_write_text(label_path_for(_config["labels_folder"], image_file), "".join(line + "\n" for line in fixed))
+    return image_file, issues, changed
+
+def _stats_task(image_file):
+    lines, exists, error = _read_label_lines(image_file)
+    counts = Counter(parsed[0] for parsed in map(parse_yolo_line, lines) if parsed is not None)
+    return image_file, counts, exists, error
+
+def _boxes_task(image_file):
+    lines, _, error = _read_label_lines(image_file)
+    boxes = [parsed for parsed in map(parse_yolo_line, lines) if parsed is not None]
+    return image_file, _image_size(image_file), boxes, error
+
+def _voc_task(image_file):
+    _, size, boxes, error = _boxes_task(image_file)
+    if size is None or error is not None: return image_file, False, error
+    img_w, img_h = size
+    class_map = _config["class_map"]
+    root = ElementTree.Element("annotation")
+    ElementTree.SubElement(root, "folder").text = os.path.dirname(image_file)
+    ElementTree.SubElement(root, "filename").text = os.path.basename(image_file)
+    size_node = ElementTree.SubElement(root, "size")
+    ElementTree.SubElement(size_node, "width").text = str(img_w)
+    ElementTree.SubElement(size_node, "height").text = str(img_h)
+    ElementTree.SubElement(size_node, "depth").text = "3"
+    for class_id, x_c, y_c, w, h in boxes:
+        obj = ElementTree.SubElement(root, "object")
+        ElementTree.SubElement(obj, "name").text = class_map.get(class_id, str(class_id))
+        ElementTree.SubElement(obj, "difficult").text = "0"
+        bndbox = ElementTree.SubElement(obj, "bndbox")
+        ElementTree.SubElement(bndbox, "xmin").text = str(round((x_c - w / 2) * img_w))
+        ElementTree.SubElement(bndbox, "ymin").text = str(round((y_c - h / 2) * img_h))
+        ElementTree.SubElement(bndbox, "xmax").text = str(round((x_c + w / 2) * img_w))
+        ElementTree.SubElement(bndbox, "ymax").text = str(round((y_c + h / 2) * img_h))
+    xml_path = os.path.join(_config["output"], os.path.splitext(image_file)[0] + ".xml")
+    os.makedirs(os.path.dirname(xml_path), exist_ok=True)
+    ElementTree.ElementTree(root).write(xml_path, encoding="utf-8")
+    return image_file, True, None
+
+def _parse_voc_task(xml_rel_path):
+    root = ElementTree.parse(os.path.join(_config["voc_folder"], xml_rel_path)).getroot()
+    img_w = float(root.findtext("size/width"))
+    img_h = float(root.findtext("size/height"))
+    objects = []
+    for obj in root.iter("object"):
+        box = obj.find("bndbox")
+        xmin, ymin, xmax, ymax = (float(box.findtext(tag)) for tag in ("xmin", "ymin", "xmax", "ymax"))
+        objects.append((obj.findtext("name"), (xmin + xmax) / 2 / img_w, (ymin + ymax) / 2 / img_h,
+                        (xmax - xmin) / img_w, (ymax - ymin) / img_h))
+    return os.path.splitext(xml_rel_path)[0], objects
+
+# --- Comandos ---
+
+def _dataset_config(folder):
+    classes_path = os.path.join(folder, CLASSES_FILE_NAME)
+    class_map = read_classes(classes_path) if os.path.exists(classes_path) else {}
+    return {"image_folder": folder, "labels_folder": os.path.join(folder, LABELS_FOLDER_NAME), "class_map": class_map}
+
+def _pool(args, config):
+    return multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(config,))
+
+def cmd_validate(args):
+    config = _dataset_config(args.dataset)
+    config.update(class_ids=set(config["class_map"]) if config["class_map"] else None, fix=args.fix)
+    files_with_issues = total_issues = files_fixed = unreadable = 0
+    with _pool(args, config) as pool:
+        for image_file, issues, changed in pool.imap_unordered(_validate_task, iter_image_files(args.dataset), CHUNK_SIZE):
+            if not issues: continue
+            files_with_issues += 1
+            total_issues += len(issues)
+            files_fixed += changed
+            for line_number, description in issues:
+                # Los problemas sin número de línea son del fichero entero
+                location = f":{line_number}" if line_number is not None else ""
+                unreadable += line_number is None
+                print(f"{label_path_for(LABELS_FOLDER_NAME, image_file)}{location}: {description}")
+    action = f", {files_fixed} corregidos" if args.fix else ""
+    print(f"{total_issues} problemas en {files_with_issues} archivos{action}.", file=sys.stderr)
+    # --fix no puede arreglar un fichero que no se puede leer
+    return 1 if unreadable or (total_issues and not args.fix) else 0
+
+def cmd_stats(args):
+    config = _dataset_config(args.dataset)
+    class_counts, images, labeled, boxes, unreadable = Counter(), 0, 0, 0, 0
+    with _pool(args, config) as pool:
+        for image_file, counts, exists, error in pool.imap_unordered(_stats_task, iter_image_files(args.dataset), CHUNK_SIZE):
+            images += 1
+            if error is not None:
+                print(_unreadable_message(image_file, error), file=sys.stderr)
+                unreadable += 1
+            image_boxes = sum(counts.values())
+            labeled += image_boxes > 0
+            boxes += image_boxes
+            class_counts.update(counts)
+    class_map = config["class_map"]
+    stats = {
+        "images": images, "labeled_images": labeled, "unlabeled_images": images - labeled, "boxes": boxes,
+        "unreadable_label_files": unreadable,
+        "classes": {class_map.get(class_id, f"ID:{class_id}?"): count for class_id, count in sorted(class_counts.items())},
+    }
+    if args.json:
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+    else:
+        print(f"Imágenes: {images} ({labeled} etiquetadas, {images - labeled} sin etiquetar)")
+        print(f"Cajas: {boxes}")
+        if unreadable:
+            print(f"Etiquetas ilegibles (contadas como sin etiquetar): {unreadable}")
+        for name, count in stats["classes"].items():
+            print(f"  {name}: {count}")
+    return 0
+
+def cmd_to_coco(args):
+    config = _dataset_config(args.dataset)
+    class_map = config["class_map"]
+    # Las imágenes se escriben según llegan y las anotaciones pasan por un temporal,
+    # así nunca se tiene el dataset entero en memoria.
+    annotation_id = skipped = unreadable = 0
+    seen_class_ids = set(class_map)
+    with open(args.output, 'w', encoding='utf-8') as out, tempfile.TemporaryFile('w+', encoding='utf-8') as annotations, _pool(args, config) as pool:
+        out.write('{"images": [')
+        image_id = 0
+        for image_file, size, boxes, error in pool.imap(_boxes_task, iter_image_files(args.dataset), CHUNK_SIZE):
+            # Exportarla sin cajas la haría pasar por una imagen sin objetos
+            if error is not None:
+                print(_unreadable_message(image_file, error), file=sys.stderr)
+                unreadable += 1
+                continue
+            if size is None:
+                skipped += 1
+                continue
+            img_w, img_h = size
+            image_id += 1
+            out.write(("," if image_id > 1 else "") + json.dumps({"id": image_id, "file_name": image_file.replace(os.sep, "/"), "width": img_w, "height": img_h}))
+            for class_id, x_c, y_c, w, h in boxes:
+                annotation_id += 1
+                seen_class_ids.add(class_id)
+                bbox = [round((x_c - w / 2) * img_w, 2), round((y_c - h / 2) * img_h, 2), round(w * img_w, 2), round(h * img_h, 2)]
+                annotations.write(("," if annotation_id > 1 else "") + json.dumps({
+                    "id": annotation_id, "image_id": image_id, "category_id": class_id + 1,
+                    "bbox": bbox, "area": round(bbox[2] * bbox[3], 2), "iscrowd": 0}))
+        out.write('], "annotations": [')
+        annotations.seek(0)
+        while chunk := annotations.read(1 << 20):
+            out.write(chunk)
+        categories = [{"id": class_id + 1, "name": class_map.get(class_id, str(class_id))} for class_id in sorted(seen_class_ids)]
+        out.write('], "categories": ' + json.dumps(categories, ensure_ascii=False) + '}')
+    print(f"{annotation_id} anotaciones exportadas; {skipped} imágenes sin dimensiones legibles; "
+          f"{unreadable} omitidas por etiquetas ilegibles.", file=sys.stderr)
+    return 1 if unreadable else 0
+
+def _class_ids_for_names(dataset, names):
+    """Asigna IDs a nombres de clase respetando classes.csv y añadiendo las que falten."""
+    classes_path = os.path.join(dataset, CLASSES_FILE_NAME)
+    class_map = read_classes(classes_path) if os.path.exists(classes_path) else {}
+    name_to_id = {name: class_id for class_id, name in class_map.items()}
+    for name in names:
+        if name not in name_to_id:
+            class_id = max(class_map, default=-1) + 1
+            class_map[class_id] = name
+            name_to_id[name] = class_id
+    write_classes(classes_path, class_map)
+    return name_to_id
+
+def _write_labels(labels_folder, image_stem, boxes):
+    txt_path = os.path.join(labels_folder, image_stem + ".txt")
+    os.makedirs(os.path.dirname(txt_path), exist_ok=True)
+    atomic_write_text(txt_path, "".join(format_yolo_line(*box) + "\n" for box in boxes))
+
+def cmd_from_coco(args):
+    with open(args.input, 'r', encoding='utf-8') as f:
+        coco = json.load(f)
+    categories = {c["id"]: c["name"] for c in coco.get("categories", [])}
+    name_to_id = _class_ids_for_names(args.dataset, [categories[c] for c in sorted(categories)])
+    by_image = {}
+    for annotation in coco.get("annotations", []):
+        by_image.setdefault(annotation["image_id"], []).append(annotation)
+    labels_folder = os.path.join(args.dataset, LABELS_FOLDER_NAME)
+    written = 0
+    for image in coco.get("images", []):
+        img_w, img_h = image["width"], image["height"]
+        boxes = []
+        for annotation in by_image.get(image["id"], []):
+            x, y, w, h = annotation["bbox"]
+            boxes.append((name_to_id[categories[annotation["category_id"]]], (x + w / 2) / img_w, (y + h / 2) / img_h, w / img_w, h / img_h))
+        _write_labels(labels_folder, os.path.splitext(image["file_name"].replace("/", os.sep))[0], boxes)
+        written += 1
+    print(f"{written} archivos de etiquetas escritos.", file=sys.stderr)
+    return 0
+
+def cmd_to_voc(args):
+    config = _dataset_config(args.dataset)
+    config["output"] = args.output
+    written = unreadable = 0
+    with _pool(args, config) as pool:
+        for image_file, ok, error in pool.imap_unordered(_voc_task, iter_image_files(args.dataset), CHUNK_SIZE):
+            written += ok
+            if error is not None:
+                print(_unreadable_message(image_file, error), file=sys.stderr)
+                unreadable += 1
+    print(f"{written} archivos XML escritos; {unreadable} omitidos por etiquetas ilegibles.", file=sys.stderr)
+    return 1 if unreadable else 0
+
+def cmd_from_voc(args):
+    xml_files = []
+    for folder, _, files in os.walk(args.input):
+        xml_files.extend(os.path.relpath(os.path.join(folder, name), args.input) for name in files if name.endswith(".xml"))
+    labels_folder = os.path.join(args.dataset, LABELS_FOLDER_NAME)
+    # Los IDs se asignan en el proceso principal para que sean coherentes entre procesos
+    classes_path = os.path.join(args.dataset, CLASSES_FILE_NAME)
+    name_to_id = {name: class_id for class_id, name in (read_classes(classes_path) if os.path.exists(classes_path) else {}).items()}
+    new_names, written = False, 0
+    with _pool(args, {"voc_folder": args.input}) as pool:
+        for image_stem, objects in pool.imap(_parse_voc_task, sorted(xml_files), CHUNK_SIZE):
+            boxes = []
+            for name, x_c, y_c, w, h in objects:
+                if name not in name_to_id:
+                    name_to_id[name] = max(name_to_id.values(), default=-1) + 1
+                    new_names = True
+                boxes.append((name_to_id[name], x_c, y_c, w, h))
+            _write_labels(labels_folder, image_stem, boxes)
+            written += 1
+    if new_names or not os.path.exists(classes_path):
+        write_classes(classes_path, {class_id: name for name, class_id in sorted(name_to_id.items(), key=lambda item: item[1])})
+    print(f"{written} archivos de etiquetas escritos.", file=sys.stderr)
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Validación, conversión y estadísticas de datasets YOLOv8.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="procesos a usar (por defecto, uno por CPU)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    validate = commands.add_parser("validate", help="busca etiquetas inválidas")
+    validate.add_argument("dataset")
+    validate.add_argument("--fix", action="store_true", help="recorta las cajas fuera de rango y elimina el resto de líneas con problemas")
+    validate.set_defaults(func=cmd_validate)
+
+    stats = commands.add_parser("stats", help="cuenta imágenes y cajas por clase")
+    stats.add_argument("dataset")
+    stats.add_argument("--json", action="store_true", help="salida en JSON")
+    stats.set_defaults(func=cmd_stats)
+
+    to_coco = commands.add_parser("to-coco", help="exporta a COCO JSON")
+    to_coco.add_argument("dataset")
+    to_coco.add_argument("output")
+    to_coco.set_defaults(func=cmd_to_coco)
+
+    from_coco = commands.add_parser("from-coco", help="importa desde COCO JSON")
+    from_coco.add_argument("input")
+    from_coco.add_argument("dataset")
+    from_coco.set_defaults(func=cmd_from_coco)
+
+    to_voc = commands.add_parser("to-voc", help="exporta a Pascal VOC (un XML por imagen)")
+    to_voc.add_argument("dataset")
+    to_voc.add_argument("output")
+    to_voc.set_defaults(func=cmd_to_voc)
+
+    from_voc = commands.add_parser("from-voc", help="importa desde Pascal VOC")
+    from_voc.add_argument("input")
+    from_voc.add_argument("dataset")
+    from_voc.set_defaults(func=cmd_from_voc)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
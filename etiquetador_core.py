@@ -0,0 +1,1036 @@
+"""Núcleo sin dependencias de Qt del etiquetador.
+
+Lectura y escritura de etiquetas YOLO, historial de cambios, índices del dataset,
+reasignación de clases y medición de rendimiento. Lo usan tanto la aplicación gráfica (`etiquetador.py`) como
+la herramienta de línea de comandos (`etiquetador_cli.py`).
+"""
+import os
+import csv
+import io
+import json
+import math
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+LABELS_FOLDER_NAME = "Yolov8"
+CACHE_FOLDER_NAME = ".etiquetador"
+CLASSES_FILE_NAME = "classes.csv"
+SUPPORTED_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# Carpetas propias de la aplicación que nunca contienen imágenes a etiquetar
+EXCLUDED_SCAN_FOLDERS = {LABELS_FOLDER_NAME, CACHE_FOLDER_NAME}
+
+# --- Clases y Rutas del Dataset ---
+
+def read_classes(path):
+    """Lee classes.csv como {id: nombre}."""
+    with open(path, mode='r', newline='', encoding='utf-8') as f:
+        return {int(r[0]): r[1] for r in csv.reader(f) if r}
+
+def write_classes(path, class_map):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for class_id, name in class_map.items():
+        writer.writerow([class_id, name])
+    atomic_write_text(path, buffer.getvalue())
+
+def fuzzy_score(query, name):
+    """Puntuación de `name` para una búsqueda difusa (mayor es mejor), o None si no encaja.
+
+    Las letras de la búsqueda deben aparecer en orden en el nombre, sin distinguir
+    mayúsculas. Puntúan más los prefijos, las subcadenas y las letras consecutivas o al
+    principio de una palabra.
+    """
+    query, name = query.lower(), name.lower()
+    if not query: return 0
+    if name.startswith(query): return 1000 - len(name)
+    position = name.find(query)
+    if position != -1: return 500 - position - len(name)
+    score, last = 0, -1
+    for char in query:
+        index = name.find(char, last + 1)
+        if index == -1: return None
+        if index == last + 1: score += 5
+        elif index == 0 or not name[index - 1].isalnum(): score += 3
+        score -= index - last - 1
+        last = index
+    return score - len(name)
+
+def fuzzy_filter(query, names):
+    """Nombres que encajan con la búsqueda, de mejor a peor (a igualdad, en su orden)."""
+    scored = []
+    for i, name in enumerate(names):
+        score = fuzzy_score(query, name)
+        if score is not None: scored.append((-score, i, name))
+    scored.sort()
+    return [name for _, _, name in scored]
+
+def label_path_for(labels_folder, image_file):
+    """Ruta del .txt de una imagen (ruta relativa a la carpeta de imágenes)."""
+    return os.path.join(labels_folder, os.path.splitext(image_file)[0] + ".txt")
+
+def list_image_dir(abs_dir):
+    """(imágenes, subcarpetas) de una carpeta, ordenadas y sin las carpetas propias."""
+    files, subdirs = [], []
+    with os.scandir(abs_dir) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in EXCLUDED_SCAN_FOLDERS and not entry.name.startswith('.'):
+                        subdirs.append(entry.name)
+                elif entry.name.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS):
+                    files.append(entry.name)
+            except OSError:
+                continue
+    return sorted(files), sorted(subdirs)
+
+def iter_image_files(image_folder):
+    """Genera las rutas relativas de las imágenes, en el mismo orden que la aplicación:
+    primero los ficheros de cada carpeta y después sus subcarpetas."""
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            files, subdirs = list_image_dir(os.path.join(image_folder, rel_dir))
+        except OSError:
+            continue
+        for name in files:
+            yield os.path.join(rel_dir, name) if rel_dir else name
+        stack.extend(os.path.join(rel_dir, name) if rel_dir else name for name in reversed(subdirs))
+
+# --- Modelo de Anotaciones ---
+
+def format_yolo_line(class_id, x_center, y_center, width, height):
+    return f"{class_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}"
+
+def parse_yolo_line(line):
+    """Devuelve (class_id, x_center, y_center, width, height) o None si la línea no es válida.
+    `nan` e `inf` se aceptan en `float()` pero no son coordenadas: la línea no es válida."""
+    parts = line.split()
+    if len(parts) < 5: return None
+    try:
+        coords = float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4])
+        class_id = int(parts[0])
+    except ValueError:
+        return None
+    if not all(map(math.isfinite, coords)): return None
+    return (class_id,) + coords
+
+def box_iou(a, b):
+    """IoU de dos cajas (x_center, y_center, width, height) en coordenadas normalizadas."""
+    ix = min(a[0] + a[2] / 2, b[0] + b[2] / 2) - max(a[0] - a[2] / 2, b[0] - b[2] / 2)
+    iy = min(a[1] + a[3] / 2, b[1] + b[3] / 2) - max(a[1] - a[3] / 2, b[1] - b[3] / 2)
+    if ix <= 0 or iy <= 0: return 0.0
+    inter = ix * iy
+    return inter / (a[2] * a[3] + b[2] * b[3] - inter)
+
+def merge_lines(base, ours, theirs, iou_threshold=0.5, prefer=None):
+    """Fusión a tres bandas de las líneas de una imagen que dos etiquetadores cambiaron a
+    la vez a partir de la misma versión `base`.
+
+    Se parte de la versión en disco (`theirs`) y se le aplican nuestros cambios: se quitan
+    las líneas que borramos (o modificamos) y se añaden las nuevas al final, sin duplicar
+    las que ambos añadieron igual. Es un conflicto que una línea nuestra y otra suya,
+    ambas nuevas y distintas, cubran el mismo objeto (IoU >= `iou_threshold`): con
+    `prefer` "ours" o "theirs" se descarta la del otro lado; si no, se conservan las dos.
+    Devuelve (líneas fusionadas, lista de conflictos (nuestra, suya)).
+    """
+    base_count = Counter(base)
+    removed = base_count - Counter(ours)
+    added = Counter(ours) - base_count
+    theirs_added = Counter(theirs) - base_count
+    merged, our_new = [], []
+    for line in theirs:
+        if removed[line] > 0:
+            removed[line] -= 1
+        else:
+            merged.append(line)
+    for line in ours:
+        if added[line] <= 0: continue
+        added[line] -= 1
+        if theirs_added[line] > 0:
+            theirs_added[line] -= 1 # Ambos añadieron la misma caja
+        else:
+            our_new.append(line)
+    their_new = list(theirs_added.elements())
+
+    conflicts = []
+    for our_line in our_new:
+        our_box = parse_yolo_line(our_line)
+        if our_box is None: continue
+        for their_line in their_new:
+            their_box = parse_yolo_line(their_line)
+            if their_box is not None and box_iou(our_box[1:], their_box[1:]) >= iou_threshold:
+                conflicts.append((our_line, their_line))
+    dropped = Counter()
+    if prefer == "ours": dropped = Counter(their for _, their in conflicts)
+    if prefer == "theirs": dropped = Counter(our for our, _ in conflicts)
+    result = []
+    for line in merged + our_new:
+        if dropped[line] > 0:
+            dropped[line] -= 1
+        else:
+            result.append(line)
+    return result, conflicts
+
+def atomic_write_text(path, text):
+    """Escribe en un temporal de la misma carpeta y lo renombra sobre el destino, de
+    modo que un fallo a mitad nunca deja un fichero a medio escribir."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_", suffix=".txt")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+
+class AnnotationStore:
+    """Anotaciones en memoria por imagen; es la fuente de verdad para la interfaz.
+
+    Cada imagen se lee de su .txt la primera vez que se pide. Cada línea recibe un ID
+    de caja estable durante la sesión (0..n-1 al leer, y después siempre crecientes), de
+    modo que localizar, cambiar o quitar una caja es un acceso directo que no afecta a
+    las demás aunque haya líneas idénticas. El fichero se escribe en orden de ID. Los
+    cambios sólo marcan la imagen como pendiente y `flush` la escribe de forma atómica.
+    Las líneas se conservan tal cual, incluidas las que no se pueden interpretar. Una
+    imagen cuyo fichero no se pudo leer queda en `unreadable` y no admite cambios, para
+    no sobrescribir en disco anotaciones que no se han llegado a cargar.
+
+    En una sesión compartida (`lock`, que devuelve el contexto del lock de escritura de
+    una imagen) se recuerda la versión leída de cada fichero; si al guardar otro
+    etiquetador la cambió, se fusionan ambas con `merge_lines` y la imagen queda en
+    `merged` con sus conflictos.
+    """
+    def __init__(self, labels_folder, index=None, journal=None, lock=None):
+        self.labels_folder = labels_folder
+        self.index = index
+        self.journal = journal
+        self.lock = lock
+        self._records = {} # imagen -> {box_id: línea}, ordenado por ID salvo en `_unordered`
+        self._unordered = set() # imágenes con una caja reinsertada fuera de sitio, por ordenar
+        self._next_id = {}
+        self._dirty = set()
+        self._touched = set() # imágenes cuyos IDs pueden haber dejado de ser 0..n-1
+        self._base = {} # imagen -> (sello del fichero, líneas) tal como se leyó o escribió
+        self.merged = {} # imagen -> conflictos de la última fusión
+        self.unreadable = {} # imagen -> error de lectura; se reintenta en cada acceso
+
+    def _file_stamp(self, image_file):
+        try:
+            stat = os.stat(self.label_path(image_file))
+        except FileNotFoundError:
+            return None
+        # Cada reemplazo atómico crea un inodo nuevo aunque el mtime tenga poca resolución
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _read_lines(self, image_file):
+        txt_path = self.label_path(image_file)
+        if not os.path.exists(txt_path): return []
+        with perf.measure("parse", image_file), open(txt_path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def label_path(self, image_file):
+        return label_path_for(self.labels_folder, image_file)
+
+    def records(self, image_file):
+        """{box_id: línea} de la imagen, en el orden del fichero."""
+        records = self._loaded_records(image_file)
+        if image_file in self._unordered:
+            # Se ordena aquí y no en cada reinserción: deshacer o rehacer no paga por ello
+            self._unordered.discard(image_file)
+            records = self._records[image_file] = dict(sorted(records.items()))
+        return records
+
+    def line(self, image_file, box_id):
+        """Línea de una caja, o None si no existe."""
+        return self._loaded_records(image_file).get(box_id)
+
+    def box_count(self, image_file):
+        return len(self._loaded_records(image_file))
+
+    def _loaded_records(self, image_file):
+        """{box_id: línea} de la imagen, leyéndola si hace falta, sin garantizar el orden."""
+        records = self._records.get(image_file)
+        if records is None:
+            try:
+                stamp = self._file_stamp(image_file) if self.lock else None
+                lines = self._read_lines(image_file)
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"Error leyendo el archivo .txt: {e}")
+                self.unreadable[image_file] = e
+                return {}
+            self.unreadable.pop(image_file, None)
+            if self.lock: self._base[image_file] = (stamp, list(lines))
+            records = self._records[image_file] = dict(enumerate(lines))
+            self._next_id[image_file] = len(lines)
+        return records
+
+    def changed_on_disk(self, image_file):
+        """True si el fichero de una imagen ya leída cambió desde la última lectura o escritura."""
+        base = self._base.get(image_file)
+        return base is not None and self._file_stamp(image_file) != base[0]
+
+    def reload_if_changed(self, image_file):
+        """Descarta la copia en memoria de una imagen sin cambios pendientes si otro la
+        modificó en disco. Devuelve True si se descartó; los IDs vuelven a empezar."""
+        if image_file in self._dirty or not self.changed_on_disk(image_file): return False
+        self._forget(image_file)
+        return True
+
+    def _forget(self, image_file):
+        self._records.pop(image_file, None)
+        self._unordered.discard(image_file)
+        self._next_id.pop(image_file, None)
+        self._base.pop(image_file, None)
+        self.unreadable.pop(image_file, None)
+        self._touched.discard(image_file)
+        if self.journal is not None: self.journal.forget(image_file)
+
+    def lines(self, image_file):
+        return list(self.records(image_file).values())
+
+    def _writable_records(self, image_file):
+        records = self._loaded_records(image_file)
+        if image_file in self.unreadable:
+            raise ValueError(f"no se pudo leer {self.label_path(image_file)}: {self.unreadable[image_file]}")
+        return records
+
+    def new_box_id(self, image_file):
+        self._writable_records(image_file)
+        box_id = self._next_id[image_file]
+        self._next_id[image_file] += 1
+        return box_id
+
+    def restore_ids(self, image_file, box_ids):
+        """Reasigna los IDs de una imagen recién leída (los de una sesión anterior)."""
+        self._writable_records(image_file)
+        records = self.records(image_file)
+        if len(box_ids) != len(records):
+            raise ValueError(f"{image_file} tiene {len(records)} líneas y el historial esperaba {len(box_ids)}")
+        self._records[image_file] = dict(zip(box_ids, records.values()))
+        self._next_id[image_file] = max(box_ids, default=-1) + 1
+        self._touched.add(image_file)
+
+    def insert_line(self, image_file, box_id, yolo_line):
+        records = self._writable_records(image_file)
+        if box_id in records: raise ValueError(f"la caja {box_id} ya existe")
+        last_id = next(reversed(records), -1)
+        records[box_id] = yolo_line
+        # Al rehacer o deshacer un borrado la caja recupera su sitio en el fichero, que
+        # se le da al pedir las líneas en orden (ver `records`)
+        if box_id < last_id:
+            self._unordered.add(image_file)
+        self._next_id[image_file] = max(self._next_id[image_file], box_id + 1)
+        self._dirty.add(image_file)
+        self._touched.add(image_file)
+
+    def replace_line(self, image_file, box_id, yolo_line):
+        self._writable_records(image_file)[box_id] = yolo_line
+        self._dirty.add(image_file)
+
+    def remove_line(self, image_file, box_id):
+        line = self._writable_records(image_file).pop(box_id)
+        self._dirty.add(image_file)
+        self._touched.add(image_file)
+        return line
+
+    def has_pending_changes(self):
+        return bool(self._dirty)
+
+    def renumbered_images(self):
+        """{imagen: IDs} de las imágenes cuyos IDs ya no coinciden con su posición."""
+        renumbered = {}
+        for image_file in self._touched:
+            box_ids = list(self.records(image_file))
+            if box_ids != list(range(len(box_ids))): renumbered[image_file] = box_ids
+        return renumbered
+
+    def flush(self):
+        """Escribe las imágenes modificadas. Devuelve la lista de (imagen, error) fallidas;
+        las que fallan siguen pendientes para el próximo intento."""
+        errors = []
+        self.merged = {}
+        for image_file in sorted(self._dirty):
+            txt_path = self.label_path(image_file)
+            try:
+                os.makedirs(os.path.dirname(txt_path), exist_ok=True)
+                if self.lock is not None:
+                    with self.lock(image_file):
+                        lines = self._write_shared(image_file, txt_path)
+                else:
+                    lines = self._write(image_file, txt_path)
+                records = self.records(image_file)
+                if self.index is not None:
+                    stat = os.stat(txt_path)
+                    self.index.update_image(os.path.splitext(image_file)[0], lines, stat.st_mtime_ns, stat.st_size)
+                if self.journal is not None:
+                    self.journal.mark_saved(image_file, list(records))
+            except (OSError, UnicodeDecodeError, sqlite3.Error) as e:
+                errors.append((image_file, e))
+        self._dirty = {image_file for image_file, _ in errors}
+        # Con todo en disco el log sólo necesita conservar los IDs vigentes
+        if self.journal is not None and not self._dirty:
+            self.journal.compact(self.renumbered_images())
+        return errors
+
+    def _write(self, image_file, txt_path):
+        lines = self.lines(image_file)
+        with perf.measure("write", image_file):
+            atomic_write_text(txt_path, "".join(line + "\n" for line in lines))
+        return lines
+
+    def _write_shared(self, image_file, txt_path):
+        """Escritura bajo el lock de la imagen, fusionando si otro la cambió desde la lectura."""
+        base_stamp, base_lines = self._base.get(image_file, (None, []))
+        if self._file_stamp(image_file) != base_stamp:
+            ours = self.lines(image_file)
+            merged, conflicts = merge_lines(base_lines, ours, self._read_lines(image_file))
+            # Los IDs y el historial de la imagen ya no corresponden a la versión fusionada
+            self._forget(image_file)
+            self._records[image_file] = dict(enumerate(merged))
+            self._next_id[image_file] = len(merged)
+            self.merged[image_file] = conflicts
+        lines = self._write(image_file, txt_path)
+        self._base[image_file] = (self._file_stamp(image_file), list(lines))
+        return lines
+
+# --- Historial de Cambios (Deshacer/Rehacer) ---
+
+class EditCommand:
+    """Cambio sobre una caja de una imagen, identificada por su ID: alta (`old_line`
+    None), baja (`new_line` None) o sustitución ("modify" o "relabel")."""
+    __slots__ = ("kind", "image_file", "box_id", "old_line", "new_line")
+
+    def __init__(self, kind, image_file, box_id, old_line=None, new_line=None):
+        self.kind = kind
+        self.image_file = image_file
+        self.box_id = box_id
+        self.old_line = old_line
+        self.new_line = new_line
+
+    def apply(self, store):
+        """Aplica el cambio al store, comprobando que la caja afectada es la esperada."""
+        if self.old_line is None:
+            store.insert_line(self.image_file, self.box_id, self.new_line)
+            return
+        if store.line(self.image_file, self.box_id) != self.old_line:
+            raise ValueError(f"la caja {self.box_id} no coincide con el historial")
+        if self.new_line is None:
+            store.remove_line(self.image_file, self.box_id)
+        else:
+            store.replace_line(self.image_file, self.box_id, self.new_line)
+
+    def inverse(self):
+        return EditCommand(self.kind, self.image_file, self.box_id, self.new_line, self.old_line)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, entry):
+        return cls(entry["kind"], entry["image_file"], entry["box_id"], entry.get("old_line"), entry.get("new_line"))
+
+class EditJournal:
+    """Historial de deshacer/rehacer por imagen, copiado a un log de sólo anexado.
+
+    En memoria cada imagen tiene una pila de deshacer acotada a `max_per_image` y una de
+    rehacer, así que ambas operaciones son O(1). Cada cambio se anexa además al log y
+    cada imagen guardada deja una marca con sus IDs de caja, de modo que tras un cierre
+    inesperado `pending()` devuelve justo los cambios que no llegaron a disco y los IDs
+    a los que se refieren.
+    """
+    def __init__(self, log_path, max_per_image=200):
+        self.log_path = log_path
+        self.max_per_image = max_per_image
+        self._undo = {}
+        self._redo = {}
+        self._log = None
+
+    def _append(self, entry):
+        if self._log is None:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            self._log = open(self.log_path, 'a', encoding='utf-8')
+        self._log.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._log.flush()
+
+    def _push_undo(self, command):
+        stack = self._undo.get(command.image_file)
+        if stack is None:
+            stack = self._undo[command.image_file] = deque(maxlen=self.max_per_image)
+        stack.append(command)
+
+    def record(self, command):
+        """Registra un cambio ya aplicado; descarta lo que hubiera para rehacer."""
+        self._push_undo(command)
+        self._redo.pop(command.image_file, None)
+        self._append({"op": "do", **command.to_dict()})
+
+    def can_undo(self, image_file):
+        return bool(self._undo.get(image_file))
+
+    def can_redo(self, image_file):
+        return bool(self._redo.get(image_file))
+
+    def undo(self, store, image_file):
+        """Deshace el último cambio de la imagen. Devuelve el cambio aplicado o None."""
+        stack = self._undo.get(image_file)
+        if not stack: return None
+        command = stack.pop()
+        inverse = command.inverse()
+        inverse.apply(store)
+        self._redo.setdefault(image_file, []).append(command)
+        self._append({"op": "undo", **command.to_dict()})
+        return inverse
+
+    def redo(self, store, image_file):
+        """Rehace el último cambio deshecho de la imagen. Devuelve el cambio aplicado o None."""
+        stack = self._redo.get(image_file)
+        if not stack: return None
+        command = stack.pop()
+        command.apply(store)
+        self._push_undo(command)
+        self._append({"op": "redo", **command.to_dict()})
+        return command
+
+    def mark_saved(self, image_file, box_ids):
+        self._append({"op": "saved", "image_file": image_file, "box_ids": box_ids})
+
+    def compact(self, renumbered=None):
+        """Reduce el log a las marcas de IDs de `renumbered` ({imagen: IDs}), las únicas
+        necesarias para interpretar cambios futuros; el historial en memoria se conserva."""
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if renumbered:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            atomic_write_text(self.log_path, "".join(
+                json.dumps({"op": "saved", "image_file": image_file, "box_ids": box_ids}, ensure_ascii=False) + "\n"
+                for image_file, box_ids in renumbered.items()))
+            return
+        try:
+            os.remove(self.log_path)
+        except FileNotFoundError:
+            pass
+
+    def forget(self, image_file):
+        """Olvida el historial de una imagen cuyas cajas se renumeraron desde fuera."""
+        self._undo.pop(image_file, None)
+        self._redo.pop(image_file, None)
+
+    def reset(self):
+        """Olvida todo el historial (p. ej. tras reescribir los ficheros desde fuera)."""
+        self._undo.clear()
+        self._redo.clear()
+        self.compact()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def pending(self):
+        """Entradas del log posteriores al último guardado de cada imagen, precedidas por
+        la marca de ese guardado. Lista vacía si no hay cambios que recuperar."""
+        entries = []
+        try:
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue # Última línea a medio escribir
+        except FileNotFoundError:
+            return []
+        last_saved = {entry.get("image_file"): i for i, entry in enumerate(entries) if entry.get("op") == "saved"}
+        changed = {entry.get("image_file") for i, entry in enumerate(entries)
+                   if entry.get("op") != "saved" and i > last_saved.get(entry.get("image_file"), -1)}
+        return [entry for i, entry in enumerate(entries)
+                if entry.get("image_file") in changed and i >= last_saved.get(entry.get("image_file"), -1)]
+
+    def replay(self, store, entries):
+        """Reaplica al store las entradas de `pending()` y reconstruye las pilas.
+        Devuelve el número de cambios aplicados; si una imagen no cuadra con su
+        historial, se descartan sus cambios restantes."""
+        applied, broken = 0, set()
+        for entry in entries:
+            if entry.get("image_file") in broken: continue
+            try:
+                if entry["op"] == "saved":
+                    store.restore_ids(entry["image_file"], entry["box_ids"])
+                    continue
+                command = EditCommand.from_dict(entry)
+                if entry["op"] == "undo":
+                    command.inverse().apply(store)
+                    stack = self._undo.get(command.image_file)
+                    if stack: stack.pop()
+                    self._redo.setdefault(command.image_file, []).append(command)
+                else:
+                    command.apply(store)
+                    self._push_undo(command)
+                    if entry["op"] == "do":
+                        self._redo.pop(command.image_file, None)
+                    elif self._redo.get(command.image_file):
+                        self._redo[command.image_file].pop()
+                applied += 1
+            except (KeyError, ValueError) as e:
+                print(f"Historial de {entry.get('image_file')} descartado: {e}")
+                broken.add(entry.get("image_file"))
+        return applied
+
+# --- Validación de Etiquetas ---
+
+# Tolerancia para coordenadas que se salen de [0, 1] por redondeo
+COORD_TOLERANCE = 1e-6
+
+def validate_lines(lines, class_ids=None, image_size=None, fix=False):
+    """Revisa las líneas YOLO de una imagen.
+
+    Detecta líneas malformadas, IDs de clase desconocidos (si se da `class_ids`),
+    cajas fuera de la imagen, cajas de área nula (menos de un píxel si se conoce
+    `image_size`) y cajas duplicadas. Devuelve (problemas, líneas corregidas), donde
+    cada problema es (número de línea, descripción). Con `fix`, las cajas fuera de
+    rango se recortan y el resto de líneas con problemas se eliminan; sin `fix`, las
+    líneas se devuelven tal cual.
+    """
+    issues, fixed, seen = [], [], set()
+    img_w, img_h = image_size if image_size else (None, None)
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line: continue
+        parsed = parse_yolo_line(line)
+        if parsed is None or len(line.split()) != 5:
+            issues.append((line_number, "línea malformada"))
+            continue
+        class_id, x_c, y_c, w, h = parsed
+        if class_ids is not None and class_id not in class_ids:
+            issues.append((line_number, f"clase desconocida {class_id}"))
+            continue
+        x0, y0, x1, y1 = x_c - w / 2, y_c - h / 2, x_c + w / 2, y_c + h / 2
+        if min(x0, y0) < -COORD_TOLERANCE or max(x1, y1) > 1 + COORD_TOLERANCE or w < 0 or h < 0:
+            issues.append((line_number, "caja fuera de la imagen"))
+            x0, y0 = max(0.0, min(x0, x1)), max(0.0, min(y0, y1))
+            x1, y1 = min(1.0, max(x0, x1)), min(1.0, max(y0, y1))
+            x_c, y_c, w, h = (x0 + x1) / 2, (y0 + y1) / 2, x1 - x0, y1 - y0
+            line = format_yolo_line(class_id, x_c, y_c, w, h)
+        too_small = w <= 0 or h <= 0 or (img_w is not None and (w * img_w < 1 or h * img_h < 1))
+        if too_small:
+            issues.append((line_number, "caja de área nula"))
+            continue
+        key = (class_id, round(x_c, 6), round(y_c, 6), round(w, 6), round(h, 6))
+        if key in seen:
+            issues.append((line_number, "caja duplicada"))
+            continue
+        seen.add(key)
+        fixed.append(line)
+    return issues, (fixed if fix else [line.strip() for line in lines if line.strip()])
+
+# --- Índice de Anotaciones del Dataset ---
+
+# Ficheros por transacción al reconciliar: el lock de escritura se suelta entre lotes
+# para que los guardados de la interfaz no esperen a que termine todo el recorrido
+RECONCILE_BATCH_SIZE = 200
+
+class AnnotationIndex:
+    """Índice SQLite imagen -> cajas de todo el dataset.
+
+    Las imágenes se identifican por su ruta relativa sin extensión, que es también la
+    ruta de su .txt dentro de la carpeta de etiquetas. Se actualiza cada vez que se
+    escribe un fichero de etiquetas y `reconcile` lo pone al día con los ficheros
+    modificados desde fuera comparando mtime y tamaño. El total de cajas por clase se
+    mantiene en `class_totals` con cada cambio, así consultarlo no recorre `boxes`.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        has_totals = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'class_totals'").fetchone()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS label_files (
+                image TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, box_count INTEGER);
+            CREATE TABLE IF NOT EXISTS boxes (
+                image TEXT, class_id INTEGER, x_center REAL, y_center REAL, width REAL, height REAL);
+            CREATE INDEX IF NOT EXISTS boxes_by_image ON boxes(image);
+            CREATE INDEX IF NOT EXISTS boxes_by_class ON boxes(class_id, image);
+            CREATE TABLE IF NOT EXISTS class_totals (class_id INTEGER PRIMARY KEY, box_count INTEGER);
+        """)
+        if not has_totals:
+            # Índice creado por una versión anterior: los totales se calculan una vez
+            with self._transaction():
+                self.conn.execute("INSERT OR REPLACE INTO class_totals SELECT class_id, COUNT(*) FROM boxes GROUP BY class_id")
+
+    def close(self):
+        self.conn.close()
+
+    def _transaction(self):
+        """Transacción que toma el lock de escritura desde el principio: las cajas que se van
+        a reemplazar, y con ellas los totales por clase, no pueden cambiar mientras tanto."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def _remove_image(self, image):
+        delta = Counter()
+        for class_id, count in self.conn.execute("SELECT class_id, COUNT(*) FROM boxes WHERE image = ? GROUP BY class_id", (image,)):
+            delta[class_id] -= count
+        self.conn.execute("DELETE FROM boxes WHERE image = ?", (image,))
+        return delta
+
+    def _add_to_totals(self, delta):
+        for class_id, count in delta.items():
+            if not count: continue
+            self.conn.execute("INSERT OR IGNORE INTO class_totals VALUES (?, 0)", (class_id,))
+            self.conn.execute("UPDATE class_totals SET box_count = box_count + ? WHERE class_id = ?", (count, class_id))
+
+    def _replace_image(self, image, lines, mtime_ns, size):
+        boxes = [(image,) + parsed for parsed in map(parse_yolo_line, lines) if parsed is not None]
+        delta = self._remove_image(image)
+        delta.update(box[1] for box in boxes)
+        self.conn.executemany("INSERT INTO boxes VALUES (?, ?, ?, ?, ?, ?)", boxes)
+        self.conn.execute("INSERT OR REPLACE INTO label_files VALUES (?, ?, ?, ?)", (image, mtime_ns, size, len(boxes)))
+        self._add_to_totals(delta)
+
+    def update_image(self, image, lines, mtime_ns, size):
+        with self._transaction():
+            self._replace_image(image, lines, mtime_ns, size)
+
+    def reconcile(self, labels_folder, batch_size=RECONCILE_BATCH_SIZE):
+        """Sincroniza el índice con los .txt en disco. Devuelve cuántas imágenes cambiaron.
+
+        Los ficheros se leen fuera de transacción y se escriben en lotes de `batch_size`."""
+        known = {row[0]: (row[1], row[2]) for row in self.conn.execute("SELECT image, mtime_ns, size FROM label_files")}
+        seen, changed, batch = set(), 0, []
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                entries = list(os.scandir(os.path.join(labels_folder, rel_dir)))
+            except OSError:
+                continue
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(rel_path)
+                    continue
+                if not entry.name.endswith(".txt") or entry.name.startswith("."): continue
+                image = rel_path[:-4]
+                seen.add(image)
+                stat = entry.stat()
+                if known.get(image) == (stat.st_mtime_ns, stat.st_size): continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        lines = [line.strip() for line in f if line.strip()]
+                except (OSError, UnicodeDecodeError):
+                    lines = []
+                batch.append((image, lines, stat.st_mtime_ns, stat.st_size))
+                if len(batch) >= batch_size:
+                    changed += self._write_batch(batch)
+                    batch = []
+        changed += self._write_batch(batch)
+        removed = list(known.keys() - seen)
+        for i in range(0, len(removed), batch_size):
+            with self._transaction():
+                for image in removed[i:i + batch_size]:
+                    self._add_to_totals(self._remove_image(image))
+                    self.conn.execute("DELETE FROM label_files WHERE image = ?", (image,))
+        return changed + len(removed)
+
+    def _write_batch(self, batch):
+        if not batch: return 0
+        with self._transaction():
+            for image, lines, mtime_ns, size in batch:
+                self._replace_image(image, lines, mtime_ns, size)
+        return len(batch)
+
+    def class_counts(self):
+        return dict(self.conn.execute("SELECT class_id, box_count FROM class_totals WHERE box_count > 0"))
+
+    def box_counts(self):
+        """{imagen: número de cajas} para todas las imágenes con fichero de etiquetas."""
+        return dict(self.conn.execute("SELECT image, box_count FROM label_files"))
+
+    def labeled_images(self):
+        return {row[0] for row in self.conn.execute("SELECT image FROM label_files WHERE box_count > 0")}
+
+    def images_with_class(self, class_id):
+        return {row[0] for row in self.conn.execute("SELECT DISTINCT image FROM boxes WHERE class_id = ?", (class_id,))}
+
+# --- Reasignación de IDs de Clase ---
+
+class RemapCancelled(Exception):
+    pass
+
+def list_label_files(labels_folder):
+    """Rutas de todos los .txt de etiquetas (con subcarpetas), sin temporales ocultos."""
+    paths, stack = [], [labels_folder]
+    while stack:
+        folder = stack.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith('.'): continue
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.name.endswith(".txt"):
+                paths.append(entry.path)
+    return paths
+
+def remap_lines(lines, mapping):
+    """Aplica {id antiguo: id nuevo o None} a líneas YOLO. Las líneas no válidas o de
+    clases que no están en el mapa se conservan; las de clases eliminadas se quitan."""
+    result = []
+    for line in lines:
+        parts = line.split(maxsplit=1)
+        try:
+            class_id = int(parts[0])
+        except (ValueError, IndexError):
+            result.append(line)
+            continue
+        if class_id not in mapping:
+            result.append(line)
+        elif mapping[class_id] is not None:
+            result.append(f"{mapping[class_id]} {parts[1]}" if len(parts) > 1 else str(mapping[class_id]))
+    return result
+
+def _stage_remap(path, mapping, cancel_event):
+    """Escribe la versión reasignada de un fichero en un temporal; devuelve su ruta o None si no cambia."""
+    if cancel_event is not None and cancel_event.is_set():
+        raise RemapCancelled()
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [line.rstrip("\n") for line in f]
+    new_lines = remap_lines(lines, mapping)
+    if new_lines == lines:
+        return None
+    folder, name = os.path.split(path)
+    staged_path = os.path.join(folder, f".{name}.remap")
+    with open(staged_path, 'w', encoding='utf-8') as f:
+        f.write("".join(line + "\n" for line in new_lines))
+    return staged_path
+
+def remap_label_files(labels_folder, mapping, progress=None, cancel_event=None, max_workers=8):
+    """Reescribe los IDs de clase de todos los archivos de etiquetas.
+
+    Primero se preparan en paralelo las versiones nuevas en temporales; si se cancela
+    o algo falla en esta fase, los temporales se borran y nada cambia. Después cada
+    original se aparta como copia de seguridad y se sustituye; si un reemplazo falla,
+    se restauran todos los ya sustituidos. `progress(hechos, total)` se llama por
+    fichero desde los hilos de trabajo. Devuelve el número de ficheros modificados y
+    lanza RemapCancelled si se cancela.
+    """
+    paths = list_label_files(labels_folder)
+    staged = {}
+    done = 0
+    lock = threading.Lock()
+
+    def stage(path):
+        nonlocal done
+        staged_path = _stage_remap(path, mapping, cancel_event)
+        with lock:
+            done += 1
+            if staged_path is not None: staged[path] = staged_path
+            if progress is not None: progress(done, len(paths))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [executor.submit(stage, path) for path in paths]
+        for future in futures:
+            future.result()
+    except BaseException:
+        # Se descartan los trabajos pendientes y se espera a los que están en curso
+        executor.shutdown(wait=True, cancel_futures=True)
+        for staged_path in staged.values():
+            if os.path.exists(staged_path): os.remove(staged_path)
+        raise
+    executor.shutdown()
+
+    replaced = []
+    try:
+        for path, staged_path in staged.items():
+            folder, name = os.path.split(path)
+            backup_path = os.path.join(folder, f".{name}.bak")
+            os.replace(path, backup_path)
+            replaced.append((path, backup_path))
+            os.replace(staged_path, path)
+    except OSError:
+        for path, backup_path in reversed(replaced):
+            os.replace(backup_path, path)
+        for staged_path in staged.values():
+            if os.path.exists(staged_path): os.remove(staged_path)
+        raise
+    for _, backup_path in replaced:
+        os.remove(backup_path)
+    return len(staged)
+
+# --- Metadatos de Imagen (dimensiones sin decodificar) ---
+
+def read_image_size(image_path):
+    """Lee (ancho, alto) de la cabecera de un PNG o JPEG sin decodificar píxeles.
+
+    Devuelve None si el formato no se reconoce o la cabecera está dañada.
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            head = f.read(26)
+            if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+                return struct.unpack('>II', head[16:24])
+            if not head.startswith(b'\xff\xd8'):
+                return None
+            # JPEG: se recorren los segmentos hasta encontrar un SOFn
+            f.seek(2)
+            while True:
+                byte = f.read(1)
+                while byte and byte != b'\xff':
+                    byte = f.read(1)
+                while byte == b'\xff':
+                    byte = f.read(1)
+                if not byte:
+                    return None
+                marker = byte[0]
+                if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                    continue
+                length_bytes = f.read(2)
+                if len(length_bytes) < 2:
+                    return None
+                length = struct.unpack('>H', length_bytes)[0]
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    data = f.read(5)
+                    if len(data) < 5:
+                        return None
+                    height, width = struct.unpack('>HH', data[1:5])
+                    return width, height
+                f.seek(length - 2, os.SEEK_CUR)
+    except OSError:
+        return None
+
+class ImageMetadataIndex:
+    """Índice persistente de dimensiones de imagen para una carpeta.
+
+    Cada entrada se guarda por ruta relativa junto con mtime y tamaño del fichero;
+    si alguno cambia, la entrada se vuelve a sondear con `probe` (por defecto, el
+    lector de cabeceras). Se guarda en JSON dentro de la carpeta de caché de la
+    aplicación.
+    """
+    def __init__(self, image_folder, index_path, probe=None):
+        self.image_folder = image_folder
+        self.index_path = index_path
+        self.probe = probe or read_image_size
+        self.entries = {}
+        self.dirty = False
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Índice de metadatos ignorado ({e})")
+                self.entries = {}
+
+    def image_size(self, rel_path):
+        """Devuelve (ancho, alto) de la imagen o None si no se puede leer."""
+        try:
+            stat = os.stat(os.path.join(self.image_folder, rel_path))
+        except OSError:
+            return None
+        entry = self.entries.get(rel_path)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry[2], entry[3]
+        size = self.probe(os.path.join(self.image_folder, rel_path))
+        if size is not None:
+            self.entries[rel_path] = [stat.st_mtime_ns, stat.st_size, size[0], size[1]]
+            self.dirty = True
+        return size
+
+    def save(self):
+        if not self.dirty: return
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.index_path)
+            self.dirty = False
+        except OSError as e:
+            print(f"No se pudo guardar el índice de metadatos: {e}")
+
+# --- Medición de Rendimiento ---
+
+class _Measure:
+    __slots__ = ("recorder", "op", "detail", "start")
+
+    def __init__(self, recorder, op, detail):
+        self.recorder, self.op, self.detail = recorder, op, detail
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.record(self.op, time.perf_counter() - self.start, self.detail)
+
+class _NoMeasure:
+    def __enter__(self): return self
+    def __exit__(self, *exc): pass
+
+_NO_MEASURE = _NoMeasure()
+
+class PerfRecorder:
+    """Tiempos por operación (decode, scale, paint, parse, write...) en un búfer circular.
+
+    Desactivado, `measure` devuelve un contexto vacío y no cuesta más que una
+    comprobación. Se puede usar desde varios hilos: `deque.append` es atómico.
+    Cada muestra es (marca de tiempo, operación, milisegundos, detalle).
+    """
+    def __init__(self, capacity=20000, enabled=False):
+        self.enabled = enabled
+        self.samples = deque(maxlen=capacity)
+
+    def measure(self, op, detail=""):
+        return _Measure(self, op, detail) if self.enabled else _NO_MEASURE
+
+    def record(self, op, seconds, detail=""):
+        if self.enabled:
+            self.samples.append((time.time(), op, seconds * 1000, detail))
+
+    def clear(self):
+        self.samples.clear()
+
+    def summary(self, last=None):
+        """{operación: {count, mean_ms, p50_ms, p95_ms, max_ms}} de las muestras (o de las `last` últimas)."""
+        samples = list(self.samples)
+        if last is not None: samples = samples[-last:]
+        by_op = {}
+        for _, op, ms, _ in samples:
+            by_op.setdefault(op, []).append(ms)
+        summary = {}
+        for op, values in sorted(by_op.items()):
+            values.sort()
+            summary[op] = {
+                "count": len(values), "mean_ms": round(sum(values) / len(values), 3),
+                "p50_ms": round(values[len(values) // 2], 3),
+                "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+                "max_ms": round(values[-1], 3)}
+        return summary
+
+    def dump(self, path):
+        """Vuelca las muestras a `path`: CSV si la extensión es .csv, JSON (con resumen) si no."""
+        samples = list(self.samples)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            if path.lower().endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(["timestamp", "op", "ms", "detail"])
+                writer.writerows((f"{t:.6f}", op, f"{ms:.3f}", detail) for t, op, ms, detail in samples)
+            else:
+                json.dump({"summary": self.summary(),
+                           "samples": [{"timestamp": t, "op": op, "ms": round(ms, 3), "detail": detail}
+                                       for t, op, ms, detail in samples]}, f, indent=1)
+
+# Registro compartido por la aplicación y el núcleo; se activa con ETIQUETADOR_PROFILE=1
+# o desde la interfaz (F12)
+perf = PerfRecorder(enabled=os.environ.get("ETIQUETADOR_PROFILE", "") not in ("", "0"))
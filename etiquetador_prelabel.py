@@ -0,0 +1,173 @@
+"""Pre-etiquetado con un modelo YOLO exportado a ONNX, ejecutado en CPU.
+
+Requiere las dependencias opcionales `onnxruntime` y `numpy`; si no están instaladas,
+`prelabel_available()` devuelve False y la aplicación desactiva la función. La
+inferencia corre en procesos aparte (ver `init_worker` y `predict_batch`) y sus
+resultados se guardan en `.etiquetador/predictions/` para no repetirla al reabrir
+la carpeta.
+"""
+import os
+import json
+import hashlib
+
+from PySide6.QtCore import QSize
+from PySide6.QtGui import QImage, QImageReader
+
+from etiquetador_core import atomic_write_text
+
+try:
+    import numpy as np
+    import onnxruntime
+except ImportError:
+    np = onnxruntime = None
+
+CONF_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.45
+MAX_DETECTIONS = 300
+# Valor de relleno del letterbox, el mismo que usa Ultralytics
+PAD_VALUE = 114
+
+def prelabel_available():
+    return onnxruntime is not None and np is not None
+
+# --- Caché de Predicciones ---
+
+def model_key(model_path):
+    """Identifica un modelo por ruta, tamaño y fecha: si se reemplaza el fichero, cambia la clave."""
+    stat = os.stat(model_path)
+    key = f"{os.path.abspath(model_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+class PredictionCache:
+    """Propuestas por imagen en JSON, invalidadas si la imagen cambia en disco."""
+    def __init__(self, image_folder, cache_folder, model_path):
+        self.image_folder = image_folder
+        self.folder = os.path.join(cache_folder, "predictions", model_key(model_path))
+
+    def _path(self, rel_path):
+        return os.path.join(self.folder, hashlib.sha1(rel_path.encode('utf-8')).hexdigest() + ".json")
+
+    def _stamp(self, rel_path):
+        stat = os.stat(os.path.join(self.image_folder, rel_path))
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def load(self, rel_path):
+        """Devuelve la lista de propuestas [class_id, x_c, y_c, w, h, score] o None si no hay caché válida."""
+        try:
+            with open(self._path(rel_path), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            if entry["stamp"] != self._stamp(rel_path): return None
+            return entry["proposals"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def store(self, rel_path, proposals):
+        os.makedirs(self.folder, exist_ok=True)
+        atomic_write_text(self._path(rel_path), json.dumps({"stamp": self._stamp(rel_path), "proposals": proposals}))
+
+# --- Inferencia (se ejecuta en los procesos del pool) ---
+
+_worker = {}
+
+def init_worker(model_path, image_folder, cache_folder, threads, allocation_limit_mb):
+    # Los procesos "spawn" no heredan el límite de memoria de QImageReader de la aplicación
+    QImageReader.setAllocationLimit(allocation_limit_mb)
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+    model_input = session.get_inputs()[0]
+    batch, _, height, width = model_input.shape
+    _worker.update(
+        session=session, input_name=model_input.name,
+        # Los modelos exportados con tamaño de lote fijo sólo admiten una imagen por llamada
+        batchable=not isinstance(batch, int) or batch > 1,
+        input_size=(width if isinstance(width, int) else 640, height if isinstance(height, int) else 640),
+        cache=PredictionCache(image_folder, cache_folder, model_path))
+
+def _letterbox(image_path, input_size):
+    """Decodifica la imagen ya reducida al tamaño de entrada y la centra con relleno.
+
+    Como en el resto de la aplicación no se aplica la orientación EXIF: las propuestas
+    tienen que caer sobre la imagen tal como se muestra y se etiqueta."""
+    in_w, in_h = input_size
+    reader = QImageReader(image_path)
+    orig = reader.size()
+    if not orig.isValid(): return None
+    scale = min(in_w / orig.width(), in_h / orig.height())
+    new_w, new_h = max(1, round(orig.width() * scale)), max(1, round(orig.height() * scale))
+    reader.setScaledSize(QSize(new_w, new_h))
+    image = reader.read()
+    if image.isNull(): return None
+    image = image.convertToFormat(QImage.Format.Format_RGB888)
+    rows = np.frombuffer(image.constBits(), np.uint8, image.bytesPerLine() * new_h).reshape(new_h, image.bytesPerLine())
+    pad_x, pad_y = (in_w - new_w) // 2, (in_h - new_h) // 2
+    canvas = np.full((in_h, in_w, 3), PAD_VALUE, np.uint8)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = rows[:, :new_w * 3].reshape(new_h, new_w, 3)
+    tensor = canvas.transpose(2, 0, 1).astype(np.float32) / 255.0
+    return tensor, (scale, pad_x, pad_y, orig.width(), orig.height())
+
+def _nms(boxes, scores, iou_threshold):
+    order = scores.argsort()[::-1]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size and len(keep) < MAX_DETECTIONS:
+        i = order[0]
+        keep.append(i)
+        xx0 = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        yy0 = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        xx1 = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        yy1 = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        inter = np.clip(xx1 - xx0, 0, None) * np.clip(yy1 - yy0, 0, None)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    return keep
+
+def _decode_output(pred, geometry):
+    """Convierte la salida YOLOv8 (4 + clases, N) de una imagen en propuestas normalizadas."""
+    if pred.shape[0] > pred.shape[1]: pred = pred.T
+    scores_all = pred[4:]
+    class_ids = scores_all.argmax(axis=0)
+    scores = scores_all[class_ids, np.arange(pred.shape[1])]
+    mask = scores >= CONF_THRESHOLD
+    if not mask.any(): return []
+    x_c, y_c, w, h = pred[:4, mask]
+    class_ids, scores = class_ids[mask], scores[mask]
+    boxes = np.stack([x_c - w / 2, y_c - h / 2, x_c + w / 2, y_c + h / 2], axis=1)
+    # NMS por clase desplazando cada clase a una región disjunta
+    offsets = class_ids[:, None] * (boxes.max() + 1)
+    keep = _nms(boxes + offsets, scores, IOU_THRESHOLD)
+
+    scale, pad_x, pad_y, orig_w, orig_h = geometry
+    proposals = []
+    for i in keep:
+        x0, y0, x1, y1 = boxes[i].tolist()
+        x0 = min(max((x0 - pad_x) / scale, 0), orig_w)
+        x1 = min(max((x1 - pad_x) / scale, 0), orig_w)
+        y0 = min(max((y0 - pad_y) / scale, 0), orig_h)
+        y1 = min(max((y1 - pad_y) / scale, 0), orig_h)
+        if x1 - x0 < 1 or y1 - y0 < 1: continue
+        proposals.append([int(class_ids[i]), round((x0 + x1) / 2 / orig_w, 6), round((y0 + y1) / 2 / orig_h, 6),
+                          round((x1 - x0) / orig_w, 6), round((y1 - y0) / orig_h, 6), round(float(scores[i]), 3)])
+    return proposals
+
+def predict_batch(rel_paths):
+    """Ejecuta el modelo sobre un lote de imágenes, guarda cada resultado en caché y lo devuelve."""
+    session, cache = _worker["session"], _worker["cache"]
+    inputs, results = [], []
+    for rel_path in rel_paths:
+        prepared = _letterbox(os.path.join(cache.image_folder, rel_path), _worker["input_size"])
+        if prepared is None:
+            results.append((rel_path, []))
+        else:
+            inputs.append((rel_path, *prepared))
+    if _worker["batchable"]:
+        chunks = [inputs] if inputs else []
+    else:
+        chunks = [[item] for item in inputs]
+    for chunk in chunks:
+        outputs = session.run(None, {_worker["input_name"]: np.stack([tensor for _, tensor, _ in chunk])})[0]
+        for (rel_path, _, geometry), pred in zip(chunk, outputs):
+            proposals = _decode_output(pred, geometry)
+            cache.store(rel_path, proposals)
+            results.append((rel_path, proposals))
+    return results
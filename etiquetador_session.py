@@ -0,0 +1,229 @@
+"""Sesión compartida: varios etiquetadores trabajando a la vez sobre la misma carpeta.
+
+Una carpeta se comparte creando `.etiquetador/session/`; a partir de ahí cada
+instancia que la abre:
+
+* toma un lease sobre la imagen que está mostrando (un lock `fcntl` no bloqueante
+  sobre un fichero por imagen), de modo que los demás la ven como ocupada. El sistema
+  libera el lock si el proceso muere, así que no quedan leases huérfanos;
+* escribe cada fichero de etiquetas bajo un lock exclusivo y, si otro lo cambió desde
+  que lo leyó, fusiona ambas versiones (ver `merge_lines` en el núcleo);
+* reparte las imágenes en lotes consecutivos con `WorkQueue`.
+
+Los locks son de tipo POSIX (`lockf`), que también funcionan sobre NFS con lockd. En
+sistemas sin `fcntl` (Windows) `session_available()` devuelve False.
+"""
+import os
+import json
+import getpass
+import hashlib
+import socket
+
+from etiquetador_core import atomic_write_text
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SESSION_FOLDER_NAME = "session"
+DEFAULT_CHUNK_SIZE = 100
+
+def session_available():
+    return fcntl is not None
+
+def session_folder(cache_folder):
+    return os.path.join(cache_folder, SESSION_FOLDER_NAME)
+
+def is_shared(cache_folder):
+    return os.path.isdir(session_folder(cache_folder))
+
+def annotator_id():
+    """Identifica al etiquetador; es estable entre ejecuciones del mismo usuario y equipo."""
+    try:
+        user = getpass.getuser()
+    except (KeyError, OSError):
+        user = "anónimo"
+    return f"{user}@{socket.gethostname()}"
+
+def _lock_name(key):
+    return hashlib.sha1(key.encode('utf-8')).hexdigest() + ".lock"
+
+# --- Locks ---
+
+class FileLock:
+    """Lock exclusivo y bloqueante sobre un fichero, para secciones críticas cortas.
+
+    Si el sistema de ficheros no admite locks (p. ej. NFS sin lockd) se avisa una vez y
+    se continúa sin él: la fusión al guardar sigue evitando perder cambios salvo en
+    escrituras exactamente simultáneas.
+    """
+    _warned = False
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a+')
+        try:
+            fcntl.lockf(self._file, fcntl.LOCK_EX)
+        except OSError as e:
+            if not FileLock._warned:
+                print(f"No se pueden usar locks en '{os.path.dirname(self.path)}': {e}")
+                FileLock._warned = True
+        return self
+
+    def __exit__(self, *exc):
+        # Cerrar el fichero libera el lock
+        self._file.close()
+        self._file = None
+
+class ImageLeases:
+    """Leases por imagen mientras un etiquetador la tiene abierta.
+
+    Los locks POSIX son por proceso y se pierden al cerrar *cualquier* descriptor del
+    fichero, así que nunca se abre un segundo descriptor de un lease propio.
+    """
+    def __init__(self, folder, owner):
+        self.folder = os.path.join(folder, "leases")
+        self.owner = owner
+        self._held = {} # imagen -> fichero abierto con el lock
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, image_file):
+        return os.path.join(self.folder, _lock_name(image_file))
+
+    def acquire(self, image_file):
+        """Toma el lease de la imagen. Devuelve None si lo consigue o el dueño actual si no."""
+        if image_file in self._held: return None
+        f = open(self._path(image_file), 'a+')
+        try:
+            fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.seek(0)
+            holder = f.read().strip() or "otro etiquetador"
+            f.close()
+            return holder
+        f.seek(0)
+        f.truncate()
+        f.write(self.owner)
+        f.flush()
+        self._held[image_file] = f
+        return None
+
+    def holds(self, image_file):
+        return image_file in self._held
+
+    def release(self, image_file):
+        f = self._held.pop(image_file, None)
+        if f is not None:
+            f.truncate(0)
+            f.close()
+
+    def release_all(self):
+        for image_file in list(self._held):
+            self.release(image_file)
+
+class SharedSession:
+    """Punto de entrada del modo sesión para una carpeta compartida."""
+    def __init__(self, cache_folder, owner=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.folder = session_folder(cache_folder)
+        self.owner = owner or annotator_id()
+        self._locks_folder = os.path.join(self.folder, "locks")
+        os.makedirs(self._locks_folder, exist_ok=True)
+        self.leases = ImageLeases(self.folder, self.owner)
+        self.queue = WorkQueue(self, chunk_size)
+
+    def lock(self, key):
+        """Lock de escritura de un fichero compartido (una imagen o classes.csv)."""
+        return FileLock(os.path.join(self._locks_folder, _lock_name(key)))
+
+    def journal_path(self):
+        # Cada etiquetador tiene su propio historial para que no se mezclen ni se compacten entre sí
+        safe_owner = "".join(c if c.isalnum() or c in "@.-_" else "_" for c in self.owner)
+        return os.path.join(self.folder, f"journal-{safe_owner}.log")
+
+    def close(self):
+        self.leases.release_all()
+
+# --- Reparto de Trabajo ---
+
+class WorkQueue:
+    """Reparto de las imágenes en lotes consecutivos, guardado en `queue.json`.
+
+    Cada lote se identifica por su primera y última imagen, no por índices, para que
+    siga siendo válido si aparecen imágenes nuevas; éstas forman lotes nuevos al final.
+    Un lote abierto sigue asignado a su etiquetador hasta que éste pide el siguiente.
+    """
+    def __init__(self, session, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.session = session
+        self.chunk_size = chunk_size
+        self.path = os.path.join(session.folder, "queue.json")
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)["chunks"]
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Cola de trabajo ilegible, se recrea: {e}")
+            return []
+
+    def _save(self, chunks):
+        atomic_write_text(self.path, json.dumps({"chunks": chunks}, ensure_ascii=False, indent=1))
+
+    def _extend(self, chunks, image_files):
+        """Añade lotes para las imágenes posteriores al último lote conocido."""
+        position = {image_file: i for i, image_file in enumerate(image_files)}
+        start = 0
+        if chunks:
+            start = position.get(chunks[-1]["last"], len(image_files) - 1) + 1
+        for i in range(start, len(image_files), self.chunk_size):
+            chunks.append({"first": image_files[i], "last": image_files[min(i + self.chunk_size, len(image_files)) - 1],
+                           "owner": None, "status": "open"})
+        return position
+
+    @staticmethod
+    def _range(chunk, position):
+        """(inicio, fin exclusivo) del lote en la lista actual, o None si ya no existe."""
+        first, last = position.get(chunk["first"]), position.get(chunk["last"])
+        if first is None or last is None or last < first: return None
+        return first, last + 1
+
+    def current(self, image_files):
+        """Lote abierto de este etiquetador como (inicio, fin), o None."""
+        position = {image_file: i for i, image_file in enumerate(image_files)}
+        for chunk in self._load():
+            if chunk["owner"] == self.session.owner and chunk["status"] == "open":
+                span = self._range(chunk, position)
+                if span is not None: return span
+        return None
+
+    def claim(self, image_files):
+        """Cierra el lote abierto de este etiquetador y le asigna el siguiente libre.
+        Devuelve (inicio, fin) del nuevo lote o None si no quedan."""
+        with self.session.lock("queue.json"):
+            chunks = self._load()
+            position = self._extend(chunks, image_files)
+            for chunk in chunks:
+                if chunk["owner"] == self.session.owner and chunk["status"] == "open":
+                    chunk["status"] = "done"
+            claimed = None
+            for chunk in chunks:
+                if chunk["owner"] is None and chunk["status"] == "open":
+                    span = self._range(chunk, position)
+                    if span is None: continue
+                    chunk["owner"] = self.session.owner
+                    claimed = span
+                    break
+            self._save(chunks)
+        return claimed
+
+    def progress(self):
+        """(lotes terminados, lotes asignados en curso, lotes totales)."""
+        chunks = self._load()
+        done = sum(chunk["status"] == "done" for chunk in chunks)
+        assigned = sum(chunk["status"] == "open" and chunk["owner"] is not None for chunk in chunks)
+        return done, assigned, len(chunks)
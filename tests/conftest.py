@@ -0,0 +1,44 @@
+"""Entorno común de las pruebas: el proyecto en el path y Qt sin pantalla."""
+import os
+import sys
+import time
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope="session")
+def qapp():
+    from PySide6.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+@pytest.fixture
+def open_app(qapp, tmp_path, monkeypatch):
+    """Devuelve una función que abre `tmp_path` con unas imágenes de prueba en la ventana
+    principal. Los diálogos se anotan en `window.dialogs` en vez de mostrarse."""
+    from PySide6.QtGui import QImage, QColor
+    from PySide6.QtWidgets import QMessageBox
+    import etiquetador
+    dialogs, windows = [], []
+    for name in ("critical", "warning", "information"):
+        monkeypatch.setattr(QMessageBox, name, staticmethod(lambda *args, name=name: dialogs.append((name, args[2]))))
+
+    def open_folder(images=2, before_open=None):
+        for i in range(images):
+            image = QImage(64, 48, QImage.Format.Format_RGB32)
+            image.fill(QColor("gray"))
+            image.save(str(tmp_path / f"img{i}.png"))
+        if before_open is not None: before_open(tmp_path)
+        window = etiquetador.LabelingApp()
+        windows.append(window)
+        window.dialogs = dialogs
+        window.open_folder(str(tmp_path))
+        deadline = time.time() + 5
+        while window.folder_scanner is not None and time.time() < deadline:
+            qapp.processEvents()
+        return window
+
+    yield open_folder
+    for window in windows:
+        window.close()
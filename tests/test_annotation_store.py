@@ -0,0 +1,40 @@
+"""Orden de las cajas del AnnotationStore al deshacer y rehacer borrados."""
+from etiquetador_core import AnnotationStore, EditCommand, EditJournal
+
+LINES = [f"0 0.{i}5 0.5 0.01 0.01" for i in range(1, 9)]
+
+def _store(tmp_path, journal=None):
+    labels = tmp_path / "labels"
+    labels.mkdir(exist_ok=True)
+    (labels / "img.txt").write_text("".join(line + "\n" for line in LINES), encoding="utf-8")
+    return AnnotationStore(str(labels), journal=journal)
+
+def test_reinserted_box_gets_its_place_back_in_the_file(tmp_path):
+    store = _store(tmp_path)
+    removed = [store.remove_line("img.jpg", box_id) for box_id in (2, 5)]
+    records = store._records["img.jpg"]
+    store.insert_line("img.jpg", 5, removed[1])
+    store.insert_line("img.jpg", 2, removed[0])
+    # Reinsertar no reconstruye el diccionario; el orden se recupera al pedir las líneas
+    assert store._records["img.jpg"] is records
+    assert store.line("img.jpg", 2) == LINES[2]
+    assert store.box_count("img.jpg") == len(LINES)
+    assert store.lines("img.jpg") == LINES
+    assert list(store.records("img.jpg")) == list(range(len(LINES)))
+    assert store.flush() == []
+    assert (tmp_path / "labels" / "img.txt").read_text(encoding="utf-8").splitlines() == LINES
+
+def test_undo_redo_of_deletes_keeps_file_order(tmp_path):
+    journal = EditJournal(str(tmp_path / "journal.log"))
+    store = _store(tmp_path, journal)
+    for box_id in (6, 1, 3):
+        command = EditCommand("delete", "img.jpg", box_id, store.line("img.jpg", box_id), None)
+        command.apply(store)
+        journal.record(command)
+    for _ in range(3):
+        journal.undo(store, "img.jpg")
+    assert store.lines("img.jpg") == LINES
+    journal.redo(store, "img.jpg")
+    assert store.lines("img.jpg") == [line for i, line in enumerate(LINES) if i != 6]
+    store.flush()
+    assert (tmp_path / "labels" / "img.txt").read_text(encoding="utf-8").splitlines() == store.lines("img.jpg")
@@ -0,0 +1,40 @@
+"""Aceptar propuestas del modelo sobre imágenes que no se pueden editar."""
+from PySide6.QtCore import QRect
+
+from etiquetador_core import LABELS_FOLDER_NAME
+
+def _proposal(class_id, x_c):
+    source = [class_id, x_c, 0.5, 0.2, 0.2, 0.9]
+    return {'rect_pixels': QRect(10, 10, 12, 9), 'label': "persona 0.90", 'yolo_data': tuple(source[:5]), 'source': source}
+
+def test_accept_on_read_only_image_keeps_proposals(open_app, monkeypatch):
+    def unreadable_labels(folder):
+        (folder / LABELS_FOLDER_NAME).mkdir()
+        (folder / LABELS_FOLDER_NAME / "img0.txt").write_bytes(b"0 0.5 0.5 0.1 0.1\n\xff\n")
+    window = open_app(before_open=unreadable_labels)
+    discarded = []
+    monkeypatch.setattr(window.prelabel_queue, "discard", lambda image_file, source: discarded.append(source))
+    window.image_label.load_proposals([_proposal(0, 0.3), _proposal(0, 0.7)])
+    window.select_proposal(0)
+
+    assert not window.btn_accept_proposal.isEnabled()
+    assert not window.btn_accept_all_proposals.isEnabled()
+    assert window.btn_reject_proposal.isEnabled()
+    assert window.accept_proposal() is False
+    window.accept_all_proposals()
+    assert discarded == []
+    assert len(window.image_label.proposals) == 2
+    assert window.annotations.lines("img0.png") == []
+
+def test_accept_all_on_editable_image(open_app, monkeypatch):
+    window = open_app()
+    discarded = []
+    monkeypatch.setattr(window.prelabel_queue, "discard", lambda image_file, source: discarded.append(source))
+    window.image_label.load_proposals([_proposal(0, 0.3), _proposal(1, 0.7)])
+    window.update_button_states()
+
+    assert window.btn_accept_all_proposals.isEnabled()
+    window.accept_all_proposals()
+    assert len(discarded) == 2
+    assert window.image_label.proposals == []
+    assert [line.split()[0] for line in window.annotations.lines("img0.png")] == ["1", "0"]
@@ -0,0 +1,35 @@
+"""classes.csv en una carpeta compartida: recreación y cambios de otros etiquetadores."""
+import os
+
+import pytest
+
+from etiquetador_core import CACHE_FOLDER_NAME, CLASSES_FILE_NAME, read_classes
+import etiquetador_session as shared
+
+pytestmark = pytest.mark.skipif(not shared.session_available(), reason="el modo sesión necesita fcntl")
+
+@pytest.fixture
+def app(open_app):
+    window = open_app(before_open=lambda folder: os.makedirs(shared.session_folder(str(folder / CACHE_FOLDER_NAME))))
+    assert window.session is not None
+    return window
+
+def test_deleted_classes_file_is_recreated(app):
+    path = os.path.join(app.image_folder, CLASSES_FILE_NAME)
+    os.remove(path)
+    app.check_shared_changes()
+    assert app.dialogs == []
+    assert read_classes(path) == {0: "persona", 1: "pez"}
+    assert app.class_map == {0: "persona", 1: "pez"}
+    assert app.classes_stamp == app._classes_stamp()
+
+def test_save_does_not_overwrite_changes_from_others(app):
+    path = os.path.join(app.image_folder, CLASSES_FILE_NAME)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write("2,coche\n")
+    app.class_map = {**app.class_map, 3: "bici"}
+    assert app.save_classes() is False
+    assert read_classes(path) == {0: "persona", 1: "pez", 2: "coche"}
+    app.check_shared_changes()
+    assert app.class_map == {0: "persona", 1: "pez", 2: "coche"}
+    assert app.dialogs == []
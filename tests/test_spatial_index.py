@@ -0,0 +1,48 @@
+"""Índice espacial de cajas del lienzo: consultas, orden de dibujo y cajas fuera de la imagen."""
+import random
+
+from PySide6.QtCore import QRect, QSize
+
+from etiquetador import BoxSpatialIndex
+
+def _intersects(rect, x0, y0, x1, y1):
+    return rect.left() <= x1 and rect.left() + rect.width() >= x0 and rect.top() <= y1 and rect.top() + rect.height() >= y0
+
+def test_query_matches_brute_force_with_boxes_outside_the_image():
+    rng = random.Random(1)
+    index = BoxSpatialIndex()
+    index.reset(QSize(1000, 800))
+    live = {}
+    for box_id in range(3000):
+        if live and rng.random() < 0.3:
+            index.remove(live.pop(rng.choice(list(live)))[0])
+            continue
+        rect = QRect(rng.randrange(-300, 1100), rng.randrange(-300, 900), rng.randrange(1, 200), rng.randrange(1, 200))
+        live[box_id] = (index.insert(rect, box_id, box_id), rect)
+    for _ in range(500):
+        x0, y0 = rng.uniform(-600, 1200), rng.uniform(-600, 1000)
+        x1, y1 = x0 + rng.uniform(0, 300), y0 + rng.uniform(0, 300)
+        expected = sorted(box_id for box_id, (_, rect) in live.items() if _intersects(rect, x0, y0, x1, y1))
+        assert [index.items[slot] for slot in index.query(x0, y0, x1, y1)] == expected
+
+def test_huge_box_stays_within_the_grid_and_its_border():
+    index = BoxSpatialIndex()
+    index.reset(QSize(6000, 4000))
+    huge = index.insert(QRect(-60000, -40000, 120000, 80000), "enorme", 0)
+    nx, ny = index._grid_cells
+    assert len(index._grid) == (nx + 2) * (ny + 2)
+    assert index.query(3000, 2000, 3000, 2000) == [huge]
+    assert index.hit_test(-50000, 5) == huge
+    assert index.hit_test(-1e6, 5) == -1
+    index.remove(huge)
+    assert index._grid == {}
+
+def test_reused_slot_keeps_draw_order():
+    index = BoxSpatialIndex()
+    index.reset(QSize(100, 100))
+    first = index.insert(QRect(10, 10, 20, 20), "a", 0)
+    index.insert(QRect(10, 10, 20, 20), "b", 1)
+    index.remove(first)
+    index.insert(QRect(10, 10, 20, 20), "c", 2)
+    assert [index.items[slot] for slot in index.query(15, 15, 15, 15)] == ["b", "c"]
+    assert index.items[index.hit_test(15, 15)] == "c"
@@ -0,0 +1,48 @@
+"""Pirámide de tiles: imágenes por encima del límite de Qt y generación por bandas."""
+import os
+
+from PySide6.QtCore import QRect, QSize
+from PySide6.QtGui import QImage, QColor
+
+from etiquetador import TilePyramid, decode_image
+
+def _build_pyramid(qapp, image_path, cache_folder, level=0):
+    image_size = QImage(image_path).size()
+    pyramid = TilePyramid()
+    pyramid.cache_folder = str(cache_folder)
+    pyramid.set_source(image_path, image_size)
+    pyramid.tiles_for_rect(level, QRect(0, 0, 1, 1))
+    pyramid._pool.waitForDone()
+    qapp.processEvents()
+    return pyramid, os.path.join(str(cache_folder), "tiles", pyramid._key, str(level))
+
+def test_png_above_default_allocation_limit_decodes(qapp, tmp_path):
+    # 8300x8200 en RGB32 pasa de los 256 MB que Qt 6 admite por defecto
+    image = QImage(8300, 8200, QImage.Format.Format_RGB32)
+    image.fill(QColor("gray"))
+    path = str(tmp_path / "big.png")
+    assert image.save(path)
+    del image
+    preview, original_size = decode_image(path, QSize(800, 600))
+    assert not preview.isNull()
+    assert original_size == QSize(8300, 8200)
+
+def test_first_tile_generates_its_whole_band(qapp, tmp_path):
+    image = QImage(1300, 1100, QImage.Format.Format_RGB32)
+    image.fill(QColor("gray"))
+    path = str(tmp_path / "img.jpg")
+    assert image.save(path)
+    pyramid, tile_folder = _build_pyramid(qapp, path, tmp_path / "cache")
+    # Sólo se pidió el tile (0, 0), pero la banda de la primera fila queda entera en disco
+    assert sorted(os.listdir(tile_folder)) == ["0_0.png", "1_0.png", "2_0.png"]
+    assert QImage(os.path.join(tile_folder, "2_0.png")).size() == QSize(1300 - 1024, 512)
+    assert list(pyramid._tiles) == [(0, 0, 0)]
+
+def test_format_without_clip_support_generates_the_whole_level(qapp, tmp_path):
+    image = QImage(1300, 1100, QImage.Format.Format_RGB32)
+    image.fill(QColor("gray"))
+    path = str(tmp_path / "img.png")
+    assert image.save(path)
+    _, tile_folder = _build_pyramid(qapp, path, tmp_path / "cache", level=1)
+    assert sorted(os.listdir(tile_folder)) == ["0_0.png", "0_1.png", "1_0.png", "1_1.png"]
+    assert QImage(os.path.join(tile_folder, "1_1.png")).size() == QSize(650 - 512, 550 - 512)
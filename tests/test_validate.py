@@ -0,0 +1,37 @@
+"""Validación de líneas YOLO y su uso desde `etiquetador_cli.py validate`."""
+import os
+
+import pytest
+
+from etiquetador_core import LABELS_FOLDER_NAME, parse_yolo_line, validate_lines
+import etiquetador_cli
+
+VALID_LINE = "1 0.5 0.5 0.2 0.2"
+
+@pytest.mark.parametrize("line", [
+    "0 nan 0.5 0.1 0.1",
+    "0 0.5 NaN 0.1 0.1",
+    "0 0.5 0.5 inf 0.1",
+    "0 0.5 0.5 0.1 -inf",
+    "0 1e400 0.5 0.1 0.1",
+])
+def test_non_finite_coordinates_are_malformed(line):
+    assert parse_yolo_line(line) is None
+    issues, fixed = validate_lines([line, VALID_LINE], fix=True)
+    assert issues == [(1, "línea malformada")]
+    assert fixed == [VALID_LINE]
+
+def test_cli_validate_reports_and_fixes_non_finite(tmp_path, capsys):
+    (tmp_path / "img.jpg").write_bytes(b"")
+    labels = tmp_path / LABELS_FOLDER_NAME
+    labels.mkdir()
+    label_file = labels / "img.txt"
+    label_file.write_text(f"0 nan 0.5 0.1 0.1\n{VALID_LINE}\n0 0.5 0.5 inf 0.1\n", encoding="utf-8")
+
+    assert etiquetador_cli.main(["--workers", "1", "validate", str(tmp_path)]) == 1
+    out = capsys.readouterr().out
+    assert f"{os.path.join(LABELS_FOLDER_NAME, 'img.txt')}:1: línea malformada" in out
+    assert f"{os.path.join(LABELS_FOLDER_NAME, 'img.txt')}:3: línea malformada" in out
+
+    assert etiquetador_cli.main(["--workers", "1", "validate", str(tmp_path), "--fix"]) == 0
+    assert label_file.read_text(encoding="utf-8") == VALID_LINE + "\n"
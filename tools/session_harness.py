@@ -0,0 +1,161 @@
+"""Prueba de la sesión compartida con varios procesos etiquetando a la vez.
+
+Crea un dataset sintético en una carpeta temporal y lanza N etiquetadores simulados,
+cada uno en su propio proceso, que:
+
+1. toman lotes de la cola de trabajo hasta agotarla y añaden cajas a sus imágenes;
+2. se disputan el lease de una misma imagen, comprobando que nunca lo tienen dos a la vez;
+3. añaden cajas a la vez a unas pocas imágenes compartidas sin lease, forzando fusiones.
+
+Al final comprueba que los lotes no se solapan y cubren todas las imágenes, que ningún
+lease se concedió dos veces y que no se perdió ni se corrompió ninguna línea.
+
+    python tools/session_harness.py [--workers 6] [--images 300] [--rounds 40] [--keep]
+
+La carpeta temporal se borra al terminar salvo que haya fallos o se pase `--keep`.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from etiquetador_core import (
+    LABELS_FOLDER_NAME, CACHE_FOLDER_NAME, AnnotationStore, format_yolo_line, parse_yolo_line
+)
+import etiquetador_session as shared
+
+HOT_IMAGES = 3
+
+def _line(worker, n):
+    # La clase codifica al etiquetador y la coordenada x el número de caja: cada línea es única
+    return format_yolo_line(worker, 0.001 + n * 1e-5, 0.5, 0.01, 0.01)
+
+def _annotator(folder, worker, image_files, rounds, chunk_size, barrier, results):
+    cache_folder = os.path.join(folder, CACHE_FOLDER_NAME)
+    session = shared.SharedSession(cache_folder, owner=f"etiquetador{worker}", chunk_size=chunk_size)
+    labels_folder = os.path.join(folder, LABELS_FOLDER_NAME)
+    rng = random.Random(worker)
+    report = {"claimed": [], "written": [], "lease_violations": 0, "leases_won": 0}
+
+    # 1. Lotes de la cola de trabajo
+    barrier.wait()
+    store = AnnotationStore(labels_folder, lock=session.lock)
+    n = 0
+    while True:
+        span = session.queue.claim(image_files)
+        if span is None: break
+        report["claimed"].append(span)
+        for image_file in image_files[span[0]:span[1]]:
+            if session.leases.acquire(image_file) is not None:
+                report["lease_violations"] += 1
+            store.insert_line(image_file, store.new_box_id(image_file), _line(worker, n))
+            report["written"].append((image_file, _line(worker, n)))
+            n += 1
+            session.leases.release(image_file)
+        store.flush()
+
+    # 2. Exclusividad de los leases sobre una misma imagen
+    barrier.wait()
+    marker = os.path.join(folder, "lease_holder")
+    for _ in range(rounds):
+        if session.leases.acquire("disputada.jpg") is None:
+            report["leases_won"] += 1
+            if os.path.exists(marker): report["lease_violations"] += 1
+            open(marker, 'w').close()
+            time.sleep(rng.uniform(0, 0.002))
+            os.remove(marker)
+            session.leases.release("disputada.jpg")
+        time.sleep(rng.uniform(0, 0.001))
+
+    # 3. Escrituras simultáneas sobre las mismas imágenes, sin lease: cada guardado
+    # puede encontrarse el fichero cambiado por otro y tiene que fusionar
+    barrier.wait()
+    store = AnnotationStore(labels_folder, lock=session.lock)
+    hot_images = [f"compartida{i}.jpg" for i in range(HOT_IMAGES)]
+    for _ in range(rounds):
+        image_file = rng.choice(hot_images)
+        store.insert_line(image_file, store.new_box_id(image_file), _line(worker, n))
+        report["written"].append((image_file, _line(worker, n)))
+        n += 1
+        if rng.random() < 0.5:
+            errors = store.flush()
+            if errors: report.setdefault("errors", []).extend(str(e) for _, e in errors)
+    store.flush()
+    session.close()
+    results.put((worker, report))
+
+def run(workers, images, rounds, chunk_size, keep=False):
+    folder = tempfile.mkdtemp(prefix="etiquetador_sesion_")
+    os.makedirs(os.path.join(folder, LABELS_FOLDER_NAME))
+    os.makedirs(shared.session_folder(os.path.join(folder, CACHE_FOLDER_NAME)))
+    image_files = [f"img{i:05d}.jpg" for i in range(images)]
+
+    context = multiprocessing.get_context("spawn")
+    barrier, results = context.Barrier(workers), context.Queue()
+    processes = [context.Process(target=_annotator, args=(folder, worker, image_files, rounds, chunk_size, barrier, results))
+                 for worker in range(workers)]
+    start = time.perf_counter()
+    for process in processes: process.start()
+    reports = dict(results.get() for _ in processes)
+    for process in processes: process.join()
+    elapsed = time.perf_counter() - start
+
+    failures = []
+    covered = sorted(index for report in reports.values() for span in report["claimed"] for index in range(*span))
+    if covered != list(range(images)):
+        failures.append(f"los lotes cubren {len(covered)} posiciones ({len(set(covered))} distintas) de {images} imágenes")
+    violations = sum(report["lease_violations"] for report in reports.values())
+    if violations:
+        failures.append(f"{violations} leases concedidos a dos etiquetadores a la vez")
+    for report in reports.values():
+        failures.extend(f"error de escritura: {e}" for e in report.get("errors", []))
+
+    store = AnnotationStore(os.path.join(folder, LABELS_FOLDER_NAME))
+    expected = {}
+    for report in reports.values():
+        for image_file, line in report["written"]:
+            expected.setdefault(image_file, []).append(line)
+    lost = duplicated = corrupt = 0
+    for image_file, lines in expected.items():
+        on_disk = store.lines(image_file)
+        corrupt += sum(parse_yolo_line(line) is None for line in on_disk)
+        lost += len(set(lines) - set(on_disk))
+        duplicated += len(on_disk) - len(set(on_disk))
+    if lost: failures.append(f"{lost} cajas perdidas")
+    if duplicated: failures.append(f"{duplicated} cajas duplicadas")
+    if corrupt: failures.append(f"{corrupt} líneas corruptas")
+
+    writes = sum(len(report["written"]) for report in reports.values())
+    leases = sum(report["leases_won"] for report in reports.values())
+    print(f"{workers} etiquetadores, {images} imágenes, {writes} cajas escritas, {leases} leases disputados en {elapsed:.1f} s")
+    for failure in failures:
+        print(f"FALLO: {failure}")
+    if not failures:
+        print("OK: lotes disjuntos y completos, leases exclusivos, ninguna caja perdida")
+    if failures or keep:
+        print(f"Datos en {folder}")
+    else:
+        shutil.rmtree(folder, ignore_errors=True)
+    return 1 if failures else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba multiproceso del modo de sesión compartida.")
+    parser.add_argument("--workers", type=int, default=6)
+    parser.add_argument("--images", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=40)
+    parser.add_argument("--chunk-size", type=int, default=25)
+    parser.add_argument("--keep", action="store_true", help="conserva la carpeta temporal aunque no haya fallos")
+    args = parser.parse_args(argv)
+    if not shared.session_available():
+        print("El modo de sesión necesita 'fcntl' (Linux/macOS).")
+        return 2
+    return run(args.workers, args.images, args.rounds, args.chunk_size, args.keep)
+
+if __name__ == '__main__':
+    sys.exit(main())